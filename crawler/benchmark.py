@@ -0,0 +1,395 @@
+"""
+Crawler benchmark against a synthetic web graph served from localhost.
+
+Builds a reproducible site graph (many hosts, each a server on its own
+127.0.0.1 port, with per-host templates, cross-host links, exact and near
+duplicate pages, robots.txt rules and binary files), serves it with
+injected latency, runs crawler/core/main.py against it in a subprocess and
+reports:
+
+- pages/sec: HTML pages fetched per second of wall time
+- CPU per page: user + system CPU time of the crawler processes per page
+- peak RSS: the largest resident set of any crawler process
+- dedup accuracy: duplicate copies correctly skipped (recall) and skipped
+  pages that really were duplicates (precision)
+- coverage, robots.txt violations and repeated fetches of the same URL
+
+Usage:
+    python crawler/benchmark.py [--hosts 20 --pages 50 ...] [-- crawler options]
+    python crawler/benchmark.py --json results.json
+    python crawler/benchmark.py --baseline results.json --tolerance 0.1
+
+With --baseline the run fails (exit code 1) when pages/sec drops, or CPU per
+page or peak RSS rises, by more than the tolerance, or when dedup accuracy
+or coverage gets worse.
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.page_store import PageStore, STORE_DIRNAME
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'core', 'main.py')
+
+# Paths every host's robots.txt disallows; pages link into them
+DISALLOWED_PREFIX = '/private/'
+
+
+class SyntheticSite:
+    """
+    The site graph. Page n of host h is /p<n>.html on that host; its text
+    is drawn from a Zipf-distributed vocabulary, wrapped in the host's
+    navigation and footer template. A share of pages are exact copies or
+    near copies (a few words changed) of an earlier page; group[page] is
+    the page whose text it carries, which is the ground truth for dedup.
+    """
+
+    def __init__(self, hosts=20, pages=50, links=8, cross_host=0.2, words=300, duplicates=0.1,
+                 near_duplicates=0.1, binaries=0.1, seed=1):
+        self.hosts = hosts
+        self.pages = pages
+        rng = random.Random(seed)
+        vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyzæøå') for _ in range(rng.randint(3, 10)))
+                      for _ in range(20000)]
+        weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+
+        self.templates = []
+        for host in range(hosts):
+            nav = [rng.randrange(pages) for _ in range(10)]
+            footer = ' '.join(rng.choices(vocabulary, weights, k=60))
+            self.templates.append((nav, footer))
+
+        self.text = {}
+        self.links = {}
+        self.group = {}
+        all_pages = [(host, n) for host in range(hosts) for n in range(pages)]
+        for i, page in enumerate(all_pages):
+            host, n = page
+            roll = rng.random()
+            if i and roll < duplicates:
+                original = self.group[all_pages[rng.randrange(i)]]
+                self.text[page] = self.text[original]
+                self.group[page] = original
+            elif i and roll < duplicates + near_duplicates:
+                original = self.group[all_pages[rng.randrange(i)]]
+                text = self.text[original].split()
+                for j in rng.sample(range(len(text)), max(1, len(text) // 40)):
+                    text[j] = rng.choice(vocabulary)
+                self.text[page] = ' '.join(text)
+                self.group[page] = original
+            else:
+                self.text[page] = ' '.join(rng.choices(vocabulary, weights, k=words))
+                self.group[page] = page
+
+            targets = []
+            for _ in range(links):
+                target_host = rng.randrange(hosts) if rng.random() < cross_host else host
+                targets.append((target_host, rng.randrange(pages)))
+            extras = [DISALLOWED_PREFIX + f'p{n}.html']
+            if rng.random() < binaries:
+                extras += [f'/files/{n}.pdf', f'/download/{n}']
+            self.links[page] = (targets, extras)
+
+    def reachable(self, start=(0, 0)):
+        """Pages reachable from the seed page by following links"""
+        seen = {start}
+        queue = deque([start])
+        while queue:
+            page = queue.popleft()
+            nav = [(page[0], n) for n in self.templates[page[0]][0]]
+            for target in self.links[page][0] + nav:
+                if target not in seen:
+                    seen.add(target)
+                    queue.append(target)
+        return seen
+
+    def render(self, page, base_urls):
+        host, n = page
+        nav, footer = self.templates[host]
+        targets, extras = self.links[page]
+        nav_html = ''.join(f'<li><a href="/p{m}.html">Section {m}</a></li>' for m in nav)
+        links_html = ''.join(f'<a href="{base_urls[h]}/p{m}.html">more</a> ' for h, m in targets)
+        links_html += ''.join(f'<a href="{path}">file</a> ' for path in extras)
+        return (f'<!DOCTYPE html><html><head><title>Host {host} page {n}</title></head><body>'
+                f'<nav><ul>{nav_html}</ul></nav><main><h1>Page {n}</h1><p>{self.text[page]}</p>'
+                f'<p>{links_html}</p></main><footer>{footer}</footer></body></html>').encode('utf-8')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The crawler closing a keep-alive connection is not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class SiteServer:
+    """Serves every host of a SyntheticSite on its own 127.0.0.1 port and counts what was requested"""
+
+    def __init__(self, site, latency=0.02, jitter=0.01, seed=1):
+        self.site = site
+        self.latency = latency
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.fetched = {}  # page -> number of HTML GETs
+        self.robots_violations = 0
+        self.binary_requests = 0
+        self.servers = []
+        for host in range(site.hosts):
+            self.servers.append(_Server(('127.0.0.1', 0), self._handler(host)))
+        self.base_urls = [f'http://127.0.0.1:{server.server_address[1]}' for server in self.servers]
+
+    def _handler(self, host):
+        owner = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                owner.respond(self, host)
+
+            def do_HEAD(self):
+                owner.respond(self, host)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def respond(self, request, host):
+        with self.lock:
+            delay = self.latency + self.rng.uniform(0, self.jitter)
+        time.sleep(delay)
+        path = request.path.split('?')[0]
+        content_type = 'text/html; charset=utf-8'
+        if path == '/robots.txt':
+            body, content_type = f'User-agent: *\nDisallow: {DISALLOWED_PREFIX}\n'.encode(), 'text/plain'
+        elif path.startswith(DISALLOWED_PREFIX):
+            with self.lock:
+                self.robots_violations += 1
+            body = b'<html><body>private</body></html>'
+        elif path.startswith('/files/') or path.startswith('/download/'):
+            with self.lock:
+                self.binary_requests += 1
+            body, content_type = os.urandom(64 * 1024), 'application/octet-stream'
+        elif path.startswith('/p') and path.endswith('.html') and path[2:-5].isdigit() \
+                and int(path[2:-5]) < self.site.pages:
+            page = (host, int(path[2:-5]))
+            if request.command == 'GET':
+                with self.lock:
+                    self.fetched[page] = self.fetched.get(page, 0) + 1
+            body = self.site.render(page, self.base_urls)
+        else:
+            request.send_error(404)
+            return
+        request.send_response(200)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        if request.command == 'GET':
+            request.wfile.write(body)
+
+    def start(self):
+        for server in self.servers:
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def page_for_url(self, url):
+        """(host, n) of a page URL of this site, or None"""
+        for host, base in enumerate(self.base_urls):
+            if url.startswith(base + '/p') and url.endswith('.html'):
+                return host, int(url[len(base) + 2:-5])
+        return None
+
+
+def saved_urls(data_dir):
+    """URLs of all pages in the page stores under data_dir (one per node in a distributed crawl)"""
+    urls = []
+    for root, dirs, files in os.walk(data_dir):
+        if os.path.basename(root) == STORE_DIRNAME and 'store.json' in files:
+            store = PageStore(root)
+            try:
+                urls.extend(store.get_meta(doc_id)['url'] for doc_id in range(store.first_doc_id, store.next_doc_id()))
+            finally:
+                store.close()
+    return urls
+
+
+def dedup_accuracy(site, fetched, saved):
+    """
+    Compare the pages the crawler skipped with the ground truth. A fetched
+    page that was not saved was skipped as a duplicate; that was right if
+    another page of its duplicate group was saved. Every group should end
+    up with exactly one saved page, so each further copy that was fetched
+    should have been skipped.
+    """
+    saved_groups = {}
+    for page in saved:
+        saved_groups[site.group[page]] = saved_groups.get(site.group[page], 0) + 1
+    skipped = [page for page in fetched if page not in saved]
+    correct = sum(1 for page in skipped if saved_groups.get(site.group[page]))
+    fetched_groups = {}
+    for page in fetched:
+        fetched_groups[site.group[page]] = fetched_groups.get(site.group[page], 0) + 1
+    copies = sum(count - 1 for count in fetched_groups.values())
+    return {
+        'duplicates_fetched': copies,
+        'duplicates_skipped': correct,
+        'unique_pages_skipped': len(skipped) - correct,
+        'dedup_recall': correct / copies if copies else 1.0,
+        'dedup_precision': correct / len(skipped) if skipped else 1.0,
+    }
+
+
+def run(args, crawler_args):
+    site = SyntheticSite(hosts=args.hosts, pages=args.pages, links=args.links, cross_host=args.cross_host,
+                         words=args.words, duplicates=args.duplicates, near_duplicates=args.near_duplicates,
+                         binaries=args.binaries, seed=args.seed)
+    server = SiteServer(site, latency=args.latency, jitter=args.jitter, seed=args.seed)
+    server.start()
+    work_dir = tempfile.mkdtemp(prefix='crawler-benchmark-')
+    data_dir = os.path.join(work_dir, 'data')
+    command = [sys.executable, MAIN, '--data-dir', data_dir, '--seed', server.base_urls[0] + '/p0.html',
+               '--crawl-delay', str(args.crawl_delay), '--exit-when-done', '--log-level', 'WARNING'] + crawler_args
+    print(f"Serving {site.hosts} hosts x {site.pages} pages; running: {' '.join(command[1:])}", file=sys.stderr)
+
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(command, cwd=work_dir, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                timeout=args.timeout)
+        elapsed = time.perf_counter() - start
+        after = resource.getrusage(resource.RUSAGE_CHILDREN)
+        if result.returncode != 0:
+            sys.stderr.write(result.stderr.decode('utf-8', 'replace')[-4000:])
+            raise SystemExit(f"Crawler exited with code {result.returncode}")
+        saved = [page for page in map(server.page_for_url, saved_urls(data_dir)) if page is not None]
+    finally:
+        server.stop()
+        if args.keep:
+            print(f"Crawl data kept in {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    fetched = set(server.fetched)
+    pages = len(fetched)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = after.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    reachable = site.reachable()
+    report = {
+        'pages': pages,
+        'seconds': round(elapsed, 3),
+        'pages_per_sec': round(pages / elapsed, 2),
+        'cpu_ms_per_page': round(cpu / pages * 1000, 3) if pages else None,
+        'peak_rss_mb': round(peak_rss / 1e6, 1),
+        'coverage': round(len(fetched & reachable) / len(reachable), 4),
+        'repeated_fetches': sum(server.fetched.values()) - pages,
+        'robots_violations': server.robots_violations,
+        'binary_requests': server.binary_requests,
+        'pages_saved': len(saved),
+    }
+    report.update({key: round(value, 4) if isinstance(value, float) else value
+                   for key, value in dedup_accuracy(site, fetched, set(saved)).items()})
+    report['config'] = {key: value for key, value in vars(args).items()
+                        if key not in ('json', 'baseline', 'tolerance', 'keep')}
+    report['config']['crawler_args'] = crawler_args
+    return report
+
+
+# metric -> direction that is better, used by --baseline
+_GATES = {
+    'pages_per_sec': 'higher',
+    'cpu_ms_per_page': 'lower',
+    'peak_rss_mb': 'lower',
+    'dedup_recall': 'higher',
+    'dedup_precision': 'higher',
+    'coverage': 'higher',
+}
+
+
+def compare(report, baseline, tolerance):
+    """Print each gated metric next to the baseline; returns the regressions"""
+    regressions = []
+    for key, better in _GATES.items():
+        old, new = baseline.get(key), report.get(key)
+        if old is None or new is None:
+            continue
+        change = (new - old) / old if old else 0.0
+        # Throughput and resource figures are noisy; accuracy and coverage must not drop at all
+        allowed = tolerance if key in ('pages_per_sec', 'cpu_ms_per_page', 'peak_rss_mb') else 0.0
+        worse = change < -allowed if better == 'higher' else change > allowed
+        print(f"  {key:18} {old:>10} -> {new:<10} ({change:+.1%}){'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the crawler against a synthetic local web graph. '
+                                                 'Options after -- are passed to the crawler.')
+    parser.add_argument('--hosts', type=int, default=20, help='Number of hosts (one local port each)')
+    parser.add_argument('--pages', type=int, default=50, help='Pages per host')
+    parser.add_argument('--links', type=int, default=8, help='Content links per page (plus navigation)')
+    parser.add_argument('--cross-host', type=float, default=0.2, help='Share of links that point to another host')
+    parser.add_argument('--words', type=int, default=300, help='Words of unique text per page')
+    parser.add_argument('--duplicates', type=float, default=0.1, help='Share of pages that are exact copies')
+    parser.add_argument('--near-duplicates', type=float, default=0.1,
+                        help='Share of pages that are copies with 2.5%% of the words changed')
+    parser.add_argument('--binaries', type=float, default=0.1, help='Share of pages that link to binary files')
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.01, help='Up to this many random seconds more')
+    parser.add_argument('--crawl-delay', type=float, default=0.0, help="Passed to the crawler's --crawl-delay")
+    parser.add_argument('--seed', type=int, default=1, help='Random seed of the site graph')
+    parser.add_argument('--timeout', type=float, default=1800, help='Give up on the crawl after this many seconds')
+    parser.add_argument('--keep', action='store_true', help='Keep the crawl data directory')
+    parser.add_argument('--json', default=None, help='Write the results to this file')
+    parser.add_argument('--baseline', default=None, help='Results file of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Allowed relative regression of pages/sec, CPU per page and peak RSS')
+    argv = sys.argv[1:]
+    crawler_args = []
+    if '--' in argv:
+        crawler_args = argv[argv.index('--') + 1:]
+        argv = argv[:argv.index('--')]
+    args = parser.parse_args(argv)
+
+    report = run(args, crawler_args)
+    for key, value in report.items():
+        if key != 'config':
+            print(f"{key:22} {value}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print("Warning: the baseline was run with a different configuration", file=sys.stderr)
+        print(f"Compared with {args.baseline}:")
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
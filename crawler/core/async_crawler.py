@@ -0,0 +1,210 @@
+"""
+Asyncio crawl engine.
+
+Fetches many pages concurrently with httpx while reusing the page handling
+from main.py (URL filtering, robots.txt, dedup, saving and link extraction),
+which main.py passes in as should_skip_url, process_page and can_fetch.
+"""
+import asyncio
+import logging
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+from utils import helper_functions as hf
+from utils import http_session
+from utils import metrics
+
+
+class AsyncCrawler:
+    """
+    Keeps up to `concurrency` requests in flight, at most
+    `per_host_concurrency` of them against any single host.
+
+    URLs still come from hf.grab_next_url, so the per-host crawl delay is
+    enforced by the scheduler exactly as in the synchronous loop. Parsing,
+    dedup and saving run on one background thread so they never block the
+    event loop and never race with each other. Frontier and scheduler calls
+    (SQLite transactions that may wait on other workers' locks) run on
+    another one, which also keeps the scheduler's heap single-threaded.
+    """
+
+    def __init__(self, should_skip_url, process_page, can_fetch, concurrency=50, per_host_concurrency=2,
+                 timeout=10, max_pages=None, exit_when_done=False, http2=False):
+        self.should_skip_url = should_skip_url
+        self.process_page = process_page
+        self.can_fetch = can_fetch
+        self.concurrency = concurrency
+        self.per_host_concurrency = per_host_concurrency
+        self.timeout = timeout
+        self.max_pages = max_pages
+        self.exit_when_done = exit_when_done
+        self.http2 = http2
+        self.dispatched = 0
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='page-processor')
+        self.frontier_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='frontier')
+
+    async def _frontier(self, func, *args):
+        """Run a frontier/scheduler call off the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(self.frontier_executor, func, *args)
+
+    async def crawl(self):
+        self.slots = asyncio.Semaphore(self.concurrency)
+        self.host_slots = {}
+        self.host_users = Counter()  # tasks holding or waiting for each host's slot
+        in_flight = set()
+
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=self.timeout, follow_redirects=True,
+                                     http2=self.http2) as client:
+            logging.info(f"Starting async crawl (concurrency={self.concurrency}, "
+                         f"per host={self.per_host_concurrency}, http2={self.http2})")
+
+            while (self.max_pages is None or self.dispatched < self.max_pages) and not hf.stop_requested():
+                await self.slots.acquire()
+                url = await self._frontier(hf.grab_next_url)
+
+                if url is None:
+                    self.slots.release()
+                    if self.exit_when_done and not in_flight and await self._frontier(hf.nothing_to_crawl):
+                        logging.info("Queue is empty, stopping async crawl")
+                        break
+                    wait = await self._frontier(hf.get_scheduler().seconds_until_ready)
+                    wait = 0.5 if wait is None else min(max(wait, 0.01), 0.5)
+                    if in_flight:
+                        # A finishing page may queue new URLs, so wake up for that too
+                        await asyncio.wait(in_flight, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                    else:
+                        await asyncio.sleep(wait)
+                    continue
+
+                self.dispatched += 1
+                metrics.urls_processed.inc()
+                if self.dispatched % 100 == 0:
+                    http_session.stats.log_summary()
+                task = asyncio.ensure_future(self._crawl_url(client, url))
+                in_flight.add(task)
+                task.add_done_callback(in_flight.discard)
+
+            if in_flight:
+                await asyncio.gather(*in_flight)
+
+        self.executor.shutdown()
+        self.frontier_executor.shutdown()
+        http_session.stats.log_summary()
+        metrics.log_summary()
+        logging.info(f"Async crawl finished: {self.dispatched} URLs processed")
+
+    async def _crawl_url(self, client, url):
+        try:
+            await self._crawl(client, url)
+        except httpx.TimeoutException:
+            metrics.errors.inc('timeout')
+            logging.error("Timeout crawling %s", url)
+        except httpx.TransportError as e:
+            metrics.errors.inc('connection')
+            logging.error("Connection error crawling %s: %s", url, e)
+        except httpx.HTTPError as e:
+            metrics.errors.inc('request')
+            logging.error("Request error crawling %s: %s", url, e)
+        except Exception as e:
+            metrics.errors.inc('other')
+            logging.error("Unexpected error crawling %s: %s", url, e)
+        finally:
+            self.slots.release()
+
+        # Failed URLs count as crawled too; only a cancelled fetch keeps its lease (released at shutdown)
+        await self._frontier(hf.finish_url, url)
+
+    async def _crawl(self, client, url):
+        logging.info("Processing URL: %s", url)
+        if self.should_skip_url(url):
+            return
+
+        loop = asyncio.get_running_loop()
+        # Usually answered from the robots cache; otherwise waits for a prefetch thread
+        if not await loop.run_in_executor(None, self.can_fetch, url):
+            metrics.fetches.inc('robots_disallowed')
+            return
+
+        state = await self._frontier(hf.get_page_state, url)
+        host = urlparse(url).netloc
+        host_slot = self.host_slots.setdefault(host, asyncio.Semaphore(self.per_host_concurrency))
+        self.host_users[host] += 1
+        try:
+            async with host_slot:
+                with metrics.stage_seconds.time('fetch'):
+                    content, headers = await self._fetch(client, url, state)
+        finally:
+            # Idle hosts give their slot back, so the dict only holds hosts being fetched
+            self.host_users[host] -= 1
+            if not self.host_users[host]:
+                del self.host_users[host]
+                del self.host_slots[host]
+        if content is http_session.NOT_MODIFIED:
+            metrics.fetches.inc('not_modified')
+            await self._frontier(hf.record_visit, url, headers, None)
+            logging.info("Not modified since the last visit: %s", url)
+            return
+        if content is None:
+            metrics.fetches.inc('skipped')
+            return
+
+        metrics.fetches.inc('ok')
+        links = await loop.run_in_executor(self.executor, self.process_page, url, content, headers)
+        with metrics.stage_seconds.time('enqueue'):
+            await self._frontier(hf.save_new_urls, links)
+
+    async def _fetch(self, client, url, state=None):
+        """Stream a URL, returning (body, headers), (NOT_MODIFIED, headers) or (None, None) (see main.fetch_page)"""
+        logging.debug("Making HTTP request to: %s", url)
+        host = urlparse(url).hostname
+        max_size = http_session.MAX_BODY_SIZE
+        headers = http_session.conditional_headers(state)
+        http_session.stats.record_request(host)
+
+        async with client.stream('GET', url, headers=headers,
+                                 extensions={'trace': http_session.httpx_trace_hook(host)}) as response:
+            if response.status_code == 304 and headers:
+                return http_session.NOT_MODIFIED, response.headers
+            if not http_session.accept_headers(url, response.status_code, response.headers, max_size):
+                return None, None
+
+            body = bytearray()
+            async for chunk in response.aiter_bytes(http_session.CHUNK_SIZE):
+                body += chunk
+                if len(body) > max_size:
+                    logging.warning("Skipping %s: body exceeds %s bytes", url, max_size)
+                    return None, None
+
+        logging.debug("Successfully fetched %s (%s bytes)", url, len(body))
+        metrics.bytes_downloaded.inc(amount=len(body))
+        return bytes(body), response.headers
+
+
+def run(should_skip_url, process_page, can_fetch, concurrency=50, per_host_concurrency=2, max_pages=None,
+        exit_when_done=False, http2=False):
+    """Run the async crawler until interrupted, the queue drains (exit_when_done) or max_pages is reached"""
+    if httpx is None:
+        logging.error("Async mode requires httpx: pip install httpx")
+        return
+
+    if http2:
+        try:
+            import h2  # noqa: F401
+        except ImportError:
+            logging.warning("HTTP/2 requires the h2 package (pip install httpx[http2]), using HTTP/1.1")
+            http2 = False
+
+    crawler = AsyncCrawler(should_skip_url, process_page, can_fetch,
+                           concurrency=concurrency, per_host_concurrency=per_host_concurrency,
+                           max_pages=max_pages, exit_when_done=exit_when_done, http2=http2)
+    try:
+        asyncio.run(crawler.crawl())
+    except KeyboardInterrupt:
+        logging.info("Crawler stopped immediately")
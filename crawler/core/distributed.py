@@ -0,0 +1,206 @@
+"""
+Distributed crawling.
+
+The crawl is split across N nodes by host: node i crawls the hosts that
+hash to it (router.node_for) with its own frontier, page store and dedup
+index in <data-dir>/node-i, and forwards the URLs it discovers for other
+nodes' hosts to them in batches (see utils.router). Nodes and the
+coordinator exchange messages over a transport (see utils.transport): a
+spool directory, which also works across machines on a shared file system,
+or Unix sockets. Near-duplicates are only detected among the pages of one
+node, so the same page served under hosts owned by different nodes is
+saved by each of them.
+
+The coordinator hands out the seed URLs, collects the nodes' status
+reports and logs the progress of the whole crawl, and stops the nodes on
+Ctrl+C or, with --exit-when-done, once every node is idle and no batch is
+in transit. It starts the nodes as local processes and restarts a node
+that crashed; with launch=False it only coordinates nodes started
+elsewhere (main.py --node I on each machine).
+"""
+import json
+import time
+import logging
+import multiprocessing
+from urllib.parse import urlparse
+
+from utils import helper_functions as hf
+from utils.router import node_for, node_name, COORDINATOR, ACK_TIMEOUT
+from utils.transport import open_transport
+
+# Seconds between two progress lines in the coordinator's log
+PROGRESS_INTERVAL = 10
+
+# Seconds between two rounds of message exchange and process checks
+CHECK_INTERVAL = 0.5
+
+
+class Coordinator:
+    """
+    Sends messages to nodes (retrying while a node is not reachable yet)
+    and keeps the latest status report of each node. URL batches (the
+    seeds) are numbered and sent again until the node acknowledges them,
+    like the nodes' batches (see router.Router).
+
+    done() uses the counting method of termination detection: the crawl
+    has ended when every node is idle and every node has received the last
+    batch each sender sent it, and both still hold in a second round of
+    reports that all arrived after the first. A batch in transit shows up
+    as a difference between the numbers, and a node that got one in
+    between the two rounds has changed its numbers. Nodes keep the numbers
+    in their frontier, so a restarted node reports where it left off.
+    """
+
+    def __init__(self, transport, count):
+        self.transport = transport
+        self.count = count
+        self.channel = f"{COORDINATOR}:{time.time_ns()}"
+        self.statuses = {}
+        self.outbox = []  # (destination, message) not delivered yet
+        self.sent = {}  # node name -> number of the last URL batch sent to it
+        self.unacked = {}  # (node name, batch number) -> [message, time sent or 0]
+        self.snapshot = None
+        self.snapshot_time = 0
+
+    def send(self, dest, message):
+        self.outbox.append((dest, message))
+        self._deliver()
+
+    def _deliver(self):
+        undelivered = []
+        for dest, message in self.outbox:
+            if not self.transport.send(dest, message):
+                undelivered.append((dest, message))
+        self.outbox = undelivered
+
+        now = time.time()
+        for batch in self.unacked.values():
+            message, sent_at = batch
+            if now - sent_at >= ACK_TIMEOUT and self.transport.send(node_name(message['node']), message):
+                batch[1] = now
+
+    def send_urls(self, urls):
+        """Send URLs (the seeds) to the nodes that own their hosts"""
+        batches = {}
+        for url in urls:
+            batches.setdefault(node_for(urlparse(url).netloc, self.count), []).append(url)
+        for node, batch in sorted(batches.items()):
+            dest = node_name(node)
+            seq = self.sent[dest] = self.sent.get(dest, 0) + 1
+            message = {'type': 'urls', 'from': COORDINATOR, 'channel': self.channel, 'seq': seq,
+                       'node': node, 'urls': batch}
+            self.unacked[(dest, seq)] = [message, 0]
+        self._deliver()
+
+    def stop_nodes(self):
+        for index in range(self.count):
+            self.send(node_name(index), {'type': 'stop'})
+
+    def poll(self):
+        """Retry undelivered messages and collect acknowledgements and status reports"""
+        self._deliver()
+        for message in self.transport.receive():
+            if message.get('type') == 'status':
+                self.statuses[message['node']] = message
+            elif message.get('type') == 'ack':
+                for key in [key for key in self.unacked if key[0] == message['from'] and key[1] <= message['seq']]:
+                    del self.unacked[key]
+
+    def delivered(self):
+        return not self.outbox
+
+    def done(self):
+        """True once all nodes are idle and no URLs are in transit (see the class docstring)"""
+        statuses = [self.statuses.get(index) for index in range(self.count)]
+        if None in statuses or not self.delivered():
+            return False
+        senders = [(self.channel, self.sent)] + [(status['channel'], status['sent']) for status in statuses]
+        balanced = all(sent.get(node_name(index), 0) == status['received'].get(channel, 0)
+                       for channel, sent in senders for index, status in enumerate(statuses))
+        if not balanced or not all(status['idle'] for status in statuses):
+            self.snapshot = None
+            return False
+        counts = json.dumps([[status['sent'], status['received']] for status in statuses], sort_keys=True)
+        if self.snapshot != counts:
+            self.snapshot = counts
+            self.snapshot_time = time.time()
+            return False
+        return all(status['time'] > self.snapshot_time for status in statuses)
+
+    def log_progress(self):
+        processed = sum(status.get('processed', 0) for status in self.statuses.values())
+        saved = sum(status.get('saved', 0) for status in self.statuses.values())
+        queued = sum(status.get('queued', 0) for status in self.statuses.values())
+        idle = sum(1 for status in self.statuses.values() if status['idle'])
+        logging.info(f"Cluster: {len(self.statuses)}/{self.count} nodes reporting ({idle} idle), "
+                     f"{processed} URLs processed, {saved} pages saved, {queued} queued")
+
+
+def run(target, count, options, transport_spec, seeds=(), launch=True, exit_when_done=False):
+    """
+    Coordinate a crawl across `count` nodes. With launch, node `index` is
+    started as a local process running target(index, count, options).
+    Returns once all nodes have stopped (or, with launch=False, once the
+    stop requests are delivered).
+    """
+    transport = open_transport(transport_spec, COORDINATOR)
+    coordinator = Coordinator(transport, count)
+    context = multiprocessing.get_context('spawn')
+    processes = {}
+
+    def start(index):
+        process = context.Process(target=target, args=(index, count, options), name=f'crawler-node-{index}')
+        process.start()
+        processes[index] = process
+        logging.info(f"Started node {index} (pid {process.pid})")
+
+    if launch:
+        for index in range(count):
+            start(index)
+    coordinator.send_urls(seeds)
+
+    stopping = False
+    next_progress = time.time() + PROGRESS_INTERVAL
+    try:
+        while True:
+            coordinator.poll()
+            if not stopping and hf.stop_requested():
+                stopping = True
+                logging.info(f"Stopping {count} nodes")
+                coordinator.stop_nodes()
+            elif not stopping and exit_when_done and coordinator.done():
+                stopping = True
+                logging.info("All nodes are idle and no URLs are in transit, stopping the crawl")
+                coordinator.stop_nodes()
+
+            for index in [i for i, p in processes.items() if not p.is_alive()]:
+                process = processes.pop(index)
+                process.join()
+                if process.exitcode != 0 and not stopping:
+                    logging.warning(f"Node {index} (pid {process.pid}) exited with code {process.exitcode}, "
+                                    f"restarting it")
+                    start(index)
+                else:
+                    logging.info(f"Node {index} (pid {process.pid}) finished")
+
+            # Local nodes also finish on their own, e.g. after --max-pages
+            if launch and not processes:
+                break
+            if not launch and stopping and coordinator.delivered():
+                break
+            if time.time() >= next_progress:
+                next_progress = time.time() + PROGRESS_INTERVAL
+                coordinator.log_progress()
+            time.sleep(CHECK_INTERVAL)
+    except KeyboardInterrupt:
+        # A second signal: local nodes get a SIGTERM, which makes them stop immediately
+        logging.info("Stopping nodes immediately")
+        for process in processes.values():
+            process.terminate()
+        for process in processes.values():
+            process.join()
+    finally:
+        coordinator.log_progress()
+        transport.close()
+
+    logging.info(f"All {count} nodes stopped")
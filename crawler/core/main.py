@@ -1,230 +1,462 @@
 from urllib.parse import urljoin, urlparse
-from urllib.robotparser import RobotFileParser
 import requests
-from bs4 import BeautifulSoup as bs
-from urllib.parse import urlparse, urljoin
-from urllib.robotparser import RobotFileParser
 import sys
 import os
 import time
 import logging
-import json
+import signal
+import argparse
 
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
-from logging_config import setup_logging
+from logging_config import setup_logging, RATE_LIMITED
 
-# Set up logging - change log_level to 'DEBUG' for more detailed output
-logger = setup_logging(log_level='DEBUG', log_to_file=True, log_directory='logs')
-
-# Cache robot parsers per domain
-robot_parsers = {}
+logger = logging.getLogger()
 
 from utils import helper_functions as hf 
+from utils import http_session
+from utils import html_parser
+from utils import metrics
+from utils import page_store
+from utils.canonical import canonicalize
 
 
-def can_fetch(url, user_agent='*'):
-    """Check if we're allowed to crawl this URL according to robots.txt"""
-    parsed = urlparse(url)
-    domain = f"{parsed.scheme}://{parsed.netloc}"
-
-    # Get or create parser for this domain
-    if domain not in robot_parsers:
-        rp = RobotFileParser()
-        robots_url = urljoin(domain, '/robots.txt')
-        rp.set_url(robots_url)
-        try:
-            logging.debug(f"Reading robots.txt for domain: {domain}")
-            # Fetch robots.txt with timeout using requests
-            response = requests.get(robots_url, timeout=2)
-            if response.status_code == 200:
-                rp.parse(response.text.splitlines())
-                robot_parsers[domain] = rp
-                logging.debug(f"Successfully loaded robots.txt for {domain}")
-            else:
-                logging.debug(f"robots.txt returned {response.status_code} for {domain}, assuming crawl allowed")
-                robot_parsers[domain] = None
-        except requests.exceptions.Timeout:
-            logging.warning(f"Timeout reading robots.txt for {domain} (2s), assuming crawl allowed")
-            robot_parsers[domain] = None
-        except Exception as e:
-            # If we can't read robots.txt, assume we can crawl
-            logging.warning(f"Could not read robots.txt for {domain}: {e}")
-            robot_parsers[domain] = None
-
-    parser = robot_parsers[domain]
-    if parser is None:
-        return True
-
-    can_crawl = parser.can_fetch(user_agent, url)
-    if not can_crawl:
-        logging.info(f"Robots.txt disallows crawling: {url}")
-    return can_crawl
+def can_fetch(url):
+    """Check if we're allowed to crawl this URL according to robots.txt (waits for an uncached robots.txt)"""
+    return hf.get_robots_cache().can_fetch(url, timeout=10)
 
 
+def link_allowed(url):
+    """
+    robots.txt check for discovered links. Only cached rules are consulted;
+    links to hosts whose robots.txt is not cached yet are kept (can_fetch
+    checks them before they are fetched) and the robots.txt is prefetched
+    in the background.
+    """
+    return hf.get_robots_cache().lookup(url) is not False
 
 
-# Startup checks and initialization
-logging.info("=== Web Crawler Starting ===")
+# Skip binary/non-HTML file extensions
+SKIP_EXTENSIONS = ['.pdf', '.jpg', '.jpeg', '.png', '.gif', '.zip', '.mp4',
+                   '.mp3', '.avi', '.exe', '.doc', '.docx', '.xls', '.xlsx',
+                   '.ppt', '.pptx', '.rar', '.tar', '.gz', '.ico', '.svg', '.webp']
 
-# Check if required data files exist
 data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'raw')
 processed_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'data', 'processed')
-to_crawl_file = os.path.join(data_dir, 'to_crawl.txt')
-crawled_file = os.path.join(data_dir, 'crawled.txt')
-
-if not os.path.exists(data_dir):
-    logging.error(f"Data directory does not exist: {data_dir}")
-    sys.exit(1)
-
-if not os.path.exists(processed_dir):
-    os.makedirs(processed_dir, exist_ok=True)
-
-if not os.path.exists(to_crawl_file):
-    logging.warning(f"To crawl file does not exist: {to_crawl_file}")
-    logging.info("Creating empty to_crawl.txt file")
-    with open(to_crawl_file, 'w') as f:
-        pass
-
-if not os.path.exists(crawled_file):
-    logging.info("Creating empty crawled.txt file")
-    with open(crawled_file, 'w') as f:
-        pass
-
-# Log initial queue status
-try:
-    with open(to_crawl_file, 'r', encoding='utf-8', errors='replace') as f:
-        initial_queue_size = len([line for line in f if line.strip()])
-    logging.info(f"Starting with {initial_queue_size} URLs in queue")
-except Exception as e:
-    logging.error(f"Could not read initial queue size: {e}")
-    initial_queue_size = 0
-
-if initial_queue_size == 0:
-    logging.warning("No URLs in queue to start crawling!")
-
-logging.info("Starting crawler main loop")
-
-def save_page_json(url, soup, processed_dir):
-    """Save page content as JSON"""
+
+
+def save_page_json(url, title, content, processed_dir, html=None):
+    """Save page content (and, if the store keeps it, the raw HTML) as a record in the page store; returns success"""
     page_data = {
         'url': url,
-        'title': soup.title.string if soup.title and soup.title.string else '',
-        'content': soup.get_text(separator=' ', strip=True)
+        'title': title,
+        'content': content
     }
 
-    # Simple filename from URL
-    filename = f"page_{len(os.listdir(processed_dir)) + 1}.json"
-    filepath = os.path.join(processed_dir, filename)
-
     try:
-        with open(filepath, 'w', encoding='utf-8') as f:
-            json.dump(page_data, f, indent=2)
-        logging.info(f"Saved page content to {filename}")
+        with metrics.stage_seconds.time('save'):
+            doc_id = hf.get_page_store(processed_dir).append(page_data, html=html)
+        metrics.pages_saved.inc()
+        logging.info("Saved page content as document %s", doc_id)
+        return True
     except Exception as e:
         logging.error(f"Failed to save page data: {e}")
+        return False
 
-# TODO: Consider implementing proper priority queue instead of simple FIFO
-# TODO: Add configurable crawl delays per domain
-# TODO: Implement proper shutdown handling (e.g., SIGINT handling)
 
-while True:
+def should_skip_url(url):
+    """Return True for URLs we never fetch (non-HTTP schemes and binary files)"""
+    parsed = urlparse(url)
+    if parsed.scheme not in ['http', 'https']:
+        logging.warning("Skipping invalid URL scheme: %s", url)
+        return True
+
+    path_lower = parsed.path.lower()
+    if any(path_lower.endswith(ext) for ext in SKIP_EXTENSIONS):
+        logging.debug("Skipping binary file: %s", url)
+        return True
+    return False
+
+
+def extract_links(url, page):
+    """Return the canonical HTTP(S) links on a page that robots.txt allows us to crawl"""
+    links = []
+    logging.debug("Found %s link elements", len(page.links))
+
+    for href in page.links:
+        absolute_url = canonicalize(urljoin(url, href))
+        parsed = urlparse(absolute_url)
+        # Only add valid HTTP/HTTPS URLs that robots.txt allows
+        if parsed.scheme in ['http', 'https'] and link_allowed(absolute_url):
+            links.append(absolute_url)
+
+    logging.debug("Extracted %s valid links from %s", len(links), url)
+    return links
+
+
+def find_canonical_url(url, page):
+    """Return the canonical form of the page's <link rel="canonical"> target, or of url itself"""
+    href = page.canonical
+    if href:
+        canonical = canonicalize(urljoin(url, href.strip()))
+        if urlparse(canonical).scheme in ['http', 'https']:
+            return canonical
+    return url
+
+
+def process_page(url, content, headers=None):
+    """Parse a fetched HTML page, save it unless it is a duplicate or unchanged, and return its links"""
+    with metrics.stage_seconds.time('parse'):
+        page = html_parser.parse_html(content)
+
+    visit = hf.record_visit(url, headers, page.text)
+    if visit == 'unchanged':
+        metrics.fetches.inc('unchanged')
+        logging.info("Content unchanged since the last visit: %s", url)
+        return []
+
+    # A page that names another URL as canonical is stored under that URL,
+    # and skipped if that URL was crawled already - unless this is a revisit
+    # that found the page changed (an earlier visit claimed the canonical URL)
+    canonical_url = find_canonical_url(url, page)
+    claimed = canonical_url == url or hf.claim_url(canonical_url)
+    if not claimed and visit != 'changed':
+        logging.info("Skipping save of %s: canonical URL %s already crawled", url, canonical_url)
+    # Save the page's main content unless it is a near-duplicate
+    else:
+        with metrics.stage_seconds.time('boilerplate'):
+            text = hf.main_content(url, page)
+        # A changed page found on a revisit is always saved: it would match its own old version
+        if visit == 'changed' or hf.should_save(text, processed_dir):
+            if save_page_json(canonical_url, page.title, text, processed_dir, html=content):
+                hf.record_saved(text, processed_dir)
+
+    # Extract links for further crawling
+    with metrics.stage_seconds.time('links'):
+        return extract_links(url, page)
+
+
+def fetch_page(url, state=None):
+    """
+    Fetch a URL, returning (body, headers) for a 200 HTML response,
+    (http_session.NOT_MODIFIED, headers) when a revisit (state from
+    hf.get_page_state) gets a 304, or (None, None).
+
+    The body is streamed, so a non-HTML response is dropped as soon as its
+    headers arrive and a body larger than http_session.MAX_BODY_SIZE is
+    abandoned part way instead of being held in memory.
+    """
+    logging.debug("Making HTTP request to: %s", url)
+    max_size = http_session.MAX_BODY_SIZE
+    headers = http_session.conditional_headers(state)
+
+    with http_session.get_session().get(url, timeout=10, stream=True, headers=headers) as response:
+        if response.status_code == 304 and headers:
+            return http_session.NOT_MODIFIED, response.headers
+        if not http_session.accept_headers(url, response.status_code, response.headers, max_size):
+            return None, None
+
+        body = bytearray()
+        for chunk in response.iter_content(chunk_size=http_session.CHUNK_SIZE):
+            body += chunk
+            if len(body) > max_size:
+                logging.warning("Skipping %s: body exceeds %s bytes", url, max_size)
+                return None, None
+
+    logging.debug("Successfully fetched %s (%s bytes)", url, len(body))
+    metrics.bytes_downloaded.inc(amount=len(body))
+    return bytes(body), response.headers
+
+
+def startup():
+    """Startup checks and initialization"""
+    logging.info("=== Web Crawler Starting ===")
+
+    # Check if required data files exist
+    if not os.path.exists(data_dir):
+        logging.error(f"Data directory does not exist: {data_dir}")
+        sys.exit(1)
+
+    if not os.path.exists(processed_dir):
+        os.makedirs(processed_dir, exist_ok=True)
+
+    # Log initial queue status (the frontier imports to_crawl.txt/crawled.txt on first start;
+    # after a clean shutdown the size comes from the checkpoint instead of a table scan)
     try:
-        url = hf.grab_next_url()
-
-        if url is None:
-            # Wait a bit before checking again if no URLs available
-            logging.debug("No URLs available for crawling, waiting...")
-            time.sleep(0.5)
-            continue
-
-        logging.info(f"Processing URL: {url}")
-
-        # Skip invalid URLs
-        parsed = urlparse(url)
-        if parsed.scheme not in ['http', 'https']:
-            logging.warning(f"Skipping invalid URL scheme: {url}")
-            continue
-
-        # Skip binary/non-HTML file extensions
-        skip_extensions = ['.pdf', '.jpg', '.jpeg', '.png', '.gif', '.zip', '.mp4', 
-                          '.mp3', '.avi', '.exe', '.doc', '.docx', '.xls', '.xlsx', 
-                          '.ppt', '.pptx', '.rar', '.tar', '.gz', '.ico', '.svg', '.webp']
-        path_lower = parsed.path.lower()
-        if any(path_lower.endswith(ext) for ext in skip_extensions):
-            logging.debug(f"Skipping binary file: {url}")
-            continue
+        initial_queue_size = hf.resume()
+        logging.info(f"Starting with {initial_queue_size} URLs in queue")
+    except Exception as e:
+        logging.error(f"Could not read initial queue size: {e}")
+        initial_queue_size = 0
+
+    if initial_queue_size == 0:
+        logging.warning("No URLs in queue to start crawling!")
+
+
+def crawl_url(url):
+    """Fetch and process one URL handed out by the scheduler"""
+    if should_skip_url(url):
+        return
+
+    if not can_fetch(url):
+        metrics.fetches.inc('robots_disallowed')
+        return
+
+    with metrics.stage_seconds.time('fetch'):
+        content, headers = fetch_page(url, hf.get_page_state(url))
+    if content is http_session.NOT_MODIFIED:
+        metrics.fetches.inc('not_modified')
+        hf.record_visit(url, headers, None)
+        logging.info("Not modified since the last visit: %s", url)
+        return
+    if content is None:
+        metrics.fetches.inc('skipped')
+        return
+
+    metrics.fetches.inc('ok')
+    links = process_page(url, content, headers)
+    with metrics.stage_seconds.time('enqueue'):
+        hf.save_new_urls(links)
+
 
+def crawl_loop(max_pages=None, exit_when_done=False):
+    """Fetch one page at a time until stopped, the queue drains (exit_when_done) or max_pages is reached"""
+    logging.info("Starting crawler main loop")
+    processed = 0
+
+    while (max_pages is None or processed < max_pages) and not hf.stop_requested():
         try:
-            logging.debug(f"Making HTTP request to: {url}")
-            # Use HEAD request first to check Content-Type
-            try:
-                head_response = requests.head(url, timeout=2, allow_redirects=True)
-                content_type = head_response.headers.get('Content-Type', '').lower()
-                
-                # Skip if not HTML content
-                if content_type and 'text/html' not in content_type:
-                    logging.debug(f"Skipping non-HTML content ({content_type}): {url}")
-                    continue
-            except:
-                # If HEAD fails, proceed with GET (some servers don't support HEAD)
-                pass
-            
-            raw_html = requests.get(url, timeout=10)
-
-            if raw_html.status_code != 200:
-                logging.warning(f"HTTP {raw_html.status_code} for {url}")
+            url = hf.grab_next_url()
+
+            if url is None:
+                if exit_when_done and hf.nothing_to_crawl():
+                    logging.info("Queue is empty, stopping crawler")
+                    break
+                # Wait until the next host is allowed again (at most 0.5s)
+                logging.debug("No URLs available for crawling, waiting...", extra=RATE_LIMITED)
+                wait = hf.get_scheduler().seconds_until_ready()
+                time.sleep(0.5 if wait is None else min(wait, 0.5))
                 continue
 
-            # Double-check content type after GET
-            content_type = raw_html.headers.get('Content-Type', '').lower()
-            if 'text/html' not in content_type:
-                logging.debug(f"Skipping non-HTML response ({content_type}): {url}")
-                continue
+            processed += 1
+            metrics.urls_processed.inc()
+            logging.info("Processing URL: %s", url)
+            if processed % 100 == 0:
+                http_session.stats.log_summary()
 
-            logging.debug(f"Successfully fetched {url} ({len(raw_html.content)} bytes)")
-
-            parsed_html = bs(raw_html.content, 'html.parser')
-
-            # Save page content as JSON
-            if hf.should_save(parsed_html.get_text(separator=' ', strip=True),processed_dir):
-                save_page_json(url, parsed_html, processed_dir)
-
-            # Extract links for further crawling
-            links = []
-            link_elements = parsed_html.find_all('a')
-            logging.debug(f"Found {len(link_elements)} link elements")
-
-            for link in link_elements:
-                href = link.get('href')
-                if href:
-                    absolute_url = urljoin(url, href)
-                    parsed = urlparse(absolute_url)
-                    # Only add valid HTTP/HTTPS URLs that robots.txt allows
-                    if parsed.scheme in ['http', 'https'] and can_fetch(absolute_url):
-                        links.append(absolute_url)
-
-            logging.info(f"Extracted {len(links)} valid links from {url}")
-            hf.save_new_urls(links)
-
-        except requests.exceptions.Timeout:
-            logging.error(f"Timeout crawling {url}")
-            continue
-        except requests.exceptions.ConnectionError:
-            logging.error(f"Connection error crawling {url}")
-            continue
-        except requests.exceptions.RequestException as e:
-            logging.error(f"Request error crawling {url}: {e}")
-            continue
+            try:
+                crawl_url(url)
+            except requests.exceptions.Timeout:
+                metrics.errors.inc('timeout')
+                logging.error("Timeout crawling %s", url)
+            except requests.exceptions.ConnectionError:
+                metrics.errors.inc('connection')
+                logging.error("Connection error crawling %s", url)
+            except requests.exceptions.RequestException as e:
+                metrics.errors.inc('request')
+                logging.error("Request error crawling %s: %s", url, e)
+            except Exception as e:
+                metrics.errors.inc('other')
+                logging.error("Unexpected error crawling %s: %s", url, e)
+
+            # Failed URLs count as crawled too; only an interrupted fetch keeps its lease
+            hf.finish_url(url)
+
+        except KeyboardInterrupt:
+            logging.info("Crawler stopped immediately")
+            break
         except Exception as e:
-            logging.error(f"Unexpected error crawling {url}: {e}")
-            continue
+            logging.error(f"Critical error in main loop: {e}")
+            logging.info("Continuing crawler after error...")
+            time.sleep(1)  # Brief pause before continuing
+
+    http_session.stats.log_summary()
+    metrics.log_summary()
+
+
+def configure(args, log_name='crawler'):
+    """Apply command line options to this process (the main process or a worker)"""
+    global data_dir, processed_dir
+    if args.data_dir:
+        data_dir = os.path.join(args.data_dir, 'raw')
+        processed_dir = os.path.join(args.data_dir, 'processed')
+        os.makedirs(data_dir, exist_ok=True)
+        hf.set_data_dir(data_dir)
+
+    global logger
+    # Set up logging - use --log-level DEBUG for more detailed output
+    logger = setup_logging(log_level=args.log_level, log_to_file=True, log_directory='logs', log_name=log_name,
+                           use_queue=not args.sync_logging)
+
+    hf.CRAWL_DELAY = args.crawl_delay
+    http_session.POOL_MAXSIZE = args.pool_size
+    http_session.MAX_BODY_SIZE = args.max_body_size
+    hf.PAGE_COMPRESSION = args.compression
+    hf.RECRAWL = args.recrawl
+    hf.STRIP_BOILERPLATE = not args.keep_boilerplate
+    html_parser.PARSER = args.parser
+
+
+def crawl(args, metrics_port=None):
+    hf.register_metrics()
+    if metrics_port:
+        metrics.start_server(metrics_port)
+    metrics.start_summary_logging()
+
+    if args.use_async:
+        from core import async_crawler
+        async_crawler.run(should_skip_url, process_page, can_fetch,
+                          concurrency=args.concurrency,
+                          per_host_concurrency=args.per_host_concurrency,
+                          http2=args.http2,
+                          max_pages=args.max_pages,
+                          exit_when_done=args.exit_when_done)
+    else:
+        crawl_loop(max_pages=args.max_pages, exit_when_done=args.exit_when_done)
+
+
+def run_worker(index, count, args):
+    """Entry point of worker process `index` of `count` (see core.workers)"""
+    configure(args, log_name=f'crawler_worker{index}')
+    # Ctrl+C reaches the whole process group; the supervisor turns it into a SIGTERM for each worker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    hf.install_signal_handlers([signal.SIGTERM])
+    hf.WORKER_SHARD = (index, count)
+    if args.max_pages is not None:
+        args.max_pages = args.max_pages // count + (1 if index < args.max_pages % count else 0)
+    try:
+        crawl(args, args.metrics_port + index if args.metrics_port else None)
+    finally:
+        # The supervisor checkpoints once all workers are done
+        hf.shutdown(checkpoint=False)
+
+
+def run_coordinator(args):
+    """Coordinate a distributed crawl (see core.distributed)"""
+    from core import distributed
+    setup_logging(log_level=args.log_level, log_to_file=True, log_directory='logs', log_name='crawler_coordinator',
+                  use_queue=not args.sync_logging)
+    hf.install_signal_handlers()
+    logging.info(f"=== Distributed crawl: {args.nodes} nodes over {args.transport} ===")
+    seeds = [canonicalize(seed.strip()) for seed in args.seed if seed.strip()]
+    distributed.run(run_node, args.nodes, args, args.transport, seeds=seeds,
+                    launch=not args.external_nodes, exit_when_done=args.exit_when_done)
+
+
+def run_node(index, count, args, launched=True):
+    """
+    Entry point of node `index` of `count` in a distributed crawl (see
+    core.distributed); launched means the coordinator started this process.
+    """
+    args.data_dir = os.path.join(args.data_dir or os.path.dirname(data_dir), f'node-{index}')
+    configure(args, log_name=f'crawler_node{index}')
+    if launched:
+        # Ctrl+C reaches the whole process group; the coordinator turns it into a stop request for each node
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        hf.install_signal_handlers([signal.SIGTERM])
+    else:
+        hf.install_signal_handlers()
+    hf.NODE_SHARD = (index, count)
+    hf.TRANSPORT = args.transport
+    if args.max_pages is not None:
+        args.max_pages = args.max_pages // count + (1 if index < args.max_pages % count else 0)
+    startup()
+    try:
+        if not launched and args.seed:
+            hf.save_new_urls(args.seed)
+        crawl(args, args.metrics_port + index if args.metrics_port else None)
+    finally:
+        hf.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Web crawler')
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='Fetch pages concurrently with asyncio (requires httpx)')
+    parser.add_argument('--concurrency', type=int, default=50,
+                        help='Maximum number of in-flight requests in async mode')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of crawler processes sharing the frontier')
+    parser.add_argument('--nodes', type=int, default=None,
+                        help='Split the crawl by host across this many nodes, each with its own state in '
+                             'DATA_DIR/node-N, and coordinate them (starts the nodes locally unless --external-nodes)')
+    parser.add_argument('--node', type=int, default=None,
+                        help='Run only node NODE of --nodes (e.g. one per machine, next to a coordinator '
+                             'started with --external-nodes)')
+    parser.add_argument('--external-nodes', action='store_true',
+                        help='Coordinate nodes started elsewhere with --node instead of starting them')
+    parser.add_argument('--transport', default=None,
+                        help='How nodes exchange URLs: spool:DIRECTORY or socket:DIRECTORY '
+                             '(default: spool:DATA_DIR/spool)')
+    parser.add_argument('--per-host-concurrency', type=int, default=2,
+                        help='Maximum number of in-flight requests per host in async mode')
+    parser.add_argument('--http2', action='store_true',
+                        help='Multiplex async requests over HTTP/2 where servers support it (requires h2)')
+    parser.add_argument('--pool-size', type=int, default=http_session.POOL_MAXSIZE,
+                        help='Keep-alive connections kept per host')
+    parser.add_argument('--max-body-size', type=int, default=http_session.MAX_BODY_SIZE,
+                        help='Abandon responses whose body is larger than this many bytes')
+    parser.add_argument('--compression', choices=page_store.COMPRESSIONS, default=hf.PAGE_COMPRESSION,
+                        help='Compression used when a new page store is created '
+                             '(default: zstd-dict if zstandard is installed, else gzip)')
+    parser.add_argument('--keep-boilerplate', action='store_true',
+                        help="Save and dedup pages' full text instead of stripping text their site repeats on every page")
+    parser.add_argument('--parser', choices=html_parser.available_parsers(), default=None,
+                        help='HTML parser backend (default: the fastest one installed)')
+    parser.add_argument('--crawl-delay', type=float, default=hf.CRAWL_DELAY,
+                        help='Default seconds between requests to the same host')
+    parser.add_argument('--seed', action='append', default=[],
+                        help='URL to add to the queue before crawling (can be repeated)')
+    parser.add_argument('--recrawl', action='store_true',
+                        help='Also revisit crawled pages when their adaptive revisit interval has passed')
+    parser.add_argument('--max-pages', type=int, default=None,
+                        help='Stop after processing this many URLs')
+    parser.add_argument('--exit-when-done', action='store_true',
+                        help='Stop once the queue is empty instead of waiting for new URLs')
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics '
+                             '(worker N of --workers uses PORT+N)')
+    parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help='Log level for the console and the log file')
+    parser.add_argument('--sync-logging', action='store_true',
+                        help='Write log records from the crawling thread instead of a background thread')
+    parser.add_argument('--data-dir', default=None,
+                        help='Data directory containing raw/ and processed/ (default: repository data/)')
+    args = parser.parse_args()
+
+    if args.nodes is not None:
+        if args.workers > 1:
+            parser.error('--workers cannot be combined with --nodes')
+        if args.node is not None and not 0 <= args.node < args.nodes:
+            parser.error('--node must be between 0 and --nodes - 1')
+        if args.transport is None:
+            args.transport = 'spool:' + os.path.join(args.data_dir or os.path.dirname(data_dir), 'spool')
+        if args.node is not None:
+            run_node(args.node, args.nodes, args, launched=False)
+            return
+        run_coordinator(args)
+        return
+    elif args.node is not None:
+        parser.error('--node needs --nodes')
+
+    configure(args)
+    hf.install_signal_handlers()
+    startup()
+    if args.seed:
+        hf.save_new_urls(args.seed)
 
-    except KeyboardInterrupt:
-        logging.info("Crawler stopped by user (Ctrl+C)")
-        break
-    except Exception as e:
-        logging.error(f"Critical error in main loop: {e}")
-        logging.info("Continuing crawler after error...")
-        time.sleep(1)  # Brief pause before continuing
+    try:
+        if args.workers > 1:
+            from core import workers
+            # Create the shared dedup index and page store once, before the workers start
+            hf.get_dedup_index(processed_dir)
+            workers.run(run_worker, args.workers, args)
+        else:
+            crawl(args, args.metrics_port)
+    finally:
+        hf.shutdown()
+
+
+if __name__ == '__main__':
+    main()
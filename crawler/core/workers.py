@@ -0,0 +1,70 @@
+"""
+Multi-process crawling.
+
+Starts N worker processes that each run the normal crawl loop (fetch,
+parse, dedup, save, extract) against the shared frontier database, and
+watches them: when a worker exits, the URLs it had leased go back to the
+queue, and a worker that crashed is started again. SIGINT/SIGTERM to the
+supervisor is passed on to the workers as SIGTERM, so they finish their
+pages in flight and save their state.
+"""
+import time
+import logging
+import multiprocessing
+
+from utils import helper_functions as hf
+from utils.frontier import lease_owner
+
+
+def run(target, count, options, restart=True):
+    """
+    Run target(index, count, options) in `count` processes until they all
+    exit normally (or Ctrl+C). Worker `index` crawls the hosts of shard
+    index of count, see HostScheduler.
+    """
+    # Workers open their own SQLite connections and files, so never fork with ours open
+    context = multiprocessing.get_context('spawn')
+    frontier = hf.get_frontier()
+    processes = {}
+
+    def start(index):
+        process = context.Process(target=target, args=(index, count, options), name=f'crawler-worker-{index}')
+        process.start()
+        processes[index] = process
+        logging.info(f"Started worker {index} (pid {process.pid})")
+
+    def reap(index):
+        process = processes.pop(index)
+        process.join()
+        released = frontier.release_leases(lease_owner(process.pid))
+        if process.exitcode != 0:
+            logging.warning(f"Worker {index} (pid {process.pid}) exited with code {process.exitcode}, "
+                            f"returned {released} leased URLs to the queue")
+        else:
+            logging.info(f"Worker {index} (pid {process.pid}) finished")
+        return process.exitcode
+
+    for index in range(count):
+        start(index)
+
+    stopping = False
+    try:
+        while processes:
+            if hf.stop_requested() and not stopping:
+                stopping = True
+                logging.info(f"Stopping {len(processes)} workers")
+                for process in processes.values():
+                    process.terminate()
+            time.sleep(1)
+            for index in [i for i, p in processes.items() if not p.is_alive()]:
+                if reap(index) != 0 and restart and not stopping:
+                    start(index)
+    except KeyboardInterrupt:
+        # A second signal: workers get a second SIGTERM, which stops them immediately
+        logging.info("Stopping workers immediately")
+        for process in processes.values():
+            process.terminate()
+        for index in list(processes):
+            reap(index)
+
+    logging.info(f"All {count} workers stopped")
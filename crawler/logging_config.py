@@ -1,8 +1,61 @@
-import logging
 import os
+import queue
+import atexit
+import logging
+import threading
 from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# Pass as extra= on messages that can repeat many times a second (e.g. idle
+# notices): at most one per template is logged every this many seconds
+RATE_LIMITED = {'rate_limit': 10}
+
+# Size-based rotation of log files
+LOG_MAX_BYTES = 50 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops records carrying a rate_limit attribute (see RATE_LIMITED) when a
+    record with the same message template was let through less than
+    rate_limit seconds ago. The next one let through notes how many were
+    dropped.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.last_emitted = {}
+        self.suppressed = {}
+        self.lock = threading.Lock()
 
-def setup_logging(log_level='INFO', log_to_file=True, log_directory='logs'):
+    def filter(self, record):
+        interval = getattr(record, 'rate_limit', None)
+        if interval is None:
+            return True
+        # The same record passes through one filter per handler without a queue
+        passed = getattr(record, 'rate_limit_passed', None)
+        if passed is not None:
+            return passed
+
+        key = (record.name, record.msg)
+        with self.lock:
+            passed = record.created - self.last_emitted.get(key, 0) >= interval
+            if passed:
+                self.last_emitted[key] = record.created
+                suppressed = self.suppressed.pop(key, 0)
+            else:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+        if passed and suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        record.rate_limit_passed = passed
+        return passed
+
+
+def setup_logging(log_level='INFO', log_to_file=True, log_directory='logs', log_name='crawler',
+                  file_log_level=None, use_queue=True):
     """
     Configure logging for the crawler with flexible options.
 
@@ -10,11 +63,16 @@ def setup_logging(log_level='INFO', log_to_file=True, log_directory='logs'):
         log_level: Logging level ('DEBUG', 'INFO', 'WARNING', 'ERROR')
         log_to_file: Whether to log to file in addition to console
         log_directory: Directory to store log files
+        log_name: Log file name prefix; only 'crawler' logs update latest.log
+        file_log_level: Level for the log file (default: log_level)
+        use_queue: Hand records to a background thread that does the
+            formatting I/O, so logging never blocks the crawl loop
     """
+    global _listener
 
     # Create logs directory if it doesn't exist
-    if log_to_file and not os.path.exists(log_directory):
-        os.makedirs(log_directory)
+    if log_to_file:
+        os.makedirs(log_directory, exist_ok=True)
 
     # Set up formatters
     detailed_formatter = logging.Formatter(
@@ -25,39 +83,71 @@ def setup_logging(log_level='INFO', log_to_file=True, log_directory='logs'):
         '%(asctime)s - %(levelname)s - %(message)s'
     )
 
+    console_level = getattr(logging, log_level.upper())
+    file_level = getattr(logging, (file_log_level or log_level).upper())
+
     # Configure root logger
     logger = logging.getLogger()
-    logger.setLevel(getattr(logging, log_level.upper()))
+    logger.setLevel(min(console_level, file_level) if log_to_file else console_level)
 
     # Clear any existing handlers
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
     logger.handlers.clear()
 
     # Console handler (always enabled)
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(getattr(logging, log_level.upper()))
+    console_handler.setLevel(console_level)
     console_handler.setFormatter(simple_formatter)
-    logger.addHandler(console_handler)
+    handlers = [console_handler]
 
     # File handler (optional)
+    log_filename = None
     if log_to_file:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        log_filename = os.path.join(log_directory, f'crawler_{timestamp}.log')
+        log_filename = os.path.join(log_directory, f'{log_name}_{timestamp}.log')
 
-        file_handler = logging.FileHandler(log_filename)
-        file_handler.setLevel(logging.DEBUG)  # Always detailed logging to file
+        file_handler = RotatingFileHandler(log_filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT)
+        file_handler.setLevel(file_level)
         file_handler.setFormatter(detailed_formatter)
-        logger.addHandler(file_handler)
+        handlers.append(file_handler)
 
         # Also create a latest.log symlink for easy access
-        latest_log = os.path.join(log_directory, 'latest.log')
-        if os.path.exists(latest_log):
-            os.remove(latest_log)
-        os.symlink(os.path.basename(log_filename), latest_log)
+        if log_name == 'crawler':
+            latest_log = os.path.join(log_directory, 'latest.log')
+            if os.path.lexists(latest_log):
+                os.remove(latest_log)
+            os.symlink(os.path.basename(log_filename), latest_log)
 
+    if use_queue:
+        queue_handler = QueueHandler(queue.SimpleQueue())
+        queue_handler.addFilter(RateLimitFilter())
+        logger.addHandler(queue_handler)
+        _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+    else:
+        rate_limit = RateLimitFilter()
+        for handler in handlers:
+            handler.addFilter(rate_limit)
+            logger.addHandler(handler)
+
+    if log_filename:
         logger.info(f"Logging to file: {log_filename}")
 
     return logger
 
+
+def stop_logging():
+    """Flush records still queued for the background logging thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+atexit.register(stop_logging)
+
 def get_logger(name):
     """Get a logger instance with the given name."""
     return logging.getLogger(name)
@@ -0,0 +1,77 @@
+"""
+Checks for the asyncio crawl engine's concurrency limits (core/async_crawler.py).
+
+Fetches are simulated, so no network is needed (httpx must be installed).
+Run with: python crawler/test_async_crawler.py
+"""
+import os
+import sys
+import asyncio
+import shutil
+import tempfile
+import unittest
+from collections import Counter
+from urllib.parse import urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from core import async_crawler
+from utils import helper_functions as hf
+
+
+class RecordingCrawler(async_crawler.AsyncCrawler):
+    """Fetches nothing; records how many fetches of each host overlap"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = Counter()
+        self.peak = Counter()
+        self.fetched = []
+
+    async def _fetch(self, client, url, state=None):
+        host = urlparse(url).netloc
+        self.active[host] += 1
+        self.peak[host] = max(self.peak[host], self.active[host])
+        await asyncio.sleep(0.01)
+        self.active[host] -= 1
+        self.fetched.append(url)
+        return b'<html></html>', {}
+
+
+def test_host_limits_and_idle_slots():
+    if async_crawler.httpx is None:
+        raise unittest.SkipTest('httpx is not installed')
+    directory = tempfile.mkdtemp()
+    saved = (hf.DATA_DIR, hf.CRAWL_DELAY)
+    try:
+        hf.set_data_dir(directory)
+        # No crawl delay, so the scheduler hands out a host's URLs as fast as they are asked for
+        hf.CRAWL_DELAY = 0
+        urls = [f'http://host{h}.example.com/{i}' for h in range(3) for i in range(12)]
+        hf.save_new_urls(urls)
+
+        crawler = RecordingCrawler(lambda url: False, lambda url, content, headers: [], lambda url: True,
+                                   concurrency=20, per_host_concurrency=2, exit_when_done=True)
+        asyncio.run(crawler.crawl())
+
+        assert sorted(crawler.fetched) == sorted(urls)
+        # Never more than per_host_concurrency fetches of one host at a time, and the limit is reached
+        assert set(crawler.peak.values()) == {2}, crawler.peak
+        # Hosts give their slot back once no task holds or waits for it
+        assert crawler.host_slots == {} and not crawler.host_users
+        assert hf.get_frontier().queue_size() == 0
+    finally:
+        hf.shutdown()
+        hf.set_data_dir(saved[0])
+        hf.CRAWL_DELAY = saved[1]
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for test in (test_host_limits_and_idle_slots,):
+        try:
+            test()
+        except unittest.SkipTest as e:
+            print(f"{test.__name__}: skipped ({e})")
+            continue
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
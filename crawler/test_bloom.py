@@ -0,0 +1,85 @@
+"""
+Checks for the seen-URL Bloom filters (utils/bloom.py).
+
+Run with: python crawler/test_bloom.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.bloom import BloomFilter, ScalableBloomFilter
+
+
+def _urls(prefix, count):
+    return [f'http://{prefix}.example.com/page/{i}' for i in range(count)]
+
+
+def test_no_false_negatives_and_false_positive_rate():
+    directory = tempfile.mkdtemp()
+    try:
+        bloom = BloomFilter(os.path.join(directory, 'filter.bin'), capacity=10000, error_rate=0.01)
+        added = _urls('seen', 10000)
+        for url in added:
+            bloom.add(url)
+        assert all(url in bloom for url in added)
+        assert bloom.count == 10000 and bloom.is_full()
+
+        false_positives = sum(url in bloom for url in _urls('unseen', 20000))
+        # 1% expected at capacity; allow for sampling noise
+        assert false_positives / 20000 < 0.015, false_positives
+        bloom.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_persistence():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'filter.bin')
+        bloom = BloomFilter(path, capacity=1000, error_rate=0.01)
+        for url in _urls('seen', 500):
+            bloom.add(url)
+        bloom.close()
+
+        bloom = BloomFilter(path)
+        assert bloom.count == 500 and (bloom.capacity, bloom.error_rate) == (1000, 0.01)
+        assert all(url in bloom for url in _urls('seen', 500))
+        bloom.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_scalable_growth():
+    directory = tempfile.mkdtemp()
+    try:
+        bloom = ScalableBloomFilter(directory, initial_capacity=1000, error_rate=0.01)
+        added = _urls('seen', 5000)
+        assert all(bloom.add(url) for url in added[:100])
+        for url in added[100:]:
+            bloom.add(url)
+        # 1000 + 2000 + 4000 capacity: the third filter holds the rest
+        assert len(bloom.filters) == 3
+        assert all(url in bloom for url in added)
+        assert not bloom.add(added[0])
+
+        false_positives = sum(url in bloom for url in _urls('unseen', 20000))
+        # Overall bound: error_rate / (1 - tightening) = 5%
+        assert false_positives / 20000 < 0.05, false_positives
+
+        # Another process sharing the directory sees the same filters
+        other = ScalableBloomFilter(directory, initial_capacity=1000, error_rate=0.01)
+        assert len(other.filters) == 3 and len(other) == len(bloom)
+        assert all(url in other for url in added)
+        other.close()
+        bloom.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for test in (test_no_false_negatives_and_false_positive_rate, test_persistence, test_scalable_growth):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
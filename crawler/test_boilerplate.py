@@ -0,0 +1,79 @@
+"""
+Checks for per-site template stripping (utils/boilerplate.py).
+
+Run with: python crawler/test_boilerplate.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.boilerplate import TemplateFilter, TEMPLATE_MIN_PAGES
+from utils.frontier import Frontier
+
+NAV = ('html/body/nav', 'Home About Contact')
+FOOTER = ('html/body/footer', 'Copyright Example')
+
+
+def _page(n):
+    return [NAV, ('html/body/main/p', f'Article {n} text'), FOOTER]
+
+
+def test_template_blocks_stripped():
+    template = TemplateFilter()
+    for n in range(TEMPLATE_MIN_PAGES):
+        # Kept whole while the template is being learned
+        assert template.main_text('a.example.com', _page(n)) == f'Home About Contact Article {n} text Copyright Example'
+    # Seen on TEMPLATE_MIN_PAGES earlier pages: part of the template
+    assert template.main_text('a.example.com', _page(99)) == 'Article 99 text'
+    # Same text under another path is not the template block
+    assert template.main_text('a.example.com', [('html/body/main/p', 'Home About Contact')]) == 'Home About Contact'
+    # Other hosts learn their own template
+    assert template.main_text('b.example.com', _page(1)) == 'Home About Contact Article 1 text Copyright Example'
+    # A page of template blocks only is kept whole
+    assert template.main_text('a.example.com', [NAV, FOOTER]) == 'Home About Contact Copyright Example'
+
+
+def test_counts_persisted():
+    directory = tempfile.mkdtemp()
+    try:
+        frontier = Frontier(os.path.join(directory, 'frontier.db'))
+        template = TemplateFilter(store=frontier)
+        for n in range(TEMPLATE_MIN_PAGES):
+            template.main_text('a.example.com', _page(n))
+        template.save()
+        frontier.close()
+
+        # A restarted crawler strips the template from its first page
+        frontier = Frontier(os.path.join(directory, 'frontier.db'))
+        template = TemplateFilter(store=frontier)
+        assert template.main_text('a.example.com', _page(99)) == 'Article 99 text'
+
+        # Hosts evicted from memory are saved and loaded back
+        template = TemplateFilter(store=frontier, max_hosts=1, save_every=10 ** 6)
+        for n in range(TEMPLATE_MIN_PAGES):
+            template.main_text('c.example.com', _page(n))
+        template.main_text('d.example.com', _page(0))
+        assert list(template.hosts) == ['d.example.com']
+        assert template.main_text('c.example.com', _page(99)) == 'Article 99 text'
+        frontier.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_blocks_bounded():
+    template = TemplateFilter(max_blocks=20)
+    for n in range(200):
+        blocks = _page(n) + [(f'html/body/div{i}', f'Unique {n}/{i}') for i in range(7)]
+        template.main_text('a.example.com', blocks)
+        assert len(template.hosts['a.example.com']) <= 20
+    # Pruning keeps the most frequent blocks, so the template is still recognized
+    assert template.main_text('a.example.com', _page(999)) == 'Article 999 text'
+
+
+if __name__ == '__main__':
+    for test in (test_template_blocks_stripped, test_counts_persisted, test_blocks_bounded):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
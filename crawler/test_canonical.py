@@ -0,0 +1,72 @@
+"""
+Checks for URL canonicalization (utils/canonical.py).
+
+Run with: python crawler/test_canonical.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.canonical import canonicalize
+
+# (URL, canonical form)
+CASES = [
+    ('HTTP://Example.COM/a', 'http://example.com/a'),
+    ('http://example.com', 'http://example.com/'),
+    ('http://example.com:80/a', 'http://example.com/a'),
+    ('https://example.com:443/a', 'https://example.com/a'),
+    ('https://example.com:8443/a', 'https://example.com:8443/a'),
+    ('http://example.com./a', 'http://example.com/a'),
+    ('http://example.com/a#section', 'http://example.com/a'),
+    ('http://example.com/a/./b/../c', 'http://example.com/a/c'),
+    ('http://example.com/../a', 'http://example.com/a'),
+    ('http://example.com/a/', 'http://example.com/a'),
+    ('http://example.com/', 'http://example.com/'),
+    ('http://example.com/%7euser/%2f', 'http://example.com/~user/%2F'),
+    ('http://example.com/a b', 'http://example.com/a%20b'),
+    ('http://example.com/?b=2&a=1', 'http://example.com/?a=1&b=2'),
+    ('http://example.com/?a=2&b=1&a=1', 'http://example.com/?a=2&a=1&b=1'),
+    ('http://example.com/?utm_source=x&id=5&fbclid=y', 'http://example.com/?id=5'),
+    ('http://example.com/?UTM_Campaign=x', 'http://example.com/'),
+    ('http://example.com/?q=', 'http://example.com/?q='),
+    # Query parameters keep their raw form: latin-1 escapes, valueless keys and '+'
+    ('http://example.com/?x=%e6', 'http://example.com/?x=%E6'),
+    ('http://example.com/?x=%E6&x=%F8', 'http://example.com/?x=%E6&x=%F8'),
+    ('https://www.findsmiley.dk/Sider/KontrolRapport.aspx?Virk6023756',
+     'https://www.findsmiley.dk/Sider/KontrolRapport.aspx?Virk6023756'),
+    ('http://example.com/?print&a=1', 'http://example.com/?a=1&print'),
+    ('http://example.com/?q=a+b', 'http://example.com/?q=a+b'),
+    ('http://example.com/?q=a%2bb&&r=%7e', 'http://example.com/?q=a%2Bb&r=~'),
+    ('http://example.com/?utm%5Fsource=x&q=1', 'http://example.com/?q=1'),
+    ('http://user:pw@Example.com/', 'http://user:pw@example.com/'),
+    ('http://[::1]:8080/a', 'http://[::1]:8080/a'),
+    ('http://bücher.de/', 'http://xn--bcher-kva.de/'),
+    # Not canonicalized: other schemes and malformed URLs come back unchanged
+    ('mailto:someone@example.com', 'mailto:someone@example.com'),
+    ('javascript:void(0)', 'javascript:void(0)'),
+    ('http://example.com:notaport/', 'http://example.com:notaport/'),
+    ('http:///no-host', 'http:///no-host'),
+]
+
+
+def test_canonical_forms():
+    for url, expected in CASES:
+        assert canonicalize(url) == expected, (url, canonicalize(url), expected)
+
+
+def test_idempotent():
+    # Canonical URLs are stored and compared, so canonicalizing one again must not change it
+    for url, expected in CASES:
+        assert canonicalize(expected) == expected, (expected, canonicalize(expected))
+
+
+def test_custom_strip_params():
+    url = 'http://example.com/?session=1&id=5&utm_source=x'
+    assert canonicalize(url, strip_params={'session'}, strip_prefixes=()) == 'http://example.com/?id=5&utm_source=x'
+
+
+if __name__ == '__main__':
+    for test in (test_canonical_forms, test_idempotent, test_custom_strip_params):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
@@ -0,0 +1,131 @@
+"""
+Checks for the SQLite crawl frontier (utils/frontier.py): leases, acks and
+the one-time import of the legacy text files.
+
+Run with: python crawler/test_frontier.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.frontier import Frontier
+
+
+def _write_lines(path, lines):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def test_lease_and_expiry():
+    directory = tempfile.mkdtemp()
+    try:
+        frontier = Frontier(os.path.join(directory, 'frontier.db'))
+        frontier.add_urls(['http://a.example.com/1', 'http://a.example.com/2'])
+
+        assert frontier.lease_from_domain('a.example.com') == 'http://a.example.com/1'
+        # A leased URL stays queued but is not handed out again while the lease runs
+        assert frontier.lease_from_domain('a.example.com') == 'http://a.example.com/2'
+        assert frontier.lease_from_domain('a.example.com') is None
+        assert frontier.queue_size() == 2 and frontier.pending_domains() == []
+
+        # Once the lease runs out (its worker never acked it) the URL is leased again
+        frontier.conn.execute("UPDATE queue SET lease_expires = 0 WHERE url = 'http://a.example.com/1'")
+        assert [domain for domain, _ in frontier.pending_domains()] == ['a.example.com']
+        assert frontier.lease_from_domain('a.example.com') == 'http://a.example.com/1'
+        frontier.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_ack_and_release():
+    directory = tempfile.mkdtemp()
+    try:
+        frontier = Frontier(os.path.join(directory, 'frontier.db'), bloom_dir=os.path.join(directory, 'seen'))
+        frontier.add_urls(['http://a.example.com/1', 'http://a.example.com/2'])
+        url = frontier.lease_from_domain('a.example.com')
+        frontier.ack(url)
+        assert frontier.queue_size() == 1 and frontier.crawled_count() == 1
+
+        # An acked URL is never queued or handed out again, even after its lease would have expired
+        assert frontier.add_urls([url]) == []
+        frontier.conn.execute('UPDATE queue SET lease_expires = 0')
+        assert frontier.lease_from_domain('a.example.com') == 'http://a.example.com/2'
+        assert frontier.lease_from_domain('a.example.com') is None
+
+        # Released leases (a stopped worker) go back to the queue
+        assert frontier.release_leases(frontier.owner) == 1
+        assert frontier.lease_from_domain('a.example.com') == 'http://a.example.com/2'
+        frontier.close()
+
+        # Nor after a restart, when the seen-URL filter answers first
+        frontier = Frontier(os.path.join(directory, 'frontier.db'), bloom_dir=os.path.join(directory, 'seen'))
+        assert frontier.add_urls([url]) == []
+        frontier.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_import_is_idempotent():
+    directory = tempfile.mkdtemp()
+    try:
+        to_crawl = os.path.join(directory, 'to_crawl.txt')
+        crawled = os.path.join(directory, 'crawled.txt')
+        timing = os.path.join(directory, 'domain_timing.txt')
+        _write_lines(to_crawl, ['http://a.example.com/1', 'http://a.example.com/1', 'http://b.example.com/',
+                                'http://a.example.com/done', ''])
+        _write_lines(crawled, ['http://a.example.com/done'])
+        _write_lines(timing, ['a.example.com\t100.5'])
+
+        def open_frontier():
+            return Frontier(os.path.join(directory, 'frontier.db'), to_crawl, crawled, timing)
+
+        def contents(frontier):
+            return (sorted(url for (url,) in frontier.conn.execute('SELECT url FROM queue')),
+                    sorted(url for (url,) in frontier.conn.execute('SELECT url FROM crawled')),
+                    frontier.last_crawl('a.example.com'))
+
+        frontier = open_frontier()
+        imported = contents(frontier)
+        # Duplicate and already crawled lines are queued once / not at all
+        assert imported == (['http://a.example.com/1', 'http://b.example.com/'], ['http://a.example.com/done'], 100.5)
+        frontier.close()
+
+        # Reopening does not import again
+        frontier = open_frontier()
+        assert contents(frontier) == imported
+        # Nor does importing the same files a second time change anything
+        frontier._import_text_files(to_crawl, crawled, timing)
+        assert contents(frontier) == imported
+        frontier.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_rejects_junk_urls():
+    directory = tempfile.mkdtemp()
+    try:
+        junk = ['http://#', 'http:///path', 'http://:80/', 'mailto:someone@example.com', 'javascript:void(0)',
+                'ftp://example.com/file', '/relative/path', 'http://[::1/']
+        to_crawl = os.path.join(directory, 'to_crawl.txt')
+        _write_lines(to_crawl, junk + ['http://a.example.com/'])
+
+        frontier = Frontier(os.path.join(directory, 'frontier.db'), to_crawl)
+        assert [url for (url,) in frontier.conn.execute('SELECT url FROM queue')] == ['http://a.example.com/']
+        assert frontier.add_urls(junk + ['https://b.example.com/']) == ['https://b.example.com/']
+
+        # Junk queued by an older version is dropped when the stored URLs are canonicalized
+        frontier.conn.execute("INSERT INTO queue (url, domain) VALUES ('http://#', '')")
+        frontier.canonicalize_urls(lambda url: url, 1)
+        assert frontier.queue_size() == 2
+        frontier.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for test in (test_lease_and_expiry, test_ack_and_release, test_import_is_idempotent, test_rejects_junk_urls):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
@@ -0,0 +1,115 @@
+"""
+Checks for the streamed page fetch (core/main.py fetch_page and
+utils/http_session.py), against a local HTTP server.
+
+Run with: python crawler/test_http_session.py
+"""
+import os
+import sys
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from core import main
+from utils import http_session
+
+# Bodies the server would keep sending to a client that does not hang up
+ENDLESS = 256 * 1024 * 1024
+PAGE = b'<html><body>' + b'x' * 1000 + b'</body></html>'
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    sent = {}  # path -> body bytes the server managed to write
+    streams_done = threading.Semaphore(0)
+
+    def do_GET(self):
+        if self.path == '/page.html':
+            self._reply('text/html; charset=utf-8', PAGE)
+        elif self.path == '/image.png':
+            self._stream('image/png', ENDLESS)
+        elif self.path == '/huge.html':
+            self._stream('text/html', ENDLESS)
+        elif self.path == '/declared.html':
+            self._stream('text/html', ENDLESS, content_length=ENDLESS)
+        else:
+            self._reply('text/html', b'not found', status=404)
+
+    def _reply(self, content_type, body, status=200):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self, content_type, size, content_length=None):
+        """Send size bytes chunked (or with a Content-Length), stopping when the client hangs up"""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if content_length is None:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(content_length))
+        self.end_headers()
+        chunk = b'<p>' + b'y' * 65533
+        sent = 0
+        try:
+            while sent < size:
+                if content_length is None:
+                    self.wfile.write(b'%x\r\n%s\r\n' % (len(chunk), chunk))
+                else:
+                    self.wfile.write(chunk)
+                sent += len(chunk)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            Handler.sent[self.path] = sent
+            Handler.streams_done.release()
+            self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_streamed_fetch():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f'http://127.0.0.1:{server.server_address[1]}'
+    saved = http_session.MAX_BODY_SIZE
+    try:
+        http_session.MAX_BODY_SIZE = 100 * 1024
+        body, headers = main.fetch_page(base + '/page.html')
+        assert body == PAGE and headers['Content-Type'].startswith('text/html')
+        assert main.fetch_page(base + '/missing.html') == (None, None)
+
+        # Non-HTML responses and bodies over MAX_BODY_SIZE are dropped without downloading them:
+        # the connection is closed, so the server stops long before the end of the body
+        streams = ('/image.png', '/huge.html', '/declared.html')
+        for path in streams:
+            assert main.fetch_page(base + path) == (None, None), path
+        for path in streams:
+            assert Handler.streams_done.acquire(timeout=30)
+        for path in streams:
+            assert Handler.sent[path] < ENDLESS, (path, Handler.sent[path])
+    finally:
+        http_session.MAX_BODY_SIZE = saved
+        server.shutdown()
+        server.server_close()
+
+
+def test_accept_headers():
+    html = {'Content-Type': 'text/html; charset=utf-8'}
+    assert http_session.accept_headers('u', 200, html)
+    assert not http_session.accept_headers('u', 404, html)
+    assert not http_session.accept_headers('u', 200, {'Content-Type': 'application/pdf'})
+    assert not http_session.accept_headers('u', 200, {})
+    assert http_session.accept_headers('u', 200, dict(html, **{'Content-Length': '1000'}), max_body_size=1000)
+    assert not http_session.accept_headers('u', 200, dict(html, **{'Content-Length': '1001'}), max_body_size=1000)
+
+
+if __name__ == '__main__':
+    for test in (test_streamed_fetch, test_accept_headers):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
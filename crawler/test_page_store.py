@@ -0,0 +1,101 @@
+"""
+Checks for the segmented page store (utils/page_store.py).
+
+Run with: python crawler/test_page_store.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils import page_store
+from utils.page_store import PageStore, open_store
+
+
+def _page(host, n):
+    return {'url': f'http://{host}/p{n}.html', 'title': f'Page {n} – {host}',
+            'content': f'Welcome to {host}. Article {n}: ' + ' '.join(f'word{i * n % 97}' for i in range(200))}
+
+
+def test_round_trip_and_segments():
+    compressions = ['none', 'gzip'] + (['zstd'] if page_store.zstandard is not None else [])
+    for compression in compressions:
+        directory = tempfile.mkdtemp()
+        try:
+            store = PageStore(directory, compression=compression, segment_size=4096)
+            pages = [_page('a.example.com', n) for n in range(40)]
+            assert [store.append(page) for page in pages] == list(range(1, 41))
+            # Small segments: the records were spread over several segment files
+            assert len([name for name in os.listdir(directory) if name.startswith('segment_')]) > 1
+            store.close()
+
+            # Reopened (compression comes from store.json), every record is read back by doc id
+            store = PageStore(directory)
+            assert store.compression == compression and len(store) == 40 and store.next_doc_id() == 41
+            assert store.get(17) == pages[16]
+            assert store.get_meta(3) == {'url': pages[2]['url'], 'title': pages[2]['title']}
+            assert [page for doc_id, page in store] == pages
+            assert store.get_html(1) is None
+            store.close()
+        finally:
+            shutil.rmtree(directory)
+
+
+def test_shared_store_and_legacy_ids():
+    directory = tempfile.mkdtemp()
+    try:
+        # Doc ids continue after the legacy page_N.json files
+        open(os.path.join(directory, 'page_7.json'), 'w').close()
+        first = open_store(directory, compression='gzip')
+        second = open_store(directory)
+        # Two writers sharing the store never hand out the same doc id
+        ids = [store.append(_page('a.example.com', n)) for n, store in enumerate([first, second] * 5)]
+        assert ids == list(range(8, 18))
+        assert second.get(8) == _page('a.example.com', 0) and first.get(17) == _page('a.example.com', 9)
+        first.close()
+        second.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_zstd_dictionaries():
+    if page_store.zstandard is None:
+        raise unittest.SkipTest('zstandard is not installed')
+    directory = tempfile.mkdtemp()
+    try:
+        store = PageStore(directory, compression='zstd-dict')
+        hosts = ('a.example.com', 'b.example.com')
+        count = page_store.DICT_SAMPLES + 10
+        pages = [(_page(host, n), f'<html><nav>{host}</nav><p>{n}</p></html>') for n in range(count) for host in hosts]
+        for page, html in pages:
+            store.append(page, html=html)
+        # Each host got a dictionary after DICT_SAMPLES pages, and its later pages are compressed with it
+        assert sorted(os.listdir(os.path.join(directory, 'dicts'))) == [f'{host}.zdict' for host in hosts]
+        last = page_store.zstandard.get_frame_parameters(store.read_record(len(pages)))
+        assert last.dict_id == store.host_dicts['b.example.com'].dict_id()
+        store.close()
+
+        # A fresh process reads back text, HTML and metadata of pages stored with and without a dictionary
+        store = PageStore(directory)
+        for doc_id, (page, html) in enumerate(pages, start=1):
+            meta, text = store.get_text(doc_id)
+            assert isinstance(text, memoryview) and str(text, 'utf-8') == page['content']
+            assert meta == store.get_meta(doc_id) == {'url': page['url'], 'title': page['title']}
+            assert store.get_html(doc_id) == html.encode('utf-8')
+            assert store.get(doc_id) == page
+        store.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for test in (test_round_trip_and_segments, test_shared_store_and_legacy_ids, test_zstd_dictionaries):
+        try:
+            test()
+        except unittest.SkipTest as e:
+            print(f"{test.__name__}: skipped ({e})")
+            continue
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
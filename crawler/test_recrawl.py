@@ -0,0 +1,109 @@
+"""
+Checks for revisits: conditional GETs, adaptive revisit intervals
+(utils/frontier.py record_visit) and re-saving changed pages (core/main.py).
+
+Run with: python crawler/test_recrawl.py
+"""
+import os
+import sys
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from core import main
+from utils import frontier as frontier_module
+from utils import http_session
+from utils import helper_functions as hf
+from utils.frontier import Frontier
+
+
+def test_adaptive_interval():
+    directory = tempfile.mkdtemp()
+    try:
+        frontier = Frontier(os.path.join(directory, 'frontier.db'))
+        url = 'http://a.example.com/'
+
+        def interval():
+            return frontier.page_state(url)['interval']
+
+        assert frontier.record_visit(url, '"v1"', 'Mon, 01 Jan 2024 00:00:00 GMT', 'hash1') == 'new'
+        assert interval() == frontier_module.REVISIT_INTERVAL
+        state = frontier.page_state(url)
+        assert http_session.conditional_headers(state) == {'If-None-Match': '"v1"',
+                                                           'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'}
+
+        # A 304 (no content hash) and an unchanged page both lengthen the interval
+        assert frontier.record_visit(url) == 'unchanged'
+        assert interval() == frontier_module.REVISIT_INTERVAL * frontier_module.UNCHANGED_FACTOR
+        assert frontier.record_visit(url, content_hash='hash1') == 'unchanged'
+        assert interval() == frontier_module.REVISIT_INTERVAL * frontier_module.UNCHANGED_FACTOR ** 2
+        # The validators of the last response are kept
+        assert frontier.page_state(url)['etag'] == '"v1"'
+
+        # A changed page shortens it
+        assert frontier.record_visit(url, '"v2"', None, 'hash2') == 'changed'
+        assert interval() == (frontier_module.REVISIT_INTERVAL * frontier_module.UNCHANGED_FACTOR ** 2
+                              * frontier_module.CHANGED_FACTOR)
+        state = frontier.page_state(url)
+        assert (state['etag'], state['visits'], state['changes']) == ('"v2"', 4, 1)
+        assert state['next_visit'] == state['last_visit'] + state['interval']
+
+        # ... within the bounds
+        for _ in range(30):
+            frontier.record_visit(url, content_hash='hash3')
+        assert interval() == frontier_module.MAX_REVISIT_INTERVAL
+        for n in range(30):
+            frontier.record_visit(url, content_hash=f'changing{n}')
+        assert interval() == frontier_module.MIN_REVISIT_INTERVAL
+
+        # Due pages are queued again once
+        frontier.conn.execute('UPDATE page_state SET next_visit = 0')
+        assert frontier.requeue_due() == 1 and frontier.requeue_due() == 0
+        frontier.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def _html(text, canonical=None):
+    link = f'<link rel="canonical" href="{canonical}">' if canonical else ''
+    return f'<html><head><title>T</title>{link}</head><body><p>{text}</p></body></html>'.encode('utf-8')
+
+
+def test_changed_page_saved_again():
+    directory = tempfile.mkdtemp()
+    saved = hf.DATA_DIR, main.processed_dir
+    try:
+        hf.set_data_dir(os.path.join(directory, 'raw'))
+        os.makedirs(hf.DATA_DIR)
+        main.processed_dir = os.path.join(directory, 'processed')
+        url = 'http://a.example.com/article?id=1'
+        canonical = 'http://a.example.com/article'
+        first = ' '.join(f'first{i}' for i in range(100))
+        second = ' '.join(f'second{i}' for i in range(100))
+
+        main.process_page(url, _html(first, canonical))
+        store = hf.get_page_store(main.processed_dir)
+        assert len(store) == 1 and store.get(1)['url'] == canonical
+
+        # Unchanged on the revisit: not saved again
+        main.process_page(url, _html(first, canonical))
+        assert len(store) == 1
+        # Changed: saved again under its canonical URL, although that URL was claimed by the first visit
+        main.process_page(url, _html(second, canonical))
+        assert len(store) == 2 and store.get(2)['url'] == canonical and 'second0' in store.get(2)['content']
+
+        # A different page naming an already crawled canonical URL is still skipped
+        main.process_page('http://a.example.com/other', _html('other page', canonical))
+        assert len(store) == 2
+    finally:
+        hf.shutdown()
+        hf.set_data_dir(saved[0])
+        main.processed_dir = saved[1]
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for test in (test_adaptive_interval, test_changed_page_saved_again):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
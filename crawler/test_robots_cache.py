@@ -0,0 +1,101 @@
+"""
+Checks for the robots.txt cache (utils/robots_cache.py) and how its
+Crawl-delays reach the scheduler.
+
+Run with: python crawler/test_robots_cache.py
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.robots_cache import RobotsCache
+from utils import helper_functions as hf
+
+ROBOTS = "User-agent: *\nCrawl-delay: 5\nDisallow: /private/\n"
+
+
+def test_rules_and_crawl_delay_after_reload():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'robots_cache.json')
+        fetched = []
+        delays = []
+
+        def fetch(robots_url):
+            fetched.append(robots_url)
+            return 200, ROBOTS
+
+        cache = RobotsCache(fetch, path, on_crawl_delay=lambda host, delay: delays.append((host, delay)))
+        assert cache.lookup('http://a.example.com/page') is None  # not cached: prefetched in the background
+        assert cache.can_fetch('http://a.example.com/page', timeout=5)
+        assert not cache.can_fetch('http://a.example.com/private/x', timeout=5)
+        assert fetched == ['http://a.example.com/robots.txt'] and delays == [('a.example.com', 5)]
+        cache.close()
+
+        # Reloaded from disk: no fetch, and the Crawl-delay is reported again on the first use only
+        delays.clear()
+        cache = RobotsCache(fetch, path, on_crawl_delay=lambda host, delay: delays.append((host, delay)))
+        assert cache.lookup('http://a.example.com/page') is True
+        assert cache.lookup('http://a.example.com/private/x') is False
+        assert len(fetched) == 1 and delays == [('a.example.com', 5)]
+        cache.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_close_waits_for_prefetches():
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'robots_cache.json')
+        started = []
+
+        def slow_fetch(robots_url):
+            started.append(robots_url)
+            time.sleep(0.2)
+            return 200, ROBOTS
+
+        cache = RobotsCache(slow_fetch, path, workers=1)
+        for host in ('a', 'b', 'c'):
+            cache.prefetch(f'http://{host}.example.com/')
+        while not started:
+            time.sleep(0.01)
+        cache.close()
+
+        # The running prefetch finished and was saved; the queued ones were dropped
+        assert started == ['http://a.example.com/robots.txt']
+        with open(path, 'r', encoding='utf-8') as f:
+            assert list(json.load(f)) == ['http://a.example.com']
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_crawl_delay_applied_by_crawl_loop():
+    directory = tempfile.mkdtemp()
+    saved = hf.DATA_DIR
+    try:
+        hf.set_data_dir(directory)
+        # Reported from a robots thread before anything else is open: nothing is created on that thread
+        thread = threading.Thread(target=hf.set_robots_crawl_delay, args=('a.example.com', '5'))
+        thread.start()
+        thread.join()
+        assert hf._scheduler is None and hf._frontier is None
+
+        assert hf.grab_next_url() is None
+        assert hf.get_scheduler().get_delay('a.example.com') == 5.0
+    finally:
+        hf.shutdown()
+        hf.set_data_dir(saved)
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for test in (test_rules_and_crawl_delay_after_reload, test_close_waits_for_prefetches,
+                 test_crawl_delay_applied_by_crawl_loop):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
@@ -0,0 +1,145 @@
+"""
+Checks for the URL exchange between the nodes of a distributed crawl
+(utils/router.py, core/distributed.py), over spool transports.
+
+Run with: python crawler/test_router.py
+"""
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from core.distributed import Coordinator
+from utils import router as router_module
+from utils.frontier import Frontier
+from utils.router import Router, node_for, node_name
+from utils.transport import SpoolTransport
+
+
+def _urls_of(node, count=3):
+    """URLs on hosts owned by node (of 2)"""
+    hosts = [f'host{i}.example.com' for i in range(50)]
+    return [f'http://{host}/' for host in hosts if node_for(host, 2) == node][:count]
+
+
+def _queued(frontier):
+    return sorted(url for (url,) in frontier.conn.execute('SELECT url FROM queue'))
+
+
+def _open_node(directory, index):
+    frontier = Frontier(os.path.join(directory, f'node-{index}.db'))
+    return frontier, Router(SpoolTransport(os.path.join(directory, 'spool'), node_name(index)), index, 2, frontier)
+
+
+def _idle():
+    return True
+
+
+def test_batches_acked_and_resent():
+    directory = tempfile.mkdtemp()
+    try:
+        store_a, a = _open_node(directory, 0)
+        store_b, b = _open_node(directory, 1)
+        first, second = _urls_of(1, 3), _urls_of(1, 6)[3:]
+
+        assert a.route(first + _urls_of(0, 1)) == _urls_of(0, 1)
+        a.flush(force=True)
+        b.poll(store_b.add_urls, _idle)
+        assert _queued(store_b) == sorted(first)
+        # The ack clears the batch from a's outbox
+        a.poll(store_a.add_urls, _idle)
+        assert store_a.unacked_batches() == []
+
+        # A duplicate and a batch after a gap are dropped; b acknowledges the last batch it applied
+        spool = SpoolTransport(os.path.join(directory, 'spool'), 'test')
+        duplicate = {'type': 'urls', 'from': 'test', 'channel': a.channel, 'seq': 1, 'urls': ['http://dup.test/']}
+        gap = dict(duplicate, seq=3, urls=['http://gap.test/'])
+        spool.send(node_name(1), duplicate)
+        spool.send(node_name(1), gap)
+        b.poll(store_b.add_urls, _idle)
+        assert _queued(store_b) == sorted(first) and b.received[a.channel] == 1
+        assert [(m['type'], m['seq']) for m in spool.receive()] == [('ack', 1)]
+
+        # A lost batch is sent again once ACK_TIMEOUT has passed without an ack
+        a.route(second)
+        a.flush(force=True)
+        b.transport.receive()
+        a.poll(store_a.add_urls, _idle)
+        b.poll(store_b.add_urls, _idle)
+        assert _queued(store_b) == sorted(first) and len(store_a.unacked_batches()) == 1
+        a.sent_at = {key: sent - router_module.ACK_TIMEOUT for key, sent in a.sent_at.items()}
+        a.next_resend = 0
+        a.poll(store_a.add_urls, _idle)
+        b.poll(store_b.add_urls, _idle)
+        assert _queued(store_b) == sorted(first + second)
+        a.poll(store_a.add_urls, _idle)
+        assert store_a.unacked_batches() == []
+        assert a.sent == {node_name(1): 2} and b.received[a.channel] == 2
+        store_a.close()
+        store_b.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_crash_before_first_send():
+    directory = tempfile.mkdtemp()
+    try:
+        store_a, a = _open_node(directory, 0)
+        a.route(_urls_of(1))
+        assert a.pending() == 3
+        # The node dies before the batch is sent...
+        store_a.close()
+
+        # ...and the restarted node sends the URLs waiting for node 1 on its first poll
+        store_a, a = _open_node(directory, 0)
+        assert a.pending() == 3
+        a.poll(store_a.add_urls, _idle)
+        store_b, b = _open_node(directory, 1)
+        b.poll(store_b.add_urls, _idle)
+        assert _queued(store_b) == sorted(_urls_of(1))
+        assert a.pending() == 0
+        store_a.close()
+        store_b.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_coordinator_done():
+    directory = tempfile.mkdtemp()
+    try:
+        coordinator = Coordinator(SpoolTransport(directory, 'coordinator'), 2)
+        coordinator.send_urls(_urls_of(0, 1) + _urls_of(1, 1))
+        assert coordinator.sent == {node_name(0): 1, node_name(1): 1}
+
+        def report(received_seeds, node0_sent, node1_received, idle=True):
+            coordinator.statuses = {
+                0: {'channel': 'node-0:x', 'sent': {node_name(1): node0_sent}, 'idle': idle, 'time': time.time(),
+                    'received': {coordinator.channel: received_seeds}},
+                1: {'channel': 'node-1:y', 'sent': {}, 'idle': idle, 'time': time.time(),
+                    'received': {coordinator.channel: received_seeds, 'node-0:x': node1_received}},
+            }
+
+        # Seeds or a batch still in transit, or a busy node: not done
+        report(0, 0, 0)
+        assert not coordinator.done()
+        report(1, 2, 1)
+        assert not coordinator.done()
+        report(1, 2, 2, idle=False)
+        assert not coordinator.done()
+        # Balanced and idle: done once a second round of reports confirms it
+        report(1, 2, 2)
+        assert not coordinator.done()
+        time.sleep(0.01)
+        report(1, 2, 2)
+        assert coordinator.done()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    for test in (test_batches_acked_and_resent, test_crash_before_first_send, test_coordinator_done):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
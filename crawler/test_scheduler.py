@@ -0,0 +1,105 @@
+"""
+Checks for the per-host politeness scheduler (utils/scheduler.py).
+
+Run with: python crawler/test_scheduler.py
+"""
+import os
+import sys
+import time
+import zlib
+import shutil
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from utils.frontier import Frontier
+from utils.scheduler import HostScheduler
+
+
+def _with_frontier(test):
+    def run():
+        directory = tempfile.mkdtemp()
+        frontier = Frontier(os.path.join(directory, 'frontier.db'))
+        try:
+            test(frontier)
+        finally:
+            frontier.close()
+            shutil.rmtree(directory)
+    run.__name__ = test.__name__
+    return run
+
+
+def _next_allowed(scheduler):
+    return {domain: next_allowed for next_allowed, domain in scheduler.heap}
+
+
+@_with_frontier
+def test_per_host_delays(frontier):
+    scheduler = HostScheduler(frontier, default_delay=0, domain_delays={'slow.example.com': 100})
+    scheduler.add_urls(['http://slow.example.com/1', 'http://slow.example.com/2',
+                        'http://fast.example.com/1', 'http://fast.example.com/2'])
+    start = time.time()
+    assert {scheduler.next_url(), scheduler.next_url()} == {'http://slow.example.com/1', 'http://fast.example.com/1'}
+
+    # Each host goes back on the heap with its own delay
+    next_allowed = _next_allowed(scheduler)
+    assert next_allowed['slow.example.com'] >= start + 100
+    assert next_allowed['fast.example.com'] < start + 1
+    assert scheduler.next_url() == 'http://fast.example.com/2'
+    # The slow host is waiting and the fast one has nothing left
+    assert scheduler.next_url() is None
+    assert 99 < scheduler.seconds_until_ready() <= 100
+
+
+@_with_frontier
+def test_robots_crawl_delay(frontier):
+    scheduler = HostScheduler(frontier, default_delay=1.0, domain_delays={'b.example.com': 5.0})
+    # A robots.txt Crawl-delay overrides a smaller configured delay, never a larger one
+    scheduler.set_robots_delay('a.example.com', 10.0)
+    scheduler.set_robots_delay('b.example.com', 2.0)
+    assert scheduler.get_delay('a.example.com') == 10.0
+    assert scheduler.get_delay('b.example.com') == 5.0
+    assert scheduler.get_delay('c.example.com') == 1.0
+
+    scheduler.add_urls(['http://a.example.com/1', 'http://a.example.com/2'])
+    start = time.time()
+    assert scheduler.next_url() == 'http://a.example.com/1'
+    assert _next_allowed(scheduler)['a.example.com'] >= start + 10.0
+
+
+@_with_frontier
+def test_shards(frontier):
+    domains = [f'host{i}.example.com' for i in range(50)]
+    schedulers = [HostScheduler(frontier, default_delay=0, shard=(index, 3)) for index in range(3)]
+    for domain in domains:
+        owners = [index for index, scheduler in enumerate(schedulers) if scheduler.owns(domain)]
+        assert owners == [zlib.crc32(domain.encode('utf-8')) % 3]
+
+    # URLs of other shards are queued, but only the owning shard schedules their host
+    schedulers[0].add_urls([f'http://{domain}/' for domain in domains])
+    for index, scheduler in enumerate(schedulers):
+        scheduler.refresh()
+        assert scheduler.scheduled == {domain for domain in domains if scheduler.owns(domain)}
+    assert sum(scheduler.host_count() for scheduler in schedulers) == len(domains)
+
+
+@_with_frontier
+def test_drained_host_rescheduled(frontier):
+    scheduler = HostScheduler(frontier, default_delay=0)
+    scheduler.add_urls(['http://a.example.com/1'])
+    assert scheduler.next_url() == 'http://a.example.com/1'
+    frontier.ack('http://a.example.com/1')
+    # The drained host is dropped once the scheduler finds its queue empty
+    assert scheduler.next_url() is None
+    assert scheduler.host_count() == 0 and scheduler.seconds_until_ready() is None
+
+    # New URLs for it schedule it again
+    scheduler.add_urls(['http://a.example.com/2'])
+    assert scheduler.host_count() == 1
+    assert scheduler.next_url() == 'http://a.example.com/2'
+
+
+if __name__ == '__main__':
+    for test in (test_per_host_delays, test_robots_crawl_delay, test_shards, test_drained_host_rescheduled):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
@@ -0,0 +1,145 @@
+"""Persistent scalable Bloom filter for the seen-URL set"""
+import os
+import mmap
+import math
+import struct
+import hashlib
+
+# magic, hash count, bit count, capacity, error rate, item count
+_HEADER = struct.Struct('<4sIQQdQ')
+_MAGIC = b'BLM1'
+
+# Item count, the last header field
+_COUNT = struct.Struct('<Q')
+_COUNT_OFFSET = _HEADER.size - _COUNT.size
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter whose bit array is a memory-mapped file, so it
+    persists without explicit saving and the OS can page it in and out.
+    Processes mapping the same file see each other's additions; writers
+    must be serialized by the caller.
+    """
+
+    def __init__(self, path, capacity=None, error_rate=None):
+        self.path = path
+        if not os.path.exists(path):
+            bits = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+            hashes = max(1, int(round(bits / capacity * math.log(2))))
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(_HEADER.pack(_MAGIC, hashes, bits, capacity, error_rate, 0))
+                f.truncate(_HEADER.size + (bits + 7) // 8)
+            os.replace(tmp_path, path)
+
+        self.file = open(path, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), 0)
+        magic, self.hashes, self.bits, self.capacity, self.error_rate, _ = _HEADER.unpack_from(self.mm, 0)
+        if magic != _MAGIC:
+            raise ValueError(f"Not a Bloom filter file: {path}")
+
+    @property
+    def count(self):
+        # Read from the mapping so additions by other processes are counted
+        return _COUNT.unpack_from(self.mm, _COUNT_OFFSET)[0]
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        for i in range(self.hashes):
+            yield (h1 + i * h2) % self.bits
+
+    def __contains__(self, key):
+        mm = self.mm
+        offset = _HEADER.size
+        for position in self._positions(key):
+            if not mm[offset + (position >> 3)] & (1 << (position & 7)):
+                return False
+        return True
+
+    def add(self, key):
+        mm = self.mm
+        offset = _HEADER.size
+        for position in self._positions(key):
+            mm[offset + (position >> 3)] |= 1 << (position & 7)
+        _COUNT.pack_into(mm, _COUNT_OFFSET, self.count + 1)
+
+    def is_full(self):
+        return self.count >= self.capacity
+
+    def flush(self):
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        self.mm.close()
+        self.file.close()
+
+
+class ScalableBloomFilter:
+    """
+    Chain of Bloom filters that grows as URLs are added: when the newest
+    filter reaches its capacity a new one is created with `growth` times the
+    capacity and `tightening` times the error rate, which keeps the overall
+    false-positive rate below error_rate / (1 - tightening). With the
+    defaults 100M URLs need seven filters totalling ~190 MB.
+
+    Membership answers are "definitely not seen" or "possibly seen"; callers
+    confirm the latter against an exact store. Filters added by another
+    process sharing the directory are picked up before every operation.
+    """
+
+    def __init__(self, directory, initial_capacity=1000000, error_rate=0.01, growth=2, tightening=0.8):
+        self.directory = directory
+        self.initial_capacity = initial_capacity
+        self.error_rate = error_rate
+        self.growth = growth
+        self.tightening = tightening
+        os.makedirs(directory, exist_ok=True)
+
+        self.filters = []
+        self._open_new_filters()
+        if not self.filters:
+            self._add_filter()
+
+    def _filter_path(self, level):
+        return os.path.join(self.directory, f"filter_{level:03d}.bin")
+
+    def _open_new_filters(self):
+        while os.path.exists(self._filter_path(len(self.filters))):
+            self.filters.append(BloomFilter(self._filter_path(len(self.filters))))
+
+    def _add_filter(self):
+        level = len(self.filters)
+        path = self._filter_path(level)
+        self.filters.append(BloomFilter(
+            path,
+            capacity=self.initial_capacity * self.growth ** level,
+            error_rate=self.error_rate * self.tightening ** level,
+        ))
+
+    def __contains__(self, key):
+        self._open_new_filters()
+        return any(key in f for f in reversed(self.filters))
+
+    def __len__(self):
+        return sum(f.count for f in self.filters)
+
+    def add(self, key):
+        """Add a key; returns False if it was (possibly) present already"""
+        if key in self:
+            return False
+        if self.filters[-1].is_full():
+            self._add_filter()
+        self.filters[-1].add(key)
+        return True
+
+    def flush(self):
+        for f in self.filters:
+            f.flush()
+
+    def close(self):
+        for f in self.filters:
+            f.close()
@@ -0,0 +1,129 @@
+"""Per-site template detection: strip text blocks that repeat across a host's pages"""
+import heapq
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from operator import itemgetter
+
+# A block (DOM path + text) seen on this many earlier pages of a host is
+# part of the site's template (navigation, footer, cookie banner, ...)
+TEMPLATE_MIN_PAGES = 3
+
+# Block counts are kept for at most MAX_HOSTS hosts (least recently used
+# hosts are forgotten) and at most MAX_BLOCKS_PER_HOST blocks per host
+MAX_HOSTS = 1000
+MAX_BLOCKS_PER_HOST = 50000
+
+# Pages between two saves of the changed hosts' counts (with a store)
+SAVE_EVERY = 1000
+
+
+def _block_key(path, text):
+    """64-bit key of a block, the same in every process (unlike hash())"""
+    digest = hashlib.blake2b(f'{path}\0{text}'.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def _encode_counts(counts):
+    return array('Q', counts.keys()).tobytes() + array('I', counts.values()).tobytes()
+
+
+def _decode_counts(blob):
+    size = len(blob) // 12
+    keys = array('Q')
+    keys.frombytes(blob[:8 * size])
+    values = array('I')
+    values.frombytes(blob[8 * size:])
+    return dict(zip(keys, values))
+
+
+class TemplateFilter:
+    """
+    Learns each host's template from the pages it is shown and returns
+    their main content.
+
+    For every host it counts on how many pages each block occurs, keyed by
+    the block's DOM path and text, so "Contact" in the footer and "Contact"
+    in an article are different blocks. Blocks that occurred on at least
+    min_pages earlier pages are dropped. The first pages of a host are kept
+    whole while the template is being learned, and a page that consists of
+    template blocks only is kept whole as well.
+
+    When a host has more than max_blocks distinct blocks, only the most
+    frequent half are kept, which bounds the memory without losing the
+    template blocks, which are the most frequent ones.
+
+    With a store (the frontier: load_block_counts/save_block_counts), a
+    host's counts are loaded the first time it is seen, saved when it is
+    evicted, and the changed hosts are saved every save_every pages and by
+    save(), so a restarted crawler keeps what it learned.
+    """
+
+    def __init__(self, min_pages=TEMPLATE_MIN_PAGES, max_hosts=MAX_HOSTS, max_blocks=MAX_BLOCKS_PER_HOST,
+                 store=None, save_every=SAVE_EVERY):
+        self.min_pages = min_pages
+        self.max_hosts = max_hosts
+        self.max_blocks = max_blocks
+        self.store = store
+        self.save_every = save_every
+        self.hosts = OrderedDict()  # host -> {block key: pages seen on}
+        self.changed = set()  # hosts whose counts are not saved yet
+        self.pages = 0
+        self.lock = threading.Lock()
+
+    def _counts(self, host):
+        counts = self.hosts.get(host)
+        if counts is None:
+            blob = self.store.load_block_counts(host) if self.store is not None else None
+            counts = self.hosts[host] = _decode_counts(blob) if blob else {}
+            while len(self.hosts) > self.max_hosts:
+                evicted, evicted_counts = self.hosts.popitem(last=False)
+                if evicted in self.changed:
+                    self.changed.discard(evicted)
+                    self.store.save_block_counts([(evicted, _encode_counts(evicted_counts))])
+        else:
+            self.hosts.move_to_end(host)
+        return counts
+
+    def _prune(self, counts):
+        """Keep the most frequent half of max_blocks blocks"""
+        kept = heapq.nlargest(self.max_blocks // 2, counts.items(), key=itemgetter(1))
+        counts.clear()
+        counts.update(kept)
+
+    def main_text(self, host, blocks):
+        """Return the text of the blocks (path, text) of a page of host that are not part of its template"""
+        keys = [_block_key(path, text) for path, text in blocks]
+        with self.lock:
+            counts = self._counts(host)
+            kept = [text for (path, text), key in zip(blocks, keys) if counts.get(key, 0) < self.min_pages]
+            for key in set(keys):
+                counts[key] = counts.get(key, 0) + 1
+            if len(counts) > self.max_blocks:
+                self._prune(counts)
+
+            if self.store is not None:
+                self.changed.add(host)
+                self.pages += 1
+                if self.pages % self.save_every == 0:
+                    self._save()
+
+        if not kept:
+            kept = [text for path, text in blocks]
+        return ' '.join(kept)
+
+    def _save(self):
+        self.store.save_block_counts([(host, _encode_counts(self.hosts[host])) for host in self.changed])
+        self.changed.clear()
+
+    def save(self):
+        """Write the counts of the hosts that changed since the last save to the store"""
+        if self.store is None:
+            return
+        with self.lock:
+            self._save()
+
+    def stats(self):
+        with self.lock:
+            return {'hosts': len(self.hosts), 'blocks': sum(len(counts) for counts in self.hosts.values())}
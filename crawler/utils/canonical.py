@@ -0,0 +1,114 @@
+"""Canonical URL form shared by the frontier, dedup and robots checks"""
+import re
+from urllib.parse import urlsplit, urlunsplit, quote, unquote_plus
+
+# Bump when the rules below change so stored URLs get re-canonicalized
+CANONICAL_VERSION = 2
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+# Query parameters that only track the visitor and never change the page
+STRIP_QUERY_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid',
+    '_ga', '_gl', 'igshid', 'ref_src', 'yclid',
+}
+STRIP_QUERY_PREFIXES = ('utm_',)
+
+# Treat /path/ and /path as the same page (the root path always keeps its slash)
+STRIP_TRAILING_SLASH = True
+
+_UNRESERVED = set('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+_ESCAPE = re.compile(r'%([0-9A-Fa-f]{2})')
+_PATH_SAFE = "/:@!$&'()*+,;=%"
+_QUERY_SAFE = "/?:@!$'()*+,;=%"
+
+
+def _normalize_escapes(component, safe):
+    """Decode escaped unreserved characters, upper-case other escapes and escape raw unsafe characters"""
+    def fix(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in _UNRESERVED else '%' + match.group(1).upper()
+    return quote(_ESCAPE.sub(fix, component), safe=safe)
+
+
+def _remove_dot_segments(path):
+    segments = path.split('/')
+    output = []
+    for segment in segments:
+        if segment == '..':
+            if len(output) > 1:
+                output.pop()
+        elif segment != '.':
+            output.append(segment)
+    if segments[-1] in ('.', '..'):
+        output.append('')
+    return '/'.join(output)
+
+
+def _normalize_host(host):
+    host = host.lower().rstrip('.')
+    try:
+        host.encode('ascii')
+    except UnicodeEncodeError:
+        try:
+            host = host.encode('idna').decode('ascii')
+        except UnicodeError:
+            pass
+    return host
+
+
+def canonicalize(url, strip_params=None, strip_prefixes=None):
+    """
+    Return the canonical form of an absolute http(s) URL:
+
+    - lower-case scheme and host (IDN hosts in punycode), no default port
+    - no fragment, dot segments resolved, empty path becomes '/'
+    - percent-escapes normalized (unreserved characters decoded, hex upper-case)
+    - trailing slash removed from non-root paths (STRIP_TRAILING_SLASH)
+    - tracking parameters removed and the remaining query sorted by name;
+      each parameter keeps its raw form ('+', valueless keys, non-UTF-8
+      escapes), since servers differ in how they decode it
+
+    Other URLs (mailto:, javascript:, garbage) are returned unchanged; the
+    frontier refuses to queue them.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        scheme = parts.scheme.lower()
+        if scheme not in DEFAULT_PORTS or not parts.hostname:
+            return url
+
+        host = _normalize_host(parts.hostname)
+        if ':' in host:
+            host = f'[{host}]'
+        port = parts.port
+        if port and port != DEFAULT_PORTS[scheme]:
+            host = f'{host}:{port}'
+        if parts.username is not None:
+            userinfo = parts.username
+            if parts.password is not None:
+                userinfo += ':' + parts.password
+            host = f'{userinfo}@{host}'
+    except ValueError:
+        # Invalid port or malformed IPv6 literal
+        return url
+
+    path = _remove_dot_segments(_normalize_escapes(parts.path, _PATH_SAFE)) or '/'
+    if STRIP_TRAILING_SLASH and len(path) > 1 and path.endswith('/'):
+        path = path.rstrip('/') or '/'
+
+    strip_params = STRIP_QUERY_PARAMS if strip_params is None else strip_params
+    strip_prefixes = STRIP_QUERY_PREFIXES if strip_prefixes is None else strip_prefixes
+    params = []
+    for param in parts.query.split('&'):
+        if not param:
+            continue
+        param = _normalize_escapes(param, _QUERY_SAFE)
+        key = param.split('=', 1)[0]
+        name = unquote_plus(key).lower()
+        if name not in strip_params and not name.startswith(tuple(strip_prefixes)):
+            params.append((key, param))
+    # Sort by name only so repeated parameters keep their relative order
+    query = '&'.join(param for key, param in sorted(params, key=lambda kv: kv[0]))
+
+    return urlunsplit((scheme, host, path, query, ''))
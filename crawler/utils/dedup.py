@@ -0,0 +1,267 @@
+"""Near-duplicate page detection with MinHash signatures and LSH banding"""
+import os
+import fcntl
+import struct
+import hashlib
+import logging
+from array import array
+from contextlib import contextmanager
+
+_MAX_HASH = 0xFFFFFFFF
+
+# Offset added per bin of distance when an empty bin borrows a neighbour's value
+_ROTATION = 0x9E3779B9
+
+# How signatures are computed, recorded in bands.bin: 1 was num_perm (a*x+b) mod p
+# permutations, 2 is one-permutation hashing. Signatures of different schemes
+# cannot be compared, so an index of another scheme is rebuilt.
+SIGNATURE_SCHEME = 2
+
+# bands.bin header: magic, signature scheme, page count, num_perm, bands
+_BANDS_HEADER = struct.Struct('<4sIQII')
+_BANDS_MAGIC = b'MHLB'
+
+
+class _BandTable:
+    """
+    Open-addressing hash table from a 64-bit band key to doc indexes, stored
+    in two flat arrays: a slot costs 12 bytes instead of a dict's ~100 bytes
+    per entry. Equal keys occupy consecutive probe slots.
+    """
+
+    def __init__(self, capacity=1024):
+        self.keys = array('Q', bytes(8 * capacity))
+        self.values = array('I', bytes(4 * capacity))
+        self.size = 0
+
+    def add(self, key, value):
+        if (self.size + 1) * 2 > len(self.keys):
+            self._grow()
+        keys = self.keys
+        capacity = len(keys)
+        i = key % capacity
+        while keys[i]:
+            i = (i + 1) % capacity
+        keys[i] = key
+        self.values[i] = value
+        self.size += 1
+
+    def get(self, key):
+        keys = self.keys
+        capacity = len(keys)
+        i = key % capacity
+        found = []
+        while keys[i]:
+            if keys[i] == key:
+                found.append(self.values[i])
+            i = (i + 1) % capacity
+        return found
+
+    def _grow(self):
+        old_keys, old_values = self.keys, self.values
+        self.keys = array('Q', bytes(8 * len(old_keys) * 2))
+        self.values = array('I', bytes(4 * len(old_keys) * 2))
+        self.size = 0
+        for key, value in zip(old_keys, old_values):
+            if key:
+                self.add(key, value)
+
+
+class MinHashIndex:
+    """
+    Persistent MinHash LSH index answering "is there a saved page whose
+    Jaccard similarity to this one exceeds the threshold?".
+
+    Each page gets a num_perm value MinHash signature, computed with
+    one-permutation hashing: every token is hashed once and the hash picks a
+    bin and a value, each bin keeping its minimum, so a signature costs
+    O(tokens + num_perm) instead of O(tokens * num_perm). Empty bins (short
+    pages) borrow the value of the next non-empty bin, offset by the
+    distance, which keeps the estimate unbiased. The signature is
+    split into `bands` bands; pages sharing any band are candidates, and a
+    candidate is a duplicate when the fraction of equal signature values
+    (an estimate of the Jaccard similarity) exceeds the threshold. With the
+    default 16 bands of 8 rows a pair at similarity 0.8 becomes a candidate
+    with probability ~0.95, and above 0.85 with probability > 0.99.
+
+    Signatures are appended to signatures.bin and read back only for
+    candidates; band tables live in memory and are checkpointed to
+    bands.bin, with any signatures added after the last checkpoint replayed
+    on load. bands.bin also records the signature scheme: when it does not
+    match SIGNATURE_SCHEME (or num_perm changed) the stored signatures are
+    dropped and the index starts empty, to be rebuilt from the saved pages.
+
+    Crawler processes sharing the index wrap find_duplicate and add in
+    locked(), which takes a file lock and first replays signatures other
+    processes appended since.
+    """
+
+    def __init__(self, directory, num_perm=128, bands=16):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.directory = directory
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.record_size = 4 * num_perm
+        self.checkpoint_every = 1000
+
+        os.makedirs(directory, exist_ok=True)
+        self.signature_file = os.path.join(directory, 'signatures.bin')
+        self.bands_file = os.path.join(directory, 'bands.bin')
+        self.tables = [_BandTable() for _ in range(bands)]
+        self.count = 0
+        self._load()
+        self.signatures = open(self.signature_file, 'ab+')
+        self.lock_file = open(os.path.join(directory, 'index.lock'), 'a+b')
+
+    def __len__(self):
+        return self.count
+
+    def _load(self):
+        stored = 0
+        if os.path.exists(self.signature_file):
+            size = os.path.getsize(self.signature_file)
+            stored = size // self.record_size
+            if size % self.record_size:
+                # Drop a partially written record left by a crash
+                with open(self.signature_file, 'r+b') as f:
+                    f.truncate(stored * self.record_size)
+
+        scheme = num_perm = None
+        if os.path.exists(self.bands_file):
+            with open(self.bands_file, 'rb') as f:
+                header = f.read(_BANDS_HEADER.size)
+                if len(header) == _BANDS_HEADER.size and header.startswith(_BANDS_MAGIC):
+                    _, scheme, count, num_perm, bands = _BANDS_HEADER.unpack(header)
+                    if (scheme, num_perm, bands) == (SIGNATURE_SCHEME, self.num_perm, self.bands) and count <= stored:
+                        for table in self.tables:
+                            capacity, size = struct.unpack('<QQ', f.read(16))
+                            table.keys = array('Q')
+                            table.keys.fromfile(f, capacity)
+                            table.values = array('I')
+                            table.values.fromfile(f, capacity)
+                            table.size = size
+                        self.count = count
+
+        # No checkpoint, one written before the scheme was recorded, or signatures of another kind
+        if (scheme, num_perm) != (SIGNATURE_SCHEME, self.num_perm):
+            if stored:
+                logging.warning("The near-duplicate index was built with other signatures; rebuilding it")
+                os.truncate(self.signature_file, 0)
+                stored = 0
+            # Record the scheme right away, so signatures added before the first checkpoint are trusted
+            self.save()
+
+        # Replay signatures appended after the last checkpoint
+        if self.count < stored:
+            with open(self.signature_file, 'rb') as f:
+                self._replay(f, stored)
+
+        if self.count:
+            logging.info(f"Loaded near-duplicate index with {self.count} pages")
+
+    def _replay(self, f, stored):
+        """Index the signatures from self.count up to stored, read from file f"""
+        f.seek(self.count * self.record_size)
+        for doc in range(self.count, stored):
+            signature = array('I')
+            signature.frombytes(f.read(self.record_size))
+            self._index(doc, signature)
+        self.count = stored
+
+    @contextmanager
+    def locked(self):
+        """Hold the index lock across processes, catching up with their additions first"""
+        fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+        try:
+            stored = os.fstat(self.signatures.fileno()).st_size // self.record_size
+            if stored > self.count:
+                self._replay(self.signatures, stored)
+            yield
+        finally:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    def signature(self, tokens):
+        """MinHash signature of a set of tokens"""
+        k = self.num_perm
+        bins = [None] * k
+        for token in tokens:
+            h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+            b = h % k
+            value = (h // k) & _MAX_HASH
+            current = bins[b]
+            if current is None or value < current:
+                bins[b] = value
+
+        signature = array('I', [_MAX_HASH] * k)
+        if all(value is None for value in bins):
+            return signature
+
+        for b in range(k):
+            if bins[b] is not None:
+                signature[b] = bins[b]
+                continue
+            distance = 1
+            while bins[(b + distance) % k] is None:
+                distance += 1
+            signature[b] = (bins[(b + distance) % k] + distance * _ROTATION) & _MAX_HASH
+        return signature
+
+    def _band_keys(self, signature):
+        for band in range(self.bands):
+            chunk = signature[band * self.rows:(band + 1) * self.rows].tobytes()
+            digest = hashlib.blake2b(chunk, digest_size=8, salt=struct.pack('<Q', band)).digest()
+            # 0 marks an empty slot in the band tables
+            yield band, int.from_bytes(digest, 'little') or 1
+
+    def _index(self, doc, signature):
+        for band, key in self._band_keys(signature):
+            self.tables[band].add(key, doc)
+
+    def _read_signature(self, doc):
+        signature = array('I')
+        signature.frombytes(os.pread(self.signatures.fileno(), self.record_size, doc * self.record_size))
+        return signature
+
+    def find_duplicate(self, signature, threshold=0.8):
+        """Return (doc, estimated similarity) of a saved page above the threshold, or None"""
+        checked = set()
+        for band, key in self._band_keys(signature):
+            for doc in self.tables[band].get(key):
+                if doc in checked:
+                    continue
+                checked.add(doc)
+                other = self._read_signature(doc)
+                similarity = sum(1 for x, y in zip(signature, other) if x == y) / self.num_perm
+                if similarity > threshold:
+                    return doc, similarity
+        return None
+
+    def add(self, signature):
+        """Store a signature and return its doc index"""
+        doc = self.count
+        self.signatures.write(signature.tobytes())
+        self.signatures.flush()
+        self._index(doc, signature)
+        self.count += 1
+        if self.count % self.checkpoint_every == 0:
+            self.save()
+        return doc
+
+    def save(self):
+        """Checkpoint the band tables so the next load does not replay signatures"""
+        tmp_file = self.bands_file + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            f.write(_BANDS_HEADER.pack(_BANDS_MAGIC, SIGNATURE_SCHEME, self.count, self.num_perm, self.bands))
+            for table in self.tables:
+                f.write(struct.pack('<QQ', len(table.keys), table.size))
+                table.keys.tofile(f)
+                table.values.tofile(f)
+        os.replace(tmp_file, self.bands_file)
+
+    def close(self):
+        with self.locked():
+            self.save()
+        self.signatures.close()
+        self.lock_file.close()
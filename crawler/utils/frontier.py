@@ -0,0 +1,539 @@
+"""Persistent URL frontier backed by SQLite"""
+import os
+import json
+import socket
+import sqlite3
+import time
+import uuid
+import logging
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlparse, urlsplit
+
+from utils.bloom import ScalableBloomFilter
+
+# Seconds before a leased URL whose worker never acknowledged it is handed out again
+LEASE_TIMEOUT = 600
+
+# Revisit interval of a newly crawled page, and the bounds it adapts within (seconds)
+REVISIT_INTERVAL = 24 * 3600
+MIN_REVISIT_INTERVAL = 3600
+MAX_REVISIT_INTERVAL = 60 * 24 * 3600
+
+# Interval multipliers after a revisit found the page changed / unchanged
+CHANGED_FACTOR = 0.5
+UNCHANGED_FACTOR = 1.5
+
+
+def lease_owner(pid=None):
+    """Lease owner id of a process on this machine"""
+    return f"{socket.gethostname()}:{os.getpid() if pid is None else pid}"
+
+
+def _crawlable(url):
+    """True for an absolute http(s) URL with a host; nothing else is ever queued"""
+    try:
+        parts = urlsplit(url)
+        return parts.scheme in ('http', 'https') and bool(parts.hostname)
+    except ValueError:
+        return False
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Frontier:
+    """
+    Crawl queue, crawl history and per-domain timing stored in one SQLite
+    database running in WAL mode.
+
+    Every operation is a single short transaction that touches a handful of
+    B-tree pages, so enqueue and dequeue cost O(log n) instead of rewriting
+    the text files on every call.
+
+    When bloom_dir is given, a persistent Bloom filter of every URL ever
+    queued sits in front of the queue/crawled tables: URLs it has never seen
+    are inserted without looking them up, and only "possibly seen" URLs are
+    confirmed against the tables.
+
+    Several processes may share one frontier. Dequeuing leases a URL to the
+    calling process (it stays in the queue, invisible to others) and ack()
+    moves it to crawled once it has been handled. Leases of a process that
+    died are released by release_leases()/release_dead_leases(), and any
+    lease not acknowledged within LEASE_TIMEOUT seconds is handed out again.
+
+    page_state keeps the validators (ETag, Last-Modified) and content hash
+    of every fetched page along with when to revisit it. The interval
+    shrinks each time a revisit finds the page changed and grows while it
+    stays the same, and requeue_due() puts pages whose time has come back
+    into the queue.
+
+    block_counts holds each host's template block counts (see
+    boilerplate.TemplateFilter) as an opaque blob, so a restarted crawler
+    does not have to learn the templates again.
+
+    In a distributed crawl the frontier also keeps the node's side of the
+    URL exchange (see router.Router): the URLs waiting to be sent to each
+    node, the batches sent to each node and not acknowledged yet, and the
+    sequence number of the last batch sent to
+    each node and received from each sender. add_urls() records a received
+    batch in the same transaction that queues its URLs.
+    """
+
+    def __init__(self, db_path, to_crawl_file=None, crawled_file=None, domain_timing_file=None, bloom_dir=None):
+        self.db_path = db_path
+        self.owner = lease_owner()
+        self.seen = ScalableBloomFilter(bloom_dir) if bloom_dir else None
+        # Shared with the async engine's page-processing thread; _transaction serializes writers
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._create_tables()
+
+        if self._get_meta('imported') is None:
+            self._import_text_files(to_crawl_file, crawled_file, domain_timing_file)
+
+        if self.seen is not None and len(self.seen) == 0:
+            self._fill_seen_filter()
+
+    def _create_tables(self):
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS queue (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                url TEXT NOT NULL UNIQUE,
+                domain TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS queue_domain ON queue (domain, id);
+            CREATE TABLE IF NOT EXISTS crawled (
+                url TEXT PRIMARY KEY,
+                crawled_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS domain_timing (
+                domain TEXT PRIMARY KEY,
+                last_crawl REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            );
+            CREATE TABLE IF NOT EXISTS page_state (
+                url TEXT PRIMARY KEY,
+                domain TEXT NOT NULL,
+                etag TEXT,
+                last_modified TEXT,
+                content_hash TEXT,
+                last_visit REAL NOT NULL,
+                next_visit REAL NOT NULL,
+                interval REAL NOT NULL,
+                visits INTEGER NOT NULL DEFAULT 1,
+                changes INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS page_state_next_visit ON page_state (next_visit);
+            CREATE TABLE IF NOT EXISTS block_counts (
+                host TEXT PRIMARY KEY,
+                counts BLOB NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS batches_sent (
+                dest TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS batches_received (
+                channel TEXT PRIMARY KEY,
+                seq INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS forward (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                dest TEXT NOT NULL,
+                url TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS outbox (
+                dest TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                urls TEXT NOT NULL,
+                PRIMARY KEY (dest, seq)
+            );
+        """)
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(queue)')}
+        if 'lease_owner' not in columns:
+            self.conn.execute('ALTER TABLE queue ADD COLUMN lease_owner TEXT')
+            self.conn.execute('ALTER TABLE queue ADD COLUMN lease_expires REAL')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS queue_lease ON queue (lease_owner) '
+                          'WHERE lease_owner IS NOT NULL')
+
+    @contextmanager
+    def _transaction(self):
+        """Run a block in a write transaction, taking the lock up front."""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            else:
+                self.conn.execute('COMMIT')
+
+    def _get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn, key, value):
+        conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _import_text_files(self, to_crawl_file, crawled_file, domain_timing_file):
+        """One-time import of the legacy to_crawl/crawled/domain_timing text files."""
+        logging.info(f"Initializing frontier database at {self.db_path}")
+        queued = crawled = domains = 0
+
+        with self._transaction() as conn:
+            if crawled_file and os.path.exists(crawled_file):
+                with open(crawled_file, 'r', encoding='utf-8', errors='replace') as f:
+                    for line in f:
+                        url = line.strip()
+                        if url:
+                            conn.execute('INSERT OR IGNORE INTO crawled (url, crawled_at) VALUES (?, 0)', (url,))
+                            if self.seen is not None:
+                                self.seen.add(url)
+                crawled = conn.execute('SELECT COUNT(*) FROM crawled').fetchone()[0]
+
+            if to_crawl_file and os.path.exists(to_crawl_file):
+                with open(to_crawl_file, 'r', encoding='utf-8', errors='replace') as f:
+                    for line in f:
+                        url = line.strip()
+                        if url:
+                            self._insert_url(conn, url)
+                queued = conn.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+
+            if domain_timing_file and os.path.exists(domain_timing_file):
+                with open(domain_timing_file, 'r', encoding='utf-8', errors='replace') as f:
+                    for line in f:
+                        line = line.strip()
+                        if line:
+                            domain, timestamp = line.split('\t')
+                            conn.execute('INSERT OR REPLACE INTO domain_timing (domain, last_crawl) VALUES (?, ?)',
+                                         (domain, float(timestamp)))
+                domains = conn.execute('SELECT COUNT(*) FROM domain_timing').fetchone()[0]
+
+            self._set_meta(conn, 'imported', time.time())
+
+        logging.info(f"Imported {queued} queued URLs, {crawled} crawled URLs and timing for {domains} domains")
+
+    def _fill_seen_filter(self):
+        """Add every queued and crawled URL to a new (or lost) Bloom filter"""
+        added = 0
+        for table in ('crawled', 'queue'):
+            for (url,) in self.conn.execute(f'SELECT url FROM {table}'):
+                self.seen.add(url)
+                added += 1
+        self.seen.flush()
+        if added:
+            logging.info(f"Built seen-URL filter from {added} known URLs")
+
+    def _insert_url(self, conn, url):
+        """Queue a URL unless it is already queued or crawled, or not an http(s) URL. Returns True if added."""
+        if not _crawlable(url):
+            return False
+        if self.seen is not None and self.seen.add(url):
+            # Definitely never seen before, so it cannot be in crawled
+            cursor = conn.execute('INSERT OR IGNORE INTO queue (url, domain) VALUES (?, ?)',
+                                  (url, urlparse(url).netloc))
+            return cursor.rowcount > 0
+
+        cursor = conn.execute(
+            'INSERT OR IGNORE INTO queue (url, domain) '
+            'SELECT ?, ? WHERE NOT EXISTS (SELECT 1 FROM crawled WHERE url = ?)',
+            (url, urlparse(url).netloc, url)
+        )
+        return cursor.rowcount > 0
+
+    def add_urls(self, urls, batch=None):
+        """
+        Queue new URLs, skipping ones already queued or crawled. Returns the
+        URLs actually added. batch is the (channel, seq) of the received
+        batch the URLs came from, recorded as received along with them.
+        """
+        added = []
+        with self._transaction() as conn:
+            for url in urls:
+                if self._insert_url(conn, url):
+                    added.append(url)
+            if batch is not None:
+                conn.execute('INSERT OR REPLACE INTO batches_received (channel, seq) VALUES (?, ?)', batch)
+        return added
+
+    def lease_from_domain(self, domain):
+        """
+        Lease and return the oldest unleased URL for a domain, or None if the
+        domain has nothing available. The domain's last crawl time is updated
+        in the same transaction; the URL stays queued until ack().
+        """
+        with self._transaction() as conn:
+            now = time.time()
+            row = conn.execute(
+                'SELECT id, url FROM queue WHERE domain = ? AND (lease_expires IS NULL OR lease_expires < ?) '
+                'ORDER BY id LIMIT 1', (domain, now)
+            ).fetchone()
+            if row is None:
+                return None
+
+            queue_id, url = row
+            conn.execute('UPDATE queue SET lease_owner = ?, lease_expires = ? WHERE id = ?',
+                         (self.owner, now + LEASE_TIMEOUT, queue_id))
+            conn.execute('INSERT OR REPLACE INTO domain_timing (domain, last_crawl) VALUES (?, ?)', (domain, now))
+        return url
+
+    def ack(self, url):
+        """Record a leased URL as crawled and remove it from the queue"""
+        with self._transaction() as conn:
+            conn.execute('INSERT OR REPLACE INTO crawled (url, crawled_at) VALUES (?, ?)', (url, time.time()))
+            conn.execute('DELETE FROM queue WHERE url = ?', (url,))
+
+    def release_leases(self, owner):
+        """Return every URL leased by owner to the queue. Returns how many were released."""
+        with self._transaction() as conn:
+            cursor = conn.execute('UPDATE queue SET lease_owner = NULL, lease_expires = NULL '
+                                  'WHERE lease_owner = ?', (owner,))
+        return cursor.rowcount
+
+    def release_dead_leases(self):
+        """Release leases held by processes on this machine that no longer exist"""
+        prefix = socket.gethostname() + ':'
+        released = 0
+        owners = self.conn.execute('SELECT DISTINCT lease_owner FROM queue WHERE lease_owner IS NOT NULL')
+        for (owner,) in owners.fetchall():
+            if owner.startswith(prefix) and owner != self.owner and not _pid_alive(int(owner[len(prefix):])):
+                released += self.release_leases(owner)
+        if released:
+            logging.info(f"Returned {released} URLs leased by stopped crawler processes to the queue")
+        return released
+
+    def mark_crawled(self, url):
+        """
+        Record a URL as crawled without fetching it (e.g. the canonical URL of
+        a page fetched under another address) and drop it from the queue.
+        Returns False if it was already crawled.
+        """
+        with self._transaction() as conn:
+            cursor = conn.execute('INSERT OR IGNORE INTO crawled (url, crawled_at) VALUES (?, ?)',
+                                  (url, time.time()))
+            conn.execute('DELETE FROM queue WHERE url = ?', (url,))
+            if self.seen is not None:
+                self.seen.add(url)
+        return cursor.rowcount > 0
+
+    def canonicalize_urls(self, canonicalize, version):
+        """
+        Rewrite stored URLs into canonical form once per canonicalization
+        version: queued URLs are replaced by their canonical form (dropping
+        ones that collapse onto a queued or crawled URL), and the canonical
+        form of every crawled URL is recorded as crawled too. Queued URLs
+        that are not http(s) URLs with a host (junk imported by older
+        versions) are dropped.
+        """
+        if self._get_meta('canonical_version') == str(version):
+            return
+
+        logging.info("Canonicalizing stored URLs...")
+        rewritten = dropped = 0
+        with self._transaction() as conn:
+            for (url,) in conn.execute('SELECT url FROM crawled').fetchall():
+                canonical = canonicalize(url)
+                if canonical != url:
+                    conn.execute('INSERT OR IGNORE INTO crawled (url, crawled_at) VALUES (?, 0)', (canonical,))
+                    if self.seen is not None:
+                        self.seen.add(canonical)
+
+            for queue_id, url in conn.execute('SELECT id, url FROM queue').fetchall():
+                canonical = canonicalize(url)
+                if not _crawlable(canonical):
+                    conn.execute('DELETE FROM queue WHERE id = ?', (queue_id,))
+                    dropped += 1
+                    continue
+                if canonical == url:
+                    continue
+                known = conn.execute(
+                    'SELECT 1 FROM queue WHERE url = ? UNION ALL SELECT 1 FROM crawled WHERE url = ?',
+                    (canonical, canonical)
+                ).fetchone()
+                if known:
+                    conn.execute('DELETE FROM queue WHERE id = ?', (queue_id,))
+                    dropped += 1
+                else:
+                    conn.execute('UPDATE queue SET url = ?, domain = ? WHERE id = ?',
+                                 (canonical, urlparse(canonical).netloc, queue_id))
+                    if self.seen is not None:
+                        self.seen.add(canonical)
+                    rewritten += 1
+
+            self._set_meta(conn, 'canonical_version', version)
+        logging.info(f"Canonicalized {rewritten} queued URLs, dropped {dropped} duplicates and invalid URLs")
+
+    def page_state(self, url):
+        """Return the stored state of a fetched page as a dict, or None"""
+        cursor = self.conn.execute('SELECT * FROM page_state WHERE url = ?', (url,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([column[0] for column in cursor.description], row))
+
+    def record_visit(self, url, etag=None, last_modified=None, content_hash=None):
+        """
+        Store the outcome of fetching a page and schedule its next visit.
+        content_hash None means the server answered 304 Not Modified.
+        Returns 'new', 'changed' or 'unchanged'.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute('SELECT etag, last_modified, content_hash, interval FROM page_state WHERE url = ?',
+                               (url,)).fetchone()
+            if row is None:
+                conn.execute(
+                    'INSERT INTO page_state (url, domain, etag, last_modified, content_hash, '
+                    'last_visit, next_visit, interval) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                    (url, urlparse(url).netloc, etag, last_modified, content_hash,
+                     now, now + REVISIT_INTERVAL, REVISIT_INTERVAL)
+                )
+                return 'new'
+
+            old_etag, old_last_modified, old_hash, interval = row
+            changed = content_hash is not None and content_hash != old_hash
+            if changed:
+                interval = max(MIN_REVISIT_INTERVAL, interval * CHANGED_FACTOR)
+            else:
+                interval = min(MAX_REVISIT_INTERVAL, interval * UNCHANGED_FACTOR)
+            conn.execute(
+                'UPDATE page_state SET etag = ?, last_modified = ?, content_hash = ?, last_visit = ?, '
+                'next_visit = ?, interval = ?, visits = visits + 1, changes = changes + ? WHERE url = ?',
+                (etag or old_etag, last_modified or old_last_modified, content_hash or old_hash,
+                 now, now + interval, interval, int(changed), url)
+            )
+        return 'changed' if changed else 'unchanged'
+
+    def requeue_due(self, limit=1000):
+        """Queue up to limit pages whose next visit is due. Returns how many were queued."""
+        now = time.time()
+        queued = 0
+        with self._transaction() as conn:
+            rows = conn.execute('SELECT url, domain, interval FROM page_state WHERE next_visit <= ? '
+                                'ORDER BY next_visit LIMIT ?', (now, limit)).fetchall()
+            for url, domain, interval in rows:
+                cursor = conn.execute('INSERT OR IGNORE INTO queue (url, domain) VALUES (?, ?)', (url, domain))
+                queued += cursor.rowcount
+                # Not due again until record_visit reschedules it (or a whole interval passes)
+                conn.execute('UPDATE page_state SET next_visit = ? WHERE url = ?', (now + interval, url))
+        return queued
+
+    def pending_domains(self):
+        """Return (domain, last_crawl) for every domain with unleased queued URLs."""
+        return self.conn.execute(
+            'SELECT q.domain, COALESCE(t.last_crawl, 0) '
+            'FROM (SELECT DISTINCT domain FROM queue WHERE lease_expires IS NULL OR lease_expires < ?) q '
+            'LEFT JOIN domain_timing t ON t.domain = q.domain', (time.time(),)
+        ).fetchall()
+
+    def last_crawl(self, domain):
+        row = self.conn.execute('SELECT last_crawl FROM domain_timing WHERE domain = ?', (domain,)).fetchone()
+        return row[0] if row else 0
+
+    def is_empty(self):
+        """True when nothing is queued or leased"""
+        return self.conn.execute('SELECT 1 FROM queue LIMIT 1').fetchone() is None
+
+    def queue_size(self):
+        return self.conn.execute('SELECT COUNT(*) FROM queue').fetchone()[0]
+
+    def crawled_count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM crawled').fetchone()[0]
+
+    def save_checkpoint(self, info):
+        """Store a dict describing the crawl at a clean shutdown"""
+        with self._transaction() as conn:
+            self._set_meta(conn, 'checkpoint', json.dumps(dict(info, clean=True, time=time.time())))
+
+    def load_checkpoint(self):
+        """
+        Return the last checkpoint and mark it stale, so the next start can
+        tell whether this run shut down cleanly. None if there is none.
+        """
+        with self._transaction() as conn:
+            stored = self._get_meta('checkpoint')
+            if stored is None:
+                return None
+            checkpoint = json.loads(stored)
+            self._set_meta(conn, 'checkpoint', json.dumps(dict(checkpoint, clean=False)))
+        return checkpoint
+
+    def load_block_counts(self, host):
+        """The block counts blob saved for a host, or None"""
+        row = self.conn.execute('SELECT counts FROM block_counts WHERE host = ?', (host,)).fetchone()
+        return row[0] if row else None
+
+    def save_block_counts(self, items):
+        """Store (host, blob) pairs of block counts in one transaction"""
+        with self._transaction() as conn:
+            conn.executemany('INSERT OR REPLACE INTO block_counts (host, counts) VALUES (?, ?)', items)
+
+    def instance_id(self):
+        """Random id of this frontier, created on first use; tells a node's batches apart from a reset node's"""
+        with self._transaction() as conn:
+            value = self._get_meta('instance_id')
+            if value is None:
+                value = uuid.uuid4().hex
+                self._set_meta(conn, 'instance_id', value)
+        return value
+
+    def batch_counts(self):
+        """({dest: seq of the last batch sent}, {channel: seq of the last batch received})"""
+        sent = dict(self.conn.execute('SELECT dest, seq FROM batches_sent'))
+        received = dict(self.conn.execute('SELECT channel, seq FROM batches_received'))
+        return sent, received
+
+    def queue_forward(self, items):
+        """Keep (dest, url) pairs of URLs for other nodes until store_batch puts them in a batch"""
+        with self._transaction() as conn:
+            conn.executemany('INSERT INTO forward (dest, url) VALUES (?, ?)', items)
+
+    def forward_counts(self):
+        """{dest: number of URLs waiting to be batched for it}"""
+        return dict(self.conn.execute('SELECT dest, COUNT(*) FROM forward GROUP BY dest'))
+
+    def store_batch(self, dest):
+        """
+        Move the URLs waiting for dest into a new batch, kept until it is
+        acknowledged. Returns (sequence number, urls), or None if no URLs
+        are waiting.
+        """
+        with self._transaction() as conn:
+            rows = conn.execute('SELECT id, url FROM forward WHERE dest = ? ORDER BY id', (dest,)).fetchall()
+            if not rows:
+                return None
+            urls = [url for _, url in rows]
+            conn.execute('DELETE FROM forward WHERE dest = ? AND id <= ?', (dest, rows[-1][0]))
+            row = conn.execute('SELECT seq FROM batches_sent WHERE dest = ?', (dest,)).fetchone()
+            seq = (row[0] if row else 0) + 1
+            conn.execute('INSERT OR REPLACE INTO batches_sent (dest, seq) VALUES (?, ?)', (dest, seq))
+            conn.execute('INSERT INTO outbox (dest, seq, urls) VALUES (?, ?, ?)', (dest, seq, json.dumps(urls)))
+        return seq, urls
+
+    def unacked_batches(self):
+        """[(dest, seq, urls)] of the batches not acknowledged yet, in the order they were sent"""
+        return [(dest, seq, json.loads(urls))
+                for dest, seq, urls in self.conn.execute('SELECT dest, seq, urls FROM outbox ORDER BY dest, seq')]
+
+    def ack_batches(self, dest, seq):
+        """Forget the batches for dest up to seq, which dest has received"""
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM outbox WHERE dest = ? AND seq <= ?', (dest, seq))
+
+    def close(self):
+        if self.seen is not None:
+            self.seen.close()
+        self.conn.close()
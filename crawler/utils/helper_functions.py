@@ -1,6 +1,10 @@
 import os
 import time
+import signal
+import hashlib
 import logging
+import threading
+from collections import deque
 from urllib.parse import urlparse
 import json
 import re
@@ -10,143 +14,413 @@ DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__
 TO_CRAWL_FILE = os.path.join(DATA_DIR, 'to_crawl.txt')
 CRAWLED_FILE = os.path.join(DATA_DIR, 'crawled.txt')
 DOMAIN_TIMING_FILE = os.path.join(DATA_DIR, 'domain_timing.txt')
+FRONTIER_DB = os.path.join(DATA_DIR, 'frontier.db')
+DEDUP_DIR = os.path.join(DATA_DIR, 'dedup')
+SEEN_FILTER_DIR = os.path.join(DATA_DIR, 'seen_urls')
+ROBOTS_CACHE_FILE = os.path.join(DATA_DIR, 'robots_cache.json')
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+
+from utils.frontier import Frontier
+from utils.scheduler import HostScheduler
+from utils.dedup import MinHashIndex
+from utils.page_store import open_store
+from utils.boilerplate import TemplateFilter
+from utils.canonical import canonicalize, CANONICAL_VERSION
+from utils.robots_cache import RobotsCache
+from utils.router import Router, node_name
+from utils.transport import open_transport
+from utils import http_session
+from utils import metrics
+from logging_config import RATE_LIMITED
+
+# Default seconds to wait between two requests to the same domain
+CRAWL_DELAY = 1.0
+
+# Per-domain overrides of CRAWL_DELAY, e.g. {'www.aau.dk': 2.0}
+DOMAIN_CRAWL_DELAYS = {}
+
+# Pages more similar than this (Jaccard) to a saved page are not saved again
+DUPLICATE_THRESHOLD = 0.8
+
+# (index, count) of this worker process when crawling with several workers
+WORKER_SHARD = None
+
+# How often a worker looks for hosts queued by other workers (seconds)
+SHARD_REFRESH_INTERVAL = 2.0
+
+# Re-queue crawled pages whose revisit time has come (see Frontier.record_visit)
+RECRAWL = False
+
+# Strip each site's repeated template blocks before dedup and saving (see TemplateFilter)
+STRIP_BOILERPLATE = True
+
+# (index, count) of this node in a distributed crawl, and the transport
+# spec ('spool:DIR' or 'socket:DIR') it exchanges URLs over (see Router)
+NODE_SHARD = None
+TRANSPORT = None
+
+# How often a node exchanges messages with the other nodes (seconds)
+NODE_POLL_INTERVAL = 0.2
+
+# How often to look for pages due for a revisit (seconds)
+RECRAWL_CHECK_INTERVAL = 60
+
+_frontier = None
+_scheduler = None
+_dedup_index = None
+_page_store = None
+_robots_cache = None
+_template_filter = None
+_router = None
+_next_recrawl_check = 0
+_next_poll = 0
+_stop = threading.Event()
+_last_signature = threading.local()
+_robots_lock = threading.Lock()
+_robots_delays = deque()  # (domain, Crawl-delay) reported by robots threads, applied by grab_next_url
+stop_signal = None
+
+# Compression for newly created page stores: 'none', 'gzip', 'zstd' or
+# 'zstd-dict'; None picks zstd-dict when zstandard is installed, else gzip
+PAGE_COMPRESSION = None
+
+
+def get_frontier():
+    """Open the frontier database, importing the legacy text files on first start."""
+    global _frontier
+    if _frontier is None:
+        _frontier = Frontier(FRONTIER_DB, TO_CRAWL_FILE, CRAWLED_FILE, DOMAIN_TIMING_FILE,
+                             bloom_dir=SEEN_FILTER_DIR)
+        _frontier.canonicalize_urls(canonicalize, CANONICAL_VERSION)
+        _frontier.release_dead_leases()
+    return _frontier
+
+
+def set_data_dir(data_dir):
+    """Point the crawler state files at another raw data directory (must be called before get_frontier)"""
+    global DATA_DIR, TO_CRAWL_FILE, CRAWLED_FILE, DOMAIN_TIMING_FILE, FRONTIER_DB, DEDUP_DIR, SEEN_FILTER_DIR
+    global ROBOTS_CACHE_FILE
+    DATA_DIR = data_dir
+    TO_CRAWL_FILE = os.path.join(DATA_DIR, 'to_crawl.txt')
+    CRAWLED_FILE = os.path.join(DATA_DIR, 'crawled.txt')
+    DOMAIN_TIMING_FILE = os.path.join(DATA_DIR, 'domain_timing.txt')
+    FRONTIER_DB = os.path.join(DATA_DIR, 'frontier.db')
+    DEDUP_DIR = os.path.join(DATA_DIR, 'dedup')
+    SEEN_FILTER_DIR = os.path.join(DATA_DIR, 'seen_urls')
+    ROBOTS_CACHE_FILE = os.path.join(DATA_DIR, 'robots_cache.json')
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        refresh_interval = SHARD_REFRESH_INTERVAL if WORKER_SHARD else None
+        _scheduler = HostScheduler(get_frontier(), CRAWL_DELAY, DOMAIN_CRAWL_DELAYS,
+                                   shard=WORKER_SHARD, refresh_interval=refresh_interval)
+    return _scheduler
+
+
+def get_page_store(processed_dir):
+    """Open the segmented page store inside processed_dir"""
+    global _page_store
+    if _page_store is None:
+        _page_store = open_store(processed_dir, compression=PAGE_COMPRESSION)
+    return _page_store
+
+
+def get_template_filter():
+    global _template_filter
+    if _template_filter is None:
+        # Counts learned by earlier runs are kept in the frontier database
+        _template_filter = TemplateFilter(store=get_frontier())
+    return _template_filter
+
+
+def main_content(url, page):
+    """The page's text without the blocks its site repeats on every page, or all of it with STRIP_BOILERPLATE off"""
+    text = page.text
+    if not STRIP_BOILERPLATE:
+        return text
+    content = get_template_filter().main_text(urlparse(url).netloc.lower(), page.blocks)
+    metrics.boilerplate_chars.inc(amount=len(text) - len(content))
+    return content
+
+
+def get_router():
+    """The router of this node in a distributed crawl, or None"""
+    global _router
+    if _router is None and NODE_SHARD is not None:
+        index, count = NODE_SHARD
+        _router = Router(open_transport(TRANSPORT, node_name(index)), index, count, get_frontier())
+    return _router
+
+
+def _receive_urls(urls, batch):
+    added = get_scheduler().add_urls(urls, batch)
+    metrics.urls_received.inc(amount=len(added))
+
+
+def _local_idle():
+    return get_scheduler().host_count() == 0 and get_frontier().is_empty()
+
+
+def poll_router():
+    """Exchange URLs and status with the other nodes; a stop request from the coordinator stops this node"""
+    global _next_poll
+    _next_poll = time.time() + NODE_POLL_INTERVAL
+    status = {
+        'processed': metrics.urls_processed.total(),
+        'saved': metrics.pages_saved.total(),
+        'queued': queue_size(),
+    }
+    if get_router().poll(_receive_urls, _local_idle, status) and not stop_requested():
+        logging.info("The coordinator asked this node to stop")
+        request_stop()
+
+
+def _fetch_robots(robots_url):
+    response = http_session.get_session().get(robots_url, timeout=2)
+    return response.status_code, response.text
+
+
+def get_robots_cache():
+    global _robots_cache
+    if _robots_cache is None:
+        # The async engine checks robots.txt from several executor threads
+        with _robots_lock:
+            if _robots_cache is None:
+                _robots_cache = RobotsCache(_fetch_robots, ROBOTS_CACHE_FILE,
+                                            on_crawl_delay=set_robots_crawl_delay)
+    return _robots_cache
+
+
+def set_robots_crawl_delay(domain, delay):
+    """
+    Honour a Crawl-delay found in a domain's robots.txt. Called from the
+    robots threads, so the delay is only queued here and handed to the
+    scheduler by the crawl loop (grab_next_url).
+    """
+    _robots_delays.append((domain, float(delay)))
+
+
+def _apply_robots_delays(scheduler):
+    while _robots_delays:
+        domain, delay = _robots_delays.popleft()
+        scheduler.set_robots_delay(domain, delay)
+        logging.debug("Using robots.txt Crawl-delay of %ss for %s", delay, domain)
+
+
+def queue_size():
+    return get_frontier().queue_size()
+
+
+def _queue_depth():
+    with _frontier.lock:
+        return _frontier.queue_size()
+
+
+def register_metrics():
+    """Expose frontier, scheduler, dedup, robots cache and connection pool figures (read on collection)"""
+    metrics.Callback('crawler_queue_depth', 'URLs queued or leased in the frontier', _queue_depth)
+    metrics.Callback('crawler_scheduled_hosts', 'Hosts with queued URLs scheduled by this process',
+                     lambda: _scheduler.host_count())
+    metrics.Callback('crawler_dedup_index_pages', 'Pages in the near-duplicate index', lambda: len(_dedup_index))
+    metrics.Callback('crawler_robots_cache_hosts', 'Hosts with cached robots.txt rules',
+                     lambda: _robots_cache.stats()['hosts'])
+    metrics.Callback('crawler_robots_cache_hits_total', 'robots.txt lookups answered from the cache',
+                     lambda: _robots_cache.stats()['hits'], kind='counter')
+    metrics.Callback('crawler_robots_cache_misses_total', 'robots.txt lookups that needed a fetch',
+                     lambda: _robots_cache.stats()['misses'], kind='counter')
+    metrics.Callback('crawler_http_requests_total', 'HTTP requests sent',
+                     lambda: http_session.stats.summary()['requests'], kind='counter')
+    metrics.Callback('crawler_http_new_connections_total', 'HTTP connections opened (pool misses)',
+                     lambda: http_session.stats.summary()['misses'], kind='counter')
+
+
+def request_stop(signum=None):
+    """Ask the crawl loops to finish the pages in flight and return"""
+    global stop_signal
+    stop_signal = signum
+    _stop.set()
+
+
+def stop_requested():
+    return _stop.is_set()
+
+
+def install_signal_handlers(signals=(signal.SIGINT, signal.SIGTERM)):
+    """
+    Make the given signals request a graceful stop. A second signal raises
+    KeyboardInterrupt to stop immediately; leased URLs are then released at
+    shutdown and crawled again next time.
+    """
+    def handle(signum, frame):
+        if _stop.is_set():
+            raise KeyboardInterrupt
+        logging.info(f"Received {signal.Signals(signum).name}, finishing pages in flight "
+                     f"(send it again to stop immediately)")
+        request_stop(signum)
+
+    for signum in signals:
+        signal.signal(signum, handle)
+
+
+def resume():
+    """Log where the previous run stopped. Returns the number of queued URLs."""
+    checkpoint = get_frontier().load_checkpoint()
+    if checkpoint is None or not checkpoint.get('clean'):
+        if checkpoint is not None:
+            logging.warning("The previous crawl did not shut down cleanly; "
+                            "its unsaved dedup entries are replayed and its leases released")
+        return queue_size()
+    logging.info(f"Resuming the crawl stopped at {time.ctime(checkpoint['time'])} "
+                 f"({checkpoint['crawled']} URLs crawled so far)")
+    return checkpoint['queued']
+
+
+def shutdown(checkpoint=True):
+    """
+    Flush and close everything this process opened: URLs still leased by it
+    go back to the queue, the dedup index writes its band checkpoint, the
+    template filter saves its block counts, and the page store, robots cache
+    and frontier are closed. With checkpoint,
+    the final queue and store sizes are recorded for resume().
+    """
+    global _frontier, _scheduler, _dedup_index, _page_store, _robots_cache, _router, _template_filter
+    if _router is not None:
+        # URLs still waiting for other nodes are sent now
+        _router.close()
+        _router = None
+    if _robots_cache is not None:
+        _robots_cache.close()
+        _robots_cache = None
+        _robots_delays.clear()
+    if _dedup_index is not None:
+        _dedup_index.close()
+        _dedup_index = None
+    if _template_filter is not None:
+        _template_filter.save()
+        _template_filter = None
+    pages = None
+    if _page_store is not None:
+        pages = len(_page_store)
+        _page_store.close()
+        _page_store = None
+    if _frontier is not None:
+        released = _frontier.release_leases(_frontier.owner)
+        if released:
+            logging.info(f"Returned {released} unfinished URLs to the queue")
+        if checkpoint:
+            _frontier.save_checkpoint({
+                'queued': _frontier.queue_size(),
+                'crawled': _frontier.crawled_count(),
+                'pages': pages,
+            })
+        _frontier.close()
+        _frontier = None
+        _scheduler = None
+    logging.info("Crawler state saved")
+
+
+def claim_url(url):
+    """Mark a URL as crawled; returns False if it already was (so it must not be saved again)"""
+    return get_frontier().mark_crawled(url)
+
+
+def requeue_due_pages():
+    """Queue crawled pages that are due for a revisit"""
+    global _next_recrawl_check
+    _next_recrawl_check = time.time() + RECRAWL_CHECK_INTERVAL
+    queued = get_frontier().requeue_due()
+    if queued:
+        logging.info(f"Queued {queued} pages for a revisit")
+        get_scheduler().refresh()
+    return queued
+
+
+def get_page_state(url):
+    """Validators, content hash and revisit schedule of a page crawled before, or None"""
+    return get_frontier().page_state(url)
+
+
+def record_visit(url, headers, text):
+    """
+    Record a fetch of url: response headers (validators) and the page's
+    extracted text, or text None for a 304. Returns 'new', 'changed' or
+    'unchanged'.
+    """
+    content_hash = None
+    if text is not None:
+        content_hash = hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+    headers = headers or {}
+    return get_frontier().record_visit(url, headers.get('ETag'), headers.get('Last-Modified'), content_hash)
+
+
 def grab_next_url():
-    # Load domain timing data
-    domain_times = {}
-    if os.path.exists(DOMAIN_TIMING_FILE):
-        logging.debug("Loading domain timing data")
-        with open(DOMAIN_TIMING_FILE, 'r', encoding='utf-8', errors='replace') as f:
-            for line in f:
-                line = line.strip()
-                if line:
-                    domain, timestamp = line.split('\t')
-                    domain_times[domain] = float(timestamp)
-        logging.debug(f"Loaded timing data for {len(domain_times)} domains")
-    else:
-        logging.debug("No domain timing file found, starting fresh")
-
-    # Read all URLs to crawl
-    if not os.path.exists(TO_CRAWL_FILE):
-        logging.warning(f"To crawl file not found: {TO_CRAWL_FILE}")
-        return None
-
-    with open(TO_CRAWL_FILE, 'r', encoding='utf-8', errors='replace') as f:
-        urls = [line.strip() for line in f if line.strip()]
-
-    logging.debug(f"Found {len(urls)} URLs in queue")
-
-    # Find first URL whose domain can be crawled (>1 second since last crawl)
-    # TODO: Make crawl delay configurable per domain
-    current_time = time.time()
-    selected_url = None
-    rate_limited_count = 0
-
-    for url in urls:
-        domain = urlparse(url).netloc
-        last_crawl_time = domain_times.get(domain, 0)
-        time_since_last = current_time - last_crawl_time
-
-        if time_since_last > 1:
-            selected_url = url
-            logging.debug(f"Selected URL from domain {domain} (last crawled {time_since_last:.1f}s ago)")
-            break
-        else:
-            rate_limited_count += 1
-            if rate_limited_count <= 3:  # Only log first few to avoid spam
-                logging.debug(f"Rate limiting {domain}: only {time_since_last:.1f}s since last crawl")
-
-    if selected_url:
-        # Remove selected URL from to_crawl
-        urls.remove(selected_url)
-        with open(TO_CRAWL_FILE, 'w', encoding='utf-8', errors='replace') as f:
-            for url in urls:
-                f.write(url + '\n')
-
-        logging.debug(f"Removed URL from queue, {len(urls)} remaining")
-
-        # Update domain timing
-        domain = urlparse(selected_url).netloc
-        domain_times[domain] = current_time
-        with open(DOMAIN_TIMING_FILE, 'w', encoding='utf-8', errors='replace') as f:
-            for d, t in domain_times.items():
-                f.write(f"{d}\t{t}\n")
-
-        # Append to crawled file
-        with open(CRAWLED_FILE, 'a', encoding='utf-8', errors='replace') as f:
-            f.write(selected_url + "\n")
-
-        return selected_url
+    if RECRAWL and time.time() >= _next_recrawl_check:
+        requeue_due_pages()
+    if NODE_SHARD is not None and time.time() >= _next_poll:
+        poll_router()
+
+    scheduler = get_scheduler()
+    _apply_robots_delays(scheduler)
+    selected_url = scheduler.next_url()
+
+    while selected_url:
+        # Queued URLs are canonical already unless the canonicalization rules changed
+        canonical = canonicalize(selected_url)
+        if canonical != selected_url:
+            # The lease is on the old form; the canonical form is claimed instead
+            finish_url(selected_url)
+        if canonical == selected_url or claim_url(canonical):
+            logging.debug("Selected URL from domain %s", urlparse(canonical).netloc)
+            return canonical
+        logging.debug("Skipping %s: already crawled as %s", selected_url, canonical)
+        selected_url = scheduler.next_url()
+
+    if scheduler.host_count() > 0:
+        logging.debug("All %s queued hosts rate-limited, waiting...", scheduler.host_count(), extra=RATE_LIMITED)
     else:
-        if rate_limited_count > 0:
-            logging.debug(f"All {rate_limited_count} URLs rate-limited, waiting...")
-        else:
-            logging.info("No URLs available to crawl")
-        return None
+        logging.info("No URLs available to crawl", extra=RATE_LIMITED)
+    return None
+
+
+def finish_url(url):
+    """Acknowledge a URL handed out by grab_next_url once it has been handled (successfully or not)"""
+    get_frontier().ack(url)
+
 
+def nothing_to_crawl():
+    """
+    True when this process has no hosts scheduled and no URL is queued or in
+    flight anywhere. A node of a distributed crawl never decides this on its
+    own: other nodes may still send it URLs, so it waits for the
+    coordinator's stop request instead.
+    """
+    if NODE_SHARD is not None:
+        return False
+    return _local_idle()
 
 
 def save_new_urls(links):
-    def _normalize(u):
-        if not u:
-            return u
-        try:
-            p = urlparse(u)
-            # remove fragment and return normalized URL
-            return p._replace(fragment='').geturl()
-        except Exception:
-            return u
-
-    logging.debug(f"Processing {len(links)} potential new URLs")
-
-    # Read existing URLs from both files
-    # TODO: Consider using database instead of files for better performance
-    to_crawl = set()
-    if os.path.exists(TO_CRAWL_FILE):
-        with open(TO_CRAWL_FILE, 'r', encoding='utf-8', errors='replace') as f:
-            to_crawl = set(_normalize(line.strip()) for line in f if line.strip())
-
-    crawled = set()
-    if os.path.exists(CRAWLED_FILE):
-        with open(CRAWLED_FILE, 'r', encoding='utf-8', errors='replace') as f:
-            crawled = set(_normalize(line.strip()) for line in f if line.strip())
-
-    logging.debug(f"Found {len(to_crawl)} URLs to crawl, {len(crawled)} already crawled")
-
-    # Filter out duplicates
-    new_urls = []
-    duplicate_count = 0
-
-    for link in links:
-        link = link.strip()
-        if link and link not in to_crawl and link not in crawled:
-            new_urls.append(link)
-            to_crawl.add(link)  # Add to set to prevent duplicates within this batch
-        elif link:
-            duplicate_count += 1
-
-    # Append only new URLs to file
-    if new_urls:
-        with open(TO_CRAWL_FILE, 'a', encoding='utf-8', errors='replace') as f:
-            for url in new_urls:
-                f.write(url + '\n')
-        logging.info(f"Added {len(new_urls)} new URLs to queue")
+    logging.debug("Processing %s potential new URLs", len(links))
+
+    links = [canonicalize(link.strip()) for link in links if link and link.strip()]
+    if NODE_SHARD is not None:
+        # URLs of hosts owned by other nodes are forwarded to them
+        local = get_router().route(links)
+        metrics.urls_forwarded.inc(amount=len(links) - len(local))
+        links = local
+    added = get_scheduler().add_urls(links)
+    duplicate_count = len(links) - len(added)
+    metrics.links_queued.inc(amount=len(added))
+
+    if added:
+        logging.debug("Added %s new URLs to queue", len(added))
         if duplicate_count > 0:
-            logging.debug(f"Skipped {duplicate_count} duplicate URLs")
+            logging.debug("Skipped %s duplicate URLs", duplicate_count)
     else:
-        logging.debug(f"No new URLs to add ({duplicate_count} were duplicates)")
-        
-
-def jaccard_similarity(text_a, text_b):
-    a = _tokenize(text_a)
-    b = _tokenize(text_b)
-    if not a and not b:
-        return 1.0
-    union = a | b
-    if not union:
-        return 0.0
-    intersection = a & b
-    return len(intersection) / len(union)
+        logging.debug("No new URLs to add (%s were duplicates)", duplicate_count)
+
 
 def _tokenize(text):
     if not text:
@@ -154,22 +428,62 @@ def _tokenize(text):
     return set(re.findall(r"\w+", text.lower()))
 
 
-# True = the page should save, false = page should be skipped
-def should_save(parsed_html,processed_dir):
-    # new_page
-# loop though all pages
-# if jaccard_similarity(new_page, oldpage) > 0.8:
-#     dont save
-
-# after loop (if not exited) save page
-    for page in os.listdir(processed_dir):
-        full_path = os.path.join(processed_dir, page)
-        with open (full_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        content = data.get('content', '')
-        
-        if jaccard_similarity(parsed_html, content) > 0.8:
-            print("page is matches: " + full_path)
-            return False
-            
-    return True
\ No newline at end of file
+def get_dedup_index(processed_dir):
+    """
+    Open the near-duplicate index. When it is created for the first time the
+    pages already saved in processed_dir are added to it.
+    """
+    global _dedup_index
+    if _dedup_index is None:
+        _dedup_index = MinHashIndex(DEDUP_DIR)
+        if len(_dedup_index) == 0 and os.path.isdir(processed_dir):
+            pages = sorted(f for f in os.listdir(processed_dir) if f.endswith('.json'))
+            store = get_page_store(processed_dir)
+            if pages or len(store):
+                logging.info(f"Building near-duplicate index from {len(pages) + len(store)} saved pages")
+            for page in pages:
+                with open(os.path.join(processed_dir, page), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                _dedup_index.add(_dedup_index.signature(_tokenize(data.get('content', ''))))
+            for doc_id, data in store:
+                _dedup_index.add(_dedup_index.signature(_tokenize(data.get('content', ''))))
+            _dedup_index.save()
+    return _dedup_index
+
+
+def _signature(index, parsed_html):
+    """MinHash signature of a page's text; the last one computed on this thread is reused by record_saved"""
+    cached = getattr(_last_signature, 'page', None)
+    if cached is not None and cached[0] is parsed_html:
+        return cached[1]
+    signature = index.signature(_tokenize(parsed_html))
+    _last_signature.page = (parsed_html, signature)
+    return signature
+
+
+def should_save(parsed_html, processed_dir):
+    # A page is skipped when its (MinHash-estimated) Jaccard similarity to
+    # any saved page is above DUPLICATE_THRESHOLD. Pages that do get saved
+    # are added to the index by record_saved, so later pages are compared
+    # against them.
+    index = get_dedup_index(processed_dir)
+    start = time.perf_counter()
+    signature = _signature(index, parsed_html)
+
+    with index.locked():
+        match = index.find_duplicate(signature, DUPLICATE_THRESHOLD)
+    metrics.stage_seconds.observe(time.perf_counter() - start, 'dedup')
+    if match is not None:
+        doc, similarity = match
+        logging.info("Page matches saved page #%s (similarity %.2f), skipping", doc, similarity)
+        metrics.duplicates.inc()
+        return False
+    return True
+
+
+def record_saved(parsed_html, processed_dir):
+    """Add a page to the near-duplicate index once it has been saved (a failed save must not block later copies)"""
+    index = get_dedup_index(processed_dir)
+    signature = _signature(index, parsed_html)
+    with index.locked():
+        index.add(signature)
@@ -0,0 +1,207 @@
+"""Single-pass extraction of title, visible text blocks, links and canonical URL from HTML"""
+import logging
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+from bs4 import BeautifulSoup, NavigableString
+
+PARSERS = ('selectolax', 'lxml', 'bs4')
+
+# Parser used by parse_html; None picks the fastest one installed
+PARSER = None
+
+# Elements whose text is never shown to a reader
+_HIDDEN_TAGS = ('script', 'style', 'template')
+
+
+class ParsedPage:
+    """
+    What the crawler needs from a page: the title, the visible text as
+    blocks (DOM path, text) in document order, hrefs and canonical href.
+    A block is one run of text between tags and its path is the chain of
+    enclosing tag names, e.g. /html/body/nav/ul/li/a.
+    """
+    __slots__ = ('title', 'blocks', 'links', 'canonical')
+
+    def __init__(self, title, blocks, links, canonical):
+        self.title = title
+        self.blocks = blocks
+        self.links = links
+        self.canonical = canonical
+
+    @property
+    def text(self):
+        """All visible text joined by spaces"""
+        return ' '.join(text for path, text in self.blocks)
+
+
+def available_parsers():
+    available = []
+    if LexborHTMLParser is not None:
+        available.append('selectolax')
+    if etree is not None:
+        available.append('lxml')
+    available.append('bs4')
+    return available
+
+
+def _is_canonical(rel):
+    return rel is not None and 'canonical' in rel.lower().split()
+
+
+class _Extractor:
+    """
+    lxml parser target: receives start/data/end events while libxml2
+    parses, so no tree is built and everything comes out of one pass.
+    """
+
+    def __init__(self):
+        self.title = None
+        self.links = []
+        self.canonical = None
+        self.blocks = []
+        self.paths = ['']
+        self.buffer = []
+        self.hidden = 0
+        self.in_title = False
+
+    def _flush(self):
+        if self.buffer:
+            text = ' '.join(''.join(self.buffer).split())
+            if text:
+                self.blocks.append((self.paths[-1], text))
+                if self.in_title and self.title is None:
+                    self.title = text
+            self.buffer = []
+
+    def start(self, tag, attrib):
+        self._flush()
+        self.paths.append(self.paths[-1] + '/' + tag)
+        if tag == 'a':
+            href = attrib.get('href')
+            if href:
+                self.links.append(href)
+        elif tag == 'link':
+            if self.canonical is None and _is_canonical(attrib.get('rel')):
+                self.canonical = attrib.get('href')
+        elif tag == 'title':
+            self.in_title = True
+        elif tag in _HIDDEN_TAGS:
+            self.hidden += 1
+
+    def end(self, tag):
+        self._flush()
+        if len(self.paths) > 1:
+            self.paths.pop()
+        if tag == 'title':
+            self.in_title = False
+        elif tag in _HIDDEN_TAGS and self.hidden:
+            self.hidden -= 1
+
+    def data(self, data):
+        if not self.hidden:
+            self.buffer.append(data)
+
+    def close(self):
+        self._flush()
+        return ParsedPage(self.title or '', self.blocks, self.links, self.canonical)
+
+
+def _parse_selectolax(content):
+    tree = LexborHTMLParser(content)
+    title = tree.css_first('title')
+    links = [node.attributes.get('href') for node in tree.css('a[href]')]
+    canonical = None
+    for node in tree.css('link[rel]'):
+        if _is_canonical(node.attributes.get('rel')):
+            canonical = node.attributes.get('href')
+            break
+    tree.strip_tags(list(_HIDDEN_TAGS))
+    blocks = []
+    if tree.root is not None:
+        # Nodes come in document order, so a node's parent always has its path already
+        paths = {}
+        for node in tree.root.traverse(include_text=True):
+            parent = node.parent
+            parent_path = paths.get(parent.mem_id, '') if parent is not None else ''
+            if node.is_text_node:
+                text = ' '.join(node.text_content.split())
+                if text:
+                    blocks.append((parent_path, text))
+            elif node.is_element_node:
+                paths[node.mem_id] = parent_path + '/' + node.tag
+    return ParsedPage(
+        title.text(strip=True) if title is not None else '',
+        blocks,
+        [href for href in links if href],
+        canonical,
+    )
+
+
+def _parse_lxml(content):
+    parser = etree.HTMLParser(target=_Extractor(), remove_comments=True, remove_pis=True)
+    if isinstance(content, bytes):
+        # libxml2 assumes Latin-1 without a <meta charset>; most pages are UTF-8
+        try:
+            content = content.decode('utf-8')
+        except UnicodeDecodeError:
+            pass
+    return etree.fromstring(content, parser) if content.strip() else ParsedPage('', [], [], None)
+
+
+def _parse_bs4(content):
+    soup = BeautifulSoup(content, 'html.parser')
+    canonical = None
+    for link in soup.find_all('link', rel=True):
+        if _is_canonical(' '.join(link['rel'])):
+            canonical = link.get('href')
+            break
+    blocks = []
+    for string in soup.find_all(string=True):
+        # Comments, doctypes and CDATA are NavigableString subclasses
+        if type(string) is not NavigableString:
+            continue
+        text = ' '.join(string.split())
+        if text:
+            names = [parent.name for parent in string.parents][-2::-1]
+            if not any(name in _HIDDEN_TAGS for name in names):
+                blocks.append(('/' + '/'.join(names), text))
+    return ParsedPage(
+        soup.title.get_text(strip=True) if soup.title else '',
+        blocks,
+        [link['href'] for link in soup.find_all('a', href=True) if link['href']],
+        canonical,
+    )
+
+
+_BACKENDS = {
+    'selectolax': _parse_selectolax,
+    'lxml': _parse_lxml,
+    'bs4': _parse_bs4,
+}
+
+
+def parse_html(content, parser=None):
+    """
+    Parse an HTML document (bytes or str) into a ParsedPage with the given
+    backend, PARSER, or the fastest installed one. A page the fast backend
+    cannot handle is retried with BeautifulSoup.
+    """
+    name = parser or PARSER or available_parsers()[0]
+    if name not in available_parsers():
+        raise ValueError(f"HTML parser {name} is not available (installed: {', '.join(available_parsers())})")
+    try:
+        return _BACKENDS[name](content)
+    except Exception as e:
+        if name == 'bs4':
+            raise
+        logging.warning("%s failed to parse page (%s), falling back to BeautifulSoup", name, e)
+        return _parse_bs4(content)
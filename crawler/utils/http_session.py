@@ -0,0 +1,183 @@
+"""Shared HTTP sessions with per-host keep-alive connection pools"""
+import logging
+import threading
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Number of per-host pools kept open (least recently used hosts are closed first)
+POOL_CONNECTIONS = 100
+
+# Keep-alive connections kept per host
+POOL_MAXSIZE = 10
+
+# Largest (decoded) response body we download; bigger pages are abandoned
+MAX_BODY_SIZE = 5 * 1024 * 1024
+
+# Bytes read from the socket at a time while streaming a body
+CHUNK_SIZE = 64 * 1024
+
+
+class PoolStats:
+    """
+    Per-host count of requests and of new connections opened for them.
+
+    A request that did not need a new connection reused a pooled keep-alive
+    connection (a pool hit); every new connection is a pool miss and pays
+    for a TCP and, for https, a TLS handshake.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hosts = {}  # host -> [requests, new_connections]
+
+    def _counters(self, host):
+        return self.hosts.setdefault(host, [0, 0])
+
+    def record_request(self, host):
+        with self.lock:
+            self._counters(host)[0] += 1
+
+    def record_connection(self, host):
+        with self.lock:
+            self._counters(host)[1] += 1
+
+    def summary(self):
+        """Return total requests, hits, misses and hit rate"""
+        with self.lock:
+            requests_made = sum(c[0] for c in self.hosts.values())
+            misses = sum(c[1] for c in self.hosts.values())
+        hits = max(requests_made - misses, 0)
+        return {
+            'requests': requests_made,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / requests_made if requests_made else 0.0,
+        }
+
+    def per_host(self):
+        with self.lock:
+            return {host: {'requests': r, 'hits': max(r - c, 0), 'misses': c}
+                    for host, (r, c) in self.hosts.items()}
+
+    def log_summary(self):
+        s = self.summary()
+        logging.info(f"Connection pool: {s['requests']} requests, {s['hits']} reused, "
+                     f"{s['misses']} new connections ({s['hit_rate']:.0%} hit rate)")
+
+
+stats = PoolStats()
+
+
+# Count socket connects rather than pool connection objects: urllib3 reuses a
+# pooled connection object and silently reconnects it if the server closed it.
+class _CountingHTTPConnection(HTTPConnection):
+    def connect(self):
+        stats.record_connection(self.host)
+        super().connect()
+
+
+class _CountingHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        stats.record_connection(self.host)
+        super().connect()
+
+
+class _CountingHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _CountingHTTPConnection
+
+
+class _CountingHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _CountingHTTPSConnection
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connection pools report hits and misses to `stats`"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _CountingHTTPConnectionPool,
+            'https': _CountingHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        stats.record_request(urlparse(request.url).hostname)
+        return super().send(request, **kwargs)
+
+
+def create_session(pool_connections=None, pool_maxsize=None):
+    """Create a requests.Session that keeps up to pool_maxsize keep-alive connections per host"""
+    adapter = PooledHTTPAdapter(
+        pool_connections=pool_connections or POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize or POOL_MAXSIZE,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def accept_headers(url, status_code, headers, max_body_size=None):
+    """
+    Decide from the status line and headers alone whether a response body is
+    worth downloading: it must be a 200 text/html response whose declared
+    Content-Length (if any) fits in max_body_size.
+    """
+    if status_code != 200:
+        logging.warning("HTTP %s for %s", status_code, url)
+        return False
+
+    content_type = headers.get('Content-Type', '').lower()
+    if 'text/html' not in content_type:
+        logging.debug("Skipping non-HTML response (%s): %s", content_type, url)
+        return False
+
+    max_body_size = max_body_size or MAX_BODY_SIZE
+    content_length = headers.get('Content-Length', '')
+    if content_length.isdigit() and int(content_length) > max_body_size:
+        logging.warning("Skipping %s: Content-Length %s exceeds %s bytes", url, content_length, max_body_size)
+        return False
+    return True
+
+
+def conditional_headers(state):
+    """Request headers that turn a revisit of a page (state from Frontier.page_state) into a conditional GET"""
+    headers = {}
+    if state:
+        if state.get('etag'):
+            headers['If-None-Match'] = state['etag']
+        if state.get('last_modified'):
+            headers['If-Modified-Since'] = state['last_modified']
+    return headers
+
+
+# fetch_page / AsyncCrawler._fetch result for a 304 response
+NOT_MODIFIED = object()
+
+
+_session = None
+
+
+def get_session():
+    """Return the process-wide pooled session, creating it on first use"""
+    global _session
+    if _session is None:
+        _session = create_session()
+    return _session
+
+
+def httpx_trace_hook(host):
+    """
+    Return an httpcore trace callback that counts new connections to `host`.
+
+    Pass it as extensions={'trace': ...} on httpx requests; with HTTP/2 a
+    single connection serves many concurrent requests, which shows up as hits.
+    """
+    async def trace(event_name, info):
+        if event_name == 'connection.connect_tcp.complete':
+            stats.record_connection(host)
+    return trace
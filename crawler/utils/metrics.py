@@ -0,0 +1,216 @@
+"""Crawler metrics: counters and histograms, a Prometheus /metrics endpoint and a periodic log summary"""
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Seconds between two metric summaries in the log
+LOG_INTERVAL = 60
+
+# Histogram bucket upper bounds for stage timings (seconds)
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=''):
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """Monotonic count, optionally split by label values"""
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def total(self):
+        with self.lock:
+            return sum(self.values.values())
+
+    def get(self, *label_values):
+        with self.lock:
+            return self.values.get(label_values, 0)
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {value}' for key, value in values]
+
+
+class Histogram:
+    """Distribution of observed values in cumulative buckets, optionally split by label values"""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=TIME_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self.lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(self.buckets)] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        """Observe how long the with-block takes"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *label_values)
+
+    def count_and_sum(self, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                return 0, 0.0
+            return sum(series[:-1]), series[-1]
+
+    def render(self):
+        with self.lock:
+            items = sorted((key, list(series)) for key, series in self.series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), series[:-1]):
+                cumulative += count
+                le = 'le="%s"' % bound
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {series[-1]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {cumulative}')
+        return lines
+
+
+class Callback:
+    """Value read from elsewhere (queue depth, cache statistics) when metrics are collected"""
+
+    def __init__(self, name, help_text, read, kind='gauge'):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.kind = kind
+        _registry.append(self)
+
+    def render(self):
+        try:
+            return [f'{self.name} {self.read()}']
+        except Exception as e:
+            logging.debug(f"Could not read metric {self.name}: {e}")
+            return []
+
+
+urls_processed = Counter('crawler_urls_processed_total', 'URLs taken from the frontier')
+fetches = Counter('crawler_fetches_total', 'Fetch outcomes', ['outcome'])
+errors = Counter('crawler_errors_total', 'URLs that failed', ['kind'])
+bytes_downloaded = Counter('crawler_bytes_downloaded_total', 'HTML body bytes downloaded')
+pages_saved = Counter('crawler_pages_saved_total', 'Pages written to the page store')
+duplicates = Counter('crawler_duplicate_pages_total', 'Pages not saved because a near-duplicate was saved before')
+links_queued = Counter('crawler_links_queued_total', 'New URLs added to the frontier')
+urls_forwarded = Counter('crawler_urls_forwarded_total', 'Discovered URLs routed to the node that owns their host')
+urls_received = Counter('crawler_urls_received_total', 'New URLs queued from batches sent by other nodes')
+boilerplate_chars = Counter('crawler_boilerplate_chars_total', 'Characters of site template text stripped from pages')
+stage_seconds = Histogram('crawler_stage_seconds', 'Time spent per page in each crawl stage', ['stage'])
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.append(f'# HELP {metric.name} {metric.help_text}')
+        lines.append(f'# TYPE {metric.name} {metric.kind}')
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port, host='127.0.0.1'):
+    """Serve /metrics on host:port from a background thread"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+class _Summary:
+    def __init__(self):
+        self.last_time = time.time()
+        self.last_processed = 0
+
+    def log(self):
+        now = time.time()
+        processed = urls_processed.total()
+        rate = (processed - self.last_processed) / max(now - self.last_time, 1e-9)
+        self.last_time, self.last_processed = now, processed
+
+        stages = []
+        for stage in ('fetch', 'parse', 'boilerplate', 'dedup', 'save', 'links', 'enqueue'):
+            count, total = stage_seconds.count_and_sum(stage)
+            if count:
+                stages.append(f"{stage} {total / count * 1000:.1f}ms")
+        saved = pages_saved.total()
+        dupes = duplicates.total()
+        logging.info(f"Metrics: {rate:.2f} URLs/s, {processed} processed, {saved} saved, "
+                     f"{dupes} duplicates, {bytes_downloaded.total() / 1e6:.1f} MB downloaded, "
+                     f"{errors.total()} errors; mean per page: {', '.join(stages) or 'n/a'}")
+
+
+_summary = _Summary()
+
+
+def log_summary():
+    _summary.log()
+
+
+def start_summary_logging(interval=None):
+    """Log a metrics summary every `interval` seconds from a background thread"""
+    interval = interval or LOG_INTERVAL
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            log_summary()
+
+    threading.Thread(target=loop, name='metrics-summary', daemon=True).start()
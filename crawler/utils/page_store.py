@@ -0,0 +1,384 @@
+"""Segmented append-only store for crawled pages"""
+import os
+import json
+import gzip
+import fcntl
+import struct
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from urllib.parse import urlparse, quote, unquote
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Name of the store directory inside data/processed
+STORE_DIRNAME = 'pages'
+
+# Start a new segment once the current one grows past this many bytes
+SEGMENT_SIZE = 64 * 1024 * 1024
+
+COMPRESSIONS = ('none', 'gzip', 'zstd', 'zstd-dict')
+
+# zstd-dict: pages of a host are sampled until DICT_SAMPLES of them are
+# stored, then a DICT_SIZE dictionary is trained on them for its later pages
+DICT_SAMPLES = 32
+DICT_SIZE = 64 * 1024
+
+# Only the first SAMPLE_BYTES of a page are kept as a training sample, and
+# samples are kept for at most MAX_SAMPLED_HOSTS hosts at a time
+SAMPLE_BYTES = 16 * 1024
+MAX_SAMPLED_HOSTS = 256
+
+ZSTD_LEVEL = 3
+
+# Offset index entry: segment number, byte offset, record length
+_ENTRY = struct.Struct('<IQI')
+
+# zstd-dict record payload header: metadata JSON, text and HTML lengths
+_PAYLOAD = struct.Struct('<III')
+
+
+def default_compression():
+    """zstd with per-host dictionaries when zstandard is installed, gzip otherwise"""
+    return 'zstd-dict' if zstandard is not None else 'gzip'
+
+
+class PageStore:
+    """
+    Pages are appended as records to numbered segment files
+    (segment_000001.dat, ...). Each record is one JSON document, compressed
+    on its own when the store uses gzip or zstd, so any record can be
+    decoded without touching its neighbours.
+
+    A zstd-dict store (version 2) keeps the raw HTML next to the text. A
+    record is one zstd frame holding a _PAYLOAD header, the metadata JSON
+    (url, title), the UTF-8 text and the HTML, in that order, so the text
+    can be read without decompressing the HTML behind it. Pages of a host
+    share a dictionary trained on its first pages (templates, navigation and
+    footers repeat on every page); the frame header names the dictionary,
+    which is stored in dicts/<host>.zdict.
+
+    index.bin holds one fixed-size entry per doc id, in doc id order, so
+    random access is one seek into the index plus one read from a segment.
+    The next doc id is first_doc_id + number of index entries; appends take
+    an exclusive file lock, so several crawler processes can share a store
+    without id collisions.
+    """
+
+    def __init__(self, directory, compression='gzip', segment_size=SEGMENT_SIZE, first_doc_id=1):
+        self.directory = directory
+        self.segment_size = segment_size
+        os.makedirs(directory, exist_ok=True)
+
+        meta_file = os.path.join(directory, 'store.json')
+        if os.path.exists(meta_file):
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        else:
+            meta = {'version': 2 if compression == 'zstd-dict' else 1, 'compression': compression,
+                    'first_doc_id': first_doc_id}
+            tmp_file = meta_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, indent=2)
+            os.replace(tmp_file, meta_file)
+
+        self.compression = meta['compression']
+        self.first_doc_id = meta['first_doc_id']
+        if self.compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown page store compression: {self.compression}")
+        if self.compression in ('zstd', 'zstd-dict') and zstandard is None:
+            raise RuntimeError("This page store is zstd-compressed; pip install zstandard")
+
+        self.lock_file = open(os.path.join(directory, 'store.lock'), 'a+b')
+        self.index_file = open(os.path.join(directory, 'index.bin'), 'a+b')
+        self.segments = {}
+        # flock does not exclude threads sharing our file descriptor
+        self.thread_lock = threading.RLock()
+
+        self.dict_dir = os.path.join(directory, 'dicts')
+        self.host_dicts = {}  # host -> ZstdCompressionDict
+        self.dicts_by_id = {}  # dict id -> ZstdCompressionDict
+        self.samples = OrderedDict()  # host -> training samples
+        if self.compression == 'zstd-dict':
+            os.makedirs(self.dict_dir, exist_ok=True)
+            self._load_dicts()
+
+        with self._locked():
+            self._recover()
+
+    @contextmanager
+    def _locked(self):
+        """Hold an exclusive lock on the store across processes and threads"""
+        with self.thread_lock:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _segment_path(self, number):
+        return os.path.join(self.directory, f"segment_{number:06d}.dat")
+
+    def _segment(self, number):
+        f = self.segments.get(number)
+        if f is None:
+            f = self.segments[number] = open(self._segment_path(number), 'a+b')
+        return f
+
+    def _entry_count(self):
+        return os.fstat(self.index_file.fileno()).st_size // _ENTRY.size
+
+    def _entry(self, position):
+        data = os.pread(self.index_file.fileno(), _ENTRY.size, position * _ENTRY.size)
+        if len(data) < _ENTRY.size:
+            return None
+        return _ENTRY.unpack(data)
+
+    def _recover(self):
+        """Drop a torn index entry and segment bytes that were written but never indexed"""
+        index_size = os.fstat(self.index_file.fileno()).st_size
+        if index_size % _ENTRY.size:
+            os.truncate(self.index_file.fileno(), index_size - index_size % _ENTRY.size)
+
+        count = self._entry_count()
+        segment, end = 1, 0
+        if count:
+            segment, offset, length = self._entry(count - 1)
+            end = offset + length
+        path = self._segment_path(segment)
+        if os.path.exists(path) and os.path.getsize(path) > end:
+            logging.warning(f"Truncating unindexed data at the end of {path}")
+            os.truncate(path, end)
+
+    def _dict_path(self, host):
+        return os.path.join(self.dict_dir, quote(host, safe='') + '.zdict')
+
+    def _load_dict(self, path):
+        with open(path, 'rb') as f:
+            dictionary = zstandard.ZstdCompressionDict(f.read())
+        dictionary.precompute_compress(level=ZSTD_LEVEL)
+        self.dicts_by_id[dictionary.dict_id()] = dictionary
+        return dictionary
+
+    def _load_dicts(self):
+        """Load the dictionaries of all hosts, including ones trained by other processes since the last call"""
+        for name in os.listdir(self.dict_dir):
+            if name.endswith('.zdict'):
+                host = unquote(name[:-len('.zdict')])
+                if host not in self.host_dicts:
+                    self.host_dicts[host] = self._load_dict(os.path.join(self.dict_dir, name))
+
+    def _train(self, host, samples):
+        """Train the dictionary for host, or adopt the one another process trained first"""
+        path = self._dict_path(host)
+        with self._locked():
+            if os.path.exists(path):
+                self.host_dicts[host] = self._load_dict(path)
+                return
+            try:
+                dictionary = zstandard.train_dictionary(DICT_SIZE, samples, level=ZSTD_LEVEL)
+            except zstandard.ZstdError as e:
+                logging.debug("Could not train a compression dictionary for %s: %s", host, e)
+                return
+            tmp_file = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(dictionary.as_bytes())
+            os.replace(tmp_file, path)
+            self.host_dicts[host] = self._load_dict(path)
+        logging.info("Trained a %s byte compression dictionary for %s on %s pages",
+                     len(dictionary), host, len(samples))
+
+    def _dictionary_for(self, host, payload):
+        """The host's dictionary, or None while its pages are still being sampled"""
+        with self.thread_lock:
+            dictionary = self.host_dicts.get(host)
+            if dictionary is not None:
+                return dictionary
+            samples = self.samples.pop(host, [])
+            samples.append(bytes(payload[:SAMPLE_BYTES]))
+            if len(samples) < DICT_SAMPLES:
+                self.samples[host] = samples
+                while len(self.samples) > MAX_SAMPLED_HOSTS:
+                    self.samples.popitem(last=False)
+                return None
+            self._train(host, samples)
+        return None
+
+    def _encode_payload(self, page, html):
+        page = dict(page)
+        text = page.pop('content', '').encode('utf-8')
+        meta = json.dumps(page, ensure_ascii=False).encode('utf-8')
+        html = html or b''
+        if isinstance(html, str):
+            html = html.encode('utf-8')
+        payload = b''.join((_PAYLOAD.pack(len(meta), len(text), len(html)), meta, text, html))
+
+        host = urlparse(page.get('url', '')).netloc.lower()
+        dictionary = self._dictionary_for(host, payload) if host else None
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dictionary).compress(payload)
+
+    def _encode(self, page, html=None):
+        if self.compression == 'zstd-dict':
+            return self._encode_payload(page, html)
+        data = json.dumps(page, ensure_ascii=False).encode('utf-8')
+        if self.compression == 'gzip':
+            return gzip.compress(data, compresslevel=6)
+        if self.compression == 'zstd':
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+        return data + b'\n'
+
+    def _decode(self, data):
+        if self.compression == 'gzip':
+            data = gzip.decompress(data)
+        elif self.compression == 'zstd':
+            data = zstandard.ZstdDecompressor().decompress(data)
+        return json.loads(data)
+
+    def _decompressor(self, record):
+        dict_id = zstandard.get_frame_parameters(record).dict_id
+        if not dict_id:
+            return zstandard.ZstdDecompressor()
+        with self.thread_lock:
+            dictionary = self.dicts_by_id.get(dict_id)
+            if dictionary is None:
+                self._load_dicts()
+                dictionary = self.dicts_by_id.get(dict_id)
+        if dictionary is None:
+            raise ValueError(f"Page store dictionary {dict_id} is missing from {self.dict_dir}")
+        return zstandard.ZstdDecompressor(dict_data=dictionary)
+
+    def _read_payload(self, doc_id, part):
+        """
+        Decompress a zstd-dict record up to and including `part` (0 = metadata,
+        1 = text, 2 = HTML) into one buffer, stopping before the parts after it.
+        Returns the metadata dict and a memoryview of the buffer plus the
+        offsets where text and HTML start.
+        """
+        record = self.read_record(doc_id)
+        with self._decompressor(record).stream_reader(record) as reader:
+            header = bytearray(_PAYLOAD.size)
+            _read_into(reader, memoryview(header))
+            lengths = _PAYLOAD.unpack(header)
+            buffer = memoryview(bytearray(sum(lengths[:part + 1])))
+            _read_into(reader, buffer)
+        text_start = lengths[0]
+        html_start = text_start + lengths[1]
+        return json.loads(bytes(buffer[:text_start])), buffer, text_start, html_start
+
+    def append(self, page, html=None):
+        """
+        Store a page dict and return its doc id. The raw html (bytes or str)
+        is kept as well in a zstd-dict store and dropped by the older formats.
+        """
+        record = self._encode(page, html)
+        with self._locked():
+            count = self._entry_count()
+            segment = 1
+            if count:
+                segment = self._entry(count - 1)[0]
+            f = self._segment(segment)
+            offset = os.fstat(f.fileno()).st_size
+            if offset and offset + len(record) > self.segment_size:
+                segment += 1
+                f = self._segment(segment)
+                offset = os.fstat(f.fileno()).st_size
+
+            f.write(record)
+            f.flush()
+            self.index_file.write(_ENTRY.pack(segment, offset, len(record)))
+            self.index_file.flush()
+        return self.first_doc_id + count
+
+    def read_record(self, doc_id):
+        """Return the raw (possibly compressed) bytes stored for a doc id"""
+        entry = self._entry(doc_id - self.first_doc_id) if doc_id >= self.first_doc_id else None
+        if entry is None:
+            raise KeyError(doc_id)
+        segment, offset, length = entry
+        return os.pread(self._segment(segment).fileno(), length, offset)
+
+    def get(self, doc_id):
+        """Return the page dict stored under doc_id"""
+        if self.compression == 'zstd-dict':
+            meta, text = self.get_text(doc_id)
+            meta['content'] = str(text, 'utf-8')
+            return meta
+        return self._decode(self.read_record(doc_id))
+
+    def get_meta(self, doc_id):
+        """Return the page dict without its content (only the metadata is decompressed in a zstd-dict store)"""
+        if self.compression == 'zstd-dict':
+            return self._read_payload(doc_id, 0)[0]
+        page = self.get(doc_id)
+        page.pop('content', None)
+        return page
+
+    def get_text(self, doc_id):
+        """
+        Return (metadata dict, memoryview of the UTF-8 text). In a zstd-dict
+        store the view points into the decompression buffer, so the text is
+        never copied before the caller decodes or tokenizes it.
+        """
+        if self.compression == 'zstd-dict':
+            meta, buffer, text_start, html_start = self._read_payload(doc_id, 1)
+            return meta, buffer[text_start:html_start]
+        page = self.get(doc_id)
+        return page, memoryview(page.pop('content', '').encode('utf-8'))
+
+    def get_html(self, doc_id):
+        """Return the raw HTML bytes saved with a page, or None if the store does not keep HTML"""
+        if self.compression != 'zstd-dict':
+            return None
+        meta, buffer, text_start, html_start = self._read_payload(doc_id, 2)
+        return bytes(buffer[html_start:])
+
+    def __len__(self):
+        return self._entry_count()
+
+    def __iter__(self):
+        """Yield (doc_id, page) for every stored page in doc id order"""
+        for position in range(self._entry_count()):
+            doc_id = self.first_doc_id + position
+            yield doc_id, self.get(doc_id)
+
+    def next_doc_id(self):
+        return self.first_doc_id + self._entry_count()
+
+    def close(self):
+        self.samples.clear()
+        for f in self.segments.values():
+            f.close()
+        self.segments.clear()
+        self.index_file.close()
+        self.lock_file.close()
+
+
+def _read_into(reader, buffer):
+    """Fill a memoryview from a zstd stream reader (readinto may return less than asked for)"""
+    filled = 0
+    while filled < len(buffer):
+        count = reader.readinto(buffer[filled:])
+        if not count:
+            raise ValueError("Truncated page store record")
+        filled += count
+
+
+def open_store(processed_dir, compression=None):
+    """
+    Open (or create) the page store in processed_dir. A new store starts its
+    doc ids after the legacy page_N.json files already in processed_dir.
+    """
+    store_dir = os.path.join(processed_dir, STORE_DIRNAME)
+    first_doc_id = 1
+    if not os.path.exists(os.path.join(store_dir, 'store.json')) and os.path.isdir(processed_dir):
+        for name in os.listdir(processed_dir):
+            if name.startswith('page_') and name.endswith('.json'):
+                try:
+                    first_doc_id = max(first_doc_id, int(name[5:-5]) + 1)
+                except ValueError:
+                    continue
+    return PageStore(store_dir, compression=compression or default_compression(), first_doc_id=first_doc_id)
@@ -0,0 +1,216 @@
+"""TTL/LRU cache of robots.txt rules with background prefetching"""
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+# How long a fetched robots.txt is trusted
+ROBOTS_TTL = 24 * 3600
+
+# How long a failed fetch (timeout, connection error, 5xx) is remembered
+NEGATIVE_TTL = 3600
+
+# Google only reads the first 500 KiB of a robots.txt, and so do we
+MAX_ROBOTS_SIZE = 500 * 1024
+
+
+class _Entry:
+    __slots__ = ('expires', 'status', 'text', 'parser', 'delay_reported')
+
+    def __init__(self, expires, status, text):
+        self.expires = expires
+        self.status = status
+        self.text = text
+        self.parser = None
+        self.delay_reported = False  # on_crawl_delay called for this entry
+
+    def get_parser(self):
+        """Parse lazily: entries loaded from disk may never be consulted"""
+        if self.parser is None and self.text is not None:
+            parser = RobotFileParser()
+            parser.parse(self.text.splitlines())
+            self.parser = parser
+        return self.parser
+
+
+class RobotsCache:
+    """
+    robots.txt rules per origin (scheme://host:port).
+
+    Entries expire after ROBOTS_TTL, failed fetches are cached for the
+    shorter NEGATIVE_TTL (and allow crawling, like the old behaviour), and
+    at most max_entries origins are kept, evicting the least recently used.
+    Fetches run on a small thread pool: lookup() never blocks and only
+    answers from the cache, scheduling a prefetch on a miss, while
+    can_fetch() waits for the rules when the caller is about to fetch.
+
+    on_crawl_delay(host, delay) is called with a host's Crawl-delay when its
+    robots.txt is fetched, and for entries loaded from disk on their first
+    use, so the delay holds across restarts. It runs on a prefetch thread
+    or the thread that looked the host up, so it should only record the
+    delay for the crawl loop to apply.
+    """
+
+    def __init__(self, fetch, path=None, max_entries=50000, workers=4, user_agent='*', on_crawl_delay=None):
+        self.fetch = fetch  # fetch(robots_url) -> (status_code, text)
+        self.path = path
+        self.max_entries = max_entries
+        self.user_agent = user_agent
+        self.on_crawl_delay = on_crawl_delay
+        self.entries = OrderedDict()
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='robots')
+        self.hits = 0
+        self.misses = 0
+        self.dirty = 0
+        self._load()
+
+    @staticmethod
+    def origin(url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not load robots cache {self.path}: {e}")
+            return
+
+        now = time.time()
+        for origin, (expires, status, text) in stored.items():
+            if expires > now:
+                self.entries[origin] = _Entry(expires, status, text)
+        logging.info(f"Loaded robots.txt rules for {len(self.entries)} hosts")
+
+    def save(self):
+        """Write unexpired entries to disk (atomically)"""
+        if not self.path:
+            return
+        # Prefetch threads may save at the same time; they would share the temporary file
+        with self.save_lock:
+            now = time.time()
+            with self.lock:
+                stored = {origin: [e.expires, e.status, e.text]
+                          for origin, e in self.entries.items() if e.expires > now}
+                self.dirty = 0
+            tmp_file = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(stored, f)
+            os.replace(tmp_file, self.path)
+
+    def _get(self, origin):
+        with self.lock:
+            entry = self.entries.get(origin)
+            if entry is not None and entry.expires <= time.time():
+                del self.entries[origin]
+                entry = None
+            if entry is not None:
+                self.entries.move_to_end(origin)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if entry is not None and not entry.delay_reported:
+            # Loaded from disk: its Crawl-delay has not been reported in this process yet
+            self._report_crawl_delay(origin, entry)
+        return entry
+
+    def _report_crawl_delay(self, origin, entry):
+        entry.delay_reported = True
+        parser = entry.get_parser()
+        if parser is not None and self.on_crawl_delay is not None:
+            crawl_delay = parser.crawl_delay(self.user_agent)
+            if crawl_delay:
+                self.on_crawl_delay(urlparse(origin).netloc, crawl_delay)
+
+    def _store(self, origin, entry):
+        with self.lock:
+            self.entries[origin] = entry
+            self.entries.move_to_end(origin)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.pending.pop(origin, None)
+            self.dirty += 1
+            save = self.dirty >= 100
+        if save:
+            self.save()
+
+    def _fetch_rules(self, origin):
+        robots_url = origin + '/robots.txt'
+        try:
+            logging.debug("Reading robots.txt for domain: %s", origin)
+            status, text = self.fetch(robots_url)
+        except Exception as e:
+            # If we can't read robots.txt, assume we can crawl (for a while)
+            logging.warning("Could not read robots.txt for %s: %s", origin, e)
+            entry = _Entry(time.time() + NEGATIVE_TTL, None, None)
+        else:
+            if status == 200:
+                logging.debug("Successfully loaded robots.txt for %s", origin)
+                entry = _Entry(time.time() + ROBOTS_TTL, status, text[:MAX_ROBOTS_SIZE])
+            else:
+                logging.debug("robots.txt returned %s for %s, assuming crawl allowed", status, origin)
+                ttl = NEGATIVE_TTL if status >= 500 else ROBOTS_TTL
+                entry = _Entry(time.time() + ttl, status, None)
+
+        self._report_crawl_delay(origin, entry)
+        self._store(origin, entry)
+        return entry
+
+    def prefetch(self, url):
+        """Start fetching a host's robots.txt in the background unless it is cached or in flight"""
+        origin = self.origin(url)
+        with self.lock:
+            if origin in self.entries or origin in self.pending:
+                return self.pending.get(origin)
+            future = self.pending[origin] = self.executor.submit(self._fetch_rules, origin)
+        return future
+
+    def _allowed(self, entry, url):
+        parser = entry.get_parser()
+        if parser is None:
+            return True
+        can_crawl = parser.can_fetch(self.user_agent, url)
+        if not can_crawl:
+            logging.debug("Robots.txt disallows crawling: %s", url)
+        return can_crawl
+
+    def lookup(self, url):
+        """True/False from cached rules, or None (and a background prefetch) if the host is not cached"""
+        entry = self._get(self.origin(url))
+        if entry is None:
+            self.prefetch(url)
+            return None
+        return self._allowed(entry, url)
+
+    def can_fetch(self, url, timeout=None):
+        """Check a URL, waiting for the host's robots.txt if it is not cached yet"""
+        entry = self._get(self.origin(url))
+        if entry is None:
+            future = self.prefetch(url)
+            if future is not None:
+                entry = future.result(timeout)
+            else:
+                entry = self._get(self.origin(url))
+            if entry is None:
+                return True
+        return self._allowed(entry, url)
+
+    def stats(self):
+        with self.lock:
+            return {'hosts': len(self.entries), 'hits': self.hits, 'misses': self.misses}
+
+    def close(self):
+        """Drop prefetches not started yet, wait for the running ones and save"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.save()
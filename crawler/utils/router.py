@@ -0,0 +1,204 @@
+"""Routing of discovered URLs between the nodes of a distributed crawl"""
+import time
+import hashlib
+import logging
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# Forward URLs for another node once this many are waiting for it...
+BATCH_SIZE = 500
+
+# ...or once the oldest has waited this many seconds
+FLUSH_INTERVAL = 1.0
+
+# Seconds between two status reports to the coordinator
+STATUS_INTERVAL = 1.0
+
+# A batch not acknowledged this many seconds after it was sent is sent again
+ACK_TIMEOUT = 10.0
+
+# URLs already forwarded are remembered (up to this many) and not sent again;
+# the owner's frontier drops duplicates anyway, this only saves traffic
+FORWARDED_CACHE_SIZE = 100000
+
+COORDINATOR = 'coordinator'
+
+
+def node_name(index):
+    return f"node-{index}"
+
+
+@lru_cache(maxsize=100000)
+def node_for(host, count):
+    """
+    Index of the node that owns a host. Uses a different hash than the
+    worker shards (HostScheduler.owns), so the workers inside a node still
+    split its hosts evenly.
+    """
+    digest = hashlib.blake2b(host.encode('utf-8'), digest_size=4).digest()
+    return int.from_bytes(digest, 'little') % count
+
+
+class Router:
+    """
+    The node side of a distributed crawl. Each node crawls the hosts that
+    hash to it (node_for), so per-host politeness stays local to one node.
+    route() keeps the URLs the node owns and stores the others in the
+    node's frontier, where they wait for their node until enough have
+    collected or the oldest is old enough to send them as a batch. poll() sends due batches, hands received batches to the local
+    frontier, reports progress to the coordinator and returns True when
+    the coordinator asks the node to stop.
+
+    Batches are numbered per destination and kept in the store until the
+    destination acknowledges them; a batch not
+    acknowledged within ACK_TIMEOUT, or any unacknowledged batch after a
+    restart, is sent again. A receiver applies the batches of each sender
+    in order: the next number is queued in the same transaction that
+    records it, anything else is a duplicate or follows a lost batch and
+    is dropped (the sender resends from the lost one). Either way the
+    receiver acknowledges the last batch it applied.
+
+    The status reports carry the last batch number sent to each node and
+    received from each sender. Like the URLs waiting for a batch, these
+    survive a crash, so the coordinator can tell that no URLs are in
+    transit when it decides the crawl is done even if nodes were restarted.
+    """
+
+    def __init__(self, transport, index, count, store, batch_size=BATCH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.transport = transport
+        self.index = index
+        self.count = count
+        self.store = store
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = node_name(index)
+        # Batches are numbered per channel; a reset node (new frontier) starts a new channel
+        self.channel = f"{self.name}:{store.instance_id()}"
+        # dest -> URLs stored for it and not batched yet; ones left by an earlier run are sent right away
+        self.waiting = store.forward_counts()
+        self.oldest = dict.fromkeys(self.waiting, 0)  # dest -> time the oldest of them was stored
+        self.forwarded = OrderedDict()
+        self.sent, self.received = store.batch_counts()
+        self.sent_at = {}  # (dest, seq) -> time it was last sent; unacknowledged batches not in it are resent
+        self.next_resend = 0
+        self.next_status = 0
+        self.lock = threading.Lock()
+
+    def owns(self, url):
+        return node_for(urlparse(url).netloc, self.count) == self.index
+
+    def route(self, urls):
+        """Return the URLs this node owns; the others are stored for their nodes"""
+        local = []
+        forward = []
+        with self.lock:
+            for url in urls:
+                node = node_for(urlparse(url).netloc, self.count)
+                if node == self.index:
+                    local.append(url)
+                elif url not in self.forwarded:
+                    self.forwarded[url] = None
+                    if len(self.forwarded) > FORWARDED_CACHE_SIZE:
+                        self.forwarded.popitem(last=False)
+                    forward.append((node_name(node), url))
+            if forward:
+                # Stored before the page they came from is acknowledged, so a crash cannot lose them
+                self.store.queue_forward(forward)
+                now = time.time()
+                for dest, url in forward:
+                    self.waiting[dest] = self.waiting.get(dest, 0) + 1
+                    self.oldest.setdefault(dest, now)
+        return local
+
+    def _send_batch(self, dest, seq, urls):
+        message = {'type': 'urls', 'from': self.name, 'channel': self.channel, 'seq': seq, 'urls': urls}
+        if self.transport.send(dest, message):
+            self.sent_at[(dest, seq)] = time.time()
+            logging.debug("Forwarded %s URLs to %s (batch %s)", len(urls), dest, seq)
+        else:
+            # Not reachable yet: try again on the next poll
+            self.next_resend = 0
+
+    def flush(self, force=False):
+        """Send the URLs waiting for a node as a batch once there are enough or they are old enough (all with force)"""
+        now = time.time()
+        with self.lock:
+            for dest, waiting in list(self.waiting.items()):
+                if not force and waiting < self.batch_size and now - self.oldest[dest] < self.flush_interval:
+                    continue
+                del self.waiting[dest]
+                del self.oldest[dest]
+                batch = self.store.store_batch(dest)
+                if batch is not None:
+                    seq, urls = batch
+                    self.sent[dest] = seq
+                    self._send_batch(dest, seq, urls)
+
+    def resend(self):
+        """Send again the batches that were not acknowledged in time (or not sent by this process)"""
+        now = time.time()
+        for dest, seq, urls in self.store.unacked_batches():
+            if now - self.sent_at.get((dest, seq), 0) >= ACK_TIMEOUT:
+                self._send_batch(dest, seq, urls)
+
+    def _acknowledged(self, dest, seq):
+        self.store.ack_batches(dest, seq)
+        for key in [key for key in self.sent_at if key[0] == dest and key[1] <= seq]:
+            del self.sent_at[key]
+
+    def pending(self):
+        with self.lock:
+            return sum(self.waiting.values())
+
+    def poll(self, add_urls, idle, status=None):
+        """
+        Exchange messages: send due batches, pass received URLs to
+        add_urls(urls, (channel, seq)), acknowledge them and, every
+        STATUS_INTERVAL, report idle() and the extra status dict to the
+        coordinator. Returns True on a stop request.
+        """
+        self.flush()
+        now = time.time()
+        if now >= self.next_resend:
+            self.next_resend = now + STATUS_INTERVAL
+            self.resend()
+
+        stop = False
+        acks = {}  # sender's endpoint -> (channel, last batch applied)
+        for message in self.transport.receive():
+            kind = message.get('type')
+            if kind == 'urls':
+                channel, seq = message['channel'], message['seq']
+                if seq == self.received.get(channel, 0) + 1:
+                    add_urls(message['urls'], (channel, seq))
+                    self.received[channel] = seq
+                acks[message['from']] = (channel, self.received.get(channel, 0))
+            elif kind == 'ack':
+                self._acknowledged(message['from'], message['seq'])
+            elif kind == 'stop':
+                stop = True
+        for sender, (channel, seq) in acks.items():
+            self.transport.send(sender, {'type': 'ack', 'from': self.name, 'channel': channel, 'seq': seq})
+
+        now = time.time()
+        if now >= self.next_status:
+            self.next_status = now + STATUS_INTERVAL
+            report = dict(status or {})
+            report.update({
+                'type': 'status',
+                'node': self.index,
+                'channel': self.channel,
+                'sent': dict(self.sent),
+                'received': dict(self.received),
+                'idle': idle() and self.pending() == 0,
+                'time': now,
+            })
+            self.transport.send(COORDINATOR, report)
+        return stop
+
+    def close(self):
+        # Batches still unacknowledged are resent by the next run
+        self.flush(force=True)
+        self.transport.close()
@@ -0,0 +1,112 @@
+"""Per-host politeness scheduler on top of the frontier"""
+import heapq
+import time
+import zlib
+import logging
+from urllib.parse import urlparse
+
+
+class HostScheduler:
+    """
+    Hands out the next fetchable URL while keeping every host's crawl delay.
+
+    Each host's queued URLs form a FIFO inside the frontier (indexed by
+    domain), and this class keeps a min-heap of (next_allowed_time, domain)
+    with one entry per host that has pending work. Picking the next URL is a
+    heap pop plus one indexed frontier lookup, so it costs O(log hosts)
+    no matter how many URLs a single host has queued.
+
+    The delay for a host is the larger of its configured delay (falling back
+    to default_delay) and the Crawl-delay from its robots.txt.
+
+    With several worker processes each one gets a shard (index, count) and
+    only schedules the hosts that hash into it, so a host is only ever
+    fetched by one process and its delay holds without coordination. URLs
+    for other shards still go into the shared frontier; every
+    refresh_interval seconds the scheduler picks up hosts that other
+    processes queued (or whose leases expired) for its shard.
+    """
+
+    def __init__(self, frontier, default_delay=1.0, domain_delays=None, shard=None, refresh_interval=None):
+        self.frontier = frontier
+        self.default_delay = default_delay
+        self.domain_delays = dict(domain_delays or {})
+        self.robots_delays = {}
+        self.shard = shard
+        self.refresh_interval = refresh_interval
+        self.next_refresh = 0
+        self.heap = []
+        self.scheduled = set()
+
+        self.refresh()
+        logging.debug(f"Scheduler loaded {len(self.heap)} hosts with queued URLs")
+
+    def owns(self, domain):
+        """True if this scheduler's shard is responsible for the domain"""
+        if self.shard is None:
+            return True
+        index, count = self.shard
+        return zlib.crc32(domain.encode('utf-8')) % count == index
+
+    def refresh(self):
+        """Schedule owned hosts with queued URLs that are not scheduled yet"""
+        for domain, last_crawl in self.frontier.pending_domains():
+            if domain not in self.scheduled and self.owns(domain):
+                self._schedule(domain, last_crawl + self.get_delay(domain))
+        if self.refresh_interval is not None:
+            self.next_refresh = time.time() + self.refresh_interval
+
+    def get_delay(self, domain):
+        delay = self.domain_delays.get(domain, self.default_delay)
+        return max(delay, self.robots_delays.get(domain, 0))
+
+    def set_domain_delay(self, domain, delay):
+        self.domain_delays[domain] = delay
+
+    def set_robots_delay(self, domain, delay):
+        """Record the Crawl-delay a host's robots.txt asks for."""
+        self.robots_delays[domain] = delay
+
+    def _schedule(self, domain, next_allowed):
+        heapq.heappush(self.heap, (next_allowed, domain))
+        self.scheduled.add(domain)
+
+    def add_urls(self, urls, batch=None):
+        """Queue URLs in the frontier and schedule any host that was idle. Returns the URLs added."""
+        added = self.frontier.add_urls(urls, batch)
+        for url in added:
+            domain = urlparse(url).netloc
+            if domain not in self.scheduled and self.owns(domain):
+                self._schedule(domain, self.frontier.last_crawl(domain) + self.get_delay(domain))
+        return added
+
+    def next_url(self):
+        """Lease the next URL whose host may be fetched now, or return None if every host is waiting."""
+        if self.refresh_interval is not None and time.time() >= self.next_refresh:
+            self.refresh()
+
+        while self.heap:
+            next_allowed, domain = self.heap[0]
+            now = time.time()
+            if next_allowed > now:
+                return None
+
+            heapq.heappop(self.heap)
+            url = self.frontier.lease_from_domain(domain)
+            if url is None:
+                # Host queue drained (or fully leased); it is rescheduled when new URLs arrive
+                self.scheduled.discard(domain)
+                continue
+
+            heapq.heappush(self.heap, (now + self.get_delay(domain), domain))
+            return url
+        return None
+
+    def seconds_until_ready(self):
+        """Seconds until the next host becomes fetchable, or None if no host has work."""
+        if not self.heap:
+            return None
+        return max(0.0, self.heap[0][0] - time.time())
+
+    def host_count(self):
+        return len(self.scheduled)
@@ -0,0 +1,154 @@
+"""Message transports between the coordinator and the nodes of a distributed crawl"""
+import os
+import json
+import time
+import socket
+import struct
+import logging
+import threading
+from collections import deque
+
+# Frame header of a socket message: length of the JSON body
+_FRAME = struct.Struct('>I')
+
+
+class SpoolTransport:
+    """
+    Messages as files in a spool directory: a message for `name` is one
+    JSON file in <directory>/<name>/, written under a temporary name and
+    renamed into place so the receiver never sees half a file. Works for
+    processes on one machine and, with the spool on a shared file system,
+    across machines. Messages survive restarts of the receiver.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.inbox = os.path.join(directory, name)
+        self.sequence = 0
+        os.makedirs(self.inbox, exist_ok=True)
+
+    def send(self, dest, message):
+        """Deliver a message (a JSON-serializable dict); returns True once it is in dest's spool"""
+        inbox = os.path.join(self.directory, dest)
+        os.makedirs(inbox, exist_ok=True)
+        self.sequence += 1
+        name = f"{time.time_ns()}-{self.name}-{os.getpid()}-{self.sequence}"
+        tmp_file = os.path.join(inbox, f".{name}.tmp")
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(message, f)
+        os.replace(tmp_file, os.path.join(inbox, name + '.msg'))
+        return True
+
+    def receive(self):
+        """Return the messages waiting for us, oldest first, and remove them from the spool"""
+        messages = []
+        for name in sorted(n for n in os.listdir(self.inbox) if n.endswith('.msg')):
+            path = os.path.join(self.inbox, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    messages.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logging.warning(f"Dropping unreadable message {path}: {e}")
+            os.remove(path)
+        return messages
+
+    def close(self):
+        pass
+
+
+class SocketTransport:
+    """
+    Messages over Unix domain sockets: every endpoint listens on
+    <directory>/<name>.sock and a background thread queues the frames it
+    receives. Connections to peers are kept open; send() returns False
+    while a peer is not listening (yet), and the caller keeps the message
+    to try again. Received messages are only held in memory until
+    receive(), so a receiver that dies loses them; the router resends URL
+    batches until they are acknowledged.
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        self.peers = {}
+        self.received = deque()
+        os.makedirs(directory, exist_ok=True)
+
+        self.path = self._socket_path(name)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.server.bind(self.path)
+        self.server.listen()
+        threading.Thread(target=self._accept, name='transport-accept', daemon=True).start()
+
+    def _socket_path(self, name):
+        return os.path.join(self.directory, name + '.sock')
+
+    def _accept(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return  # closed
+            threading.Thread(target=self._read, args=(connection,), name='transport-read', daemon=True).start()
+
+    def _read(self, connection):
+        with connection, connection.makefile('rb') as stream:
+            while True:
+                header = stream.read(_FRAME.size)
+                if len(header) < _FRAME.size:
+                    return
+                body = stream.read(_FRAME.unpack(header)[0])
+                try:
+                    self.received.append(json.loads(body))
+                except ValueError as e:
+                    logging.warning(f"Dropping unreadable message: {e}")
+
+    def send(self, dest, message):
+        """Deliver a message (a JSON-serializable dict); returns False if dest is not reachable"""
+        body = json.dumps(message).encode('utf-8')
+        peer = self.peers.get(dest)
+        try:
+            if peer is None:
+                peer = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                peer.connect(self._socket_path(dest))
+                self.peers[dest] = peer
+            peer.sendall(_FRAME.pack(len(body)) + body)
+            return True
+        except OSError as e:
+            logging.debug("Could not send to %s: %s", dest, e)
+            if peer is not None:
+                peer.close()
+            self.peers.pop(dest, None)
+            return False
+
+    def receive(self):
+        """Return the messages received since the last call, oldest first"""
+        messages = []
+        while self.received:
+            messages.append(self.received.popleft())
+        return messages
+
+    def close(self):
+        for peer in self.peers.values():
+            peer.close()
+        self.peers.clear()
+        self.server.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+TRANSPORTS = {
+    'spool': SpoolTransport,
+    'socket': SocketTransport,
+}
+
+
+def open_transport(spec, name):
+    """Open endpoint `name` of a transport given as 'spool:DIRECTORY' or 'socket:DIRECTORY'"""
+    kind, _, directory = spec.partition(':')
+    if kind not in TRANSPORTS or not directory:
+        raise ValueError(f"Unknown transport {spec!r}; use spool:DIRECTORY or socket:DIRECTORY")
+    return TRANSPORTS[kind](directory, name)
@@ -17,6 +17,8 @@ python3 search.py
 #    - Single word: university
 #    - AND query: aalborg university
 #    - OR query: python OR java
+#    - Phrase query: "aalborg university" (needs: python3 build_index.py --positions)
+#    - Proximity query: aalborg NEAR/3 university
 
 # 4. Run tests
 python3 test_search.py
@@ -35,8 +37,11 @@ python3 test_search.py
   - Single term search
   - AND query (all terms must match)
   - OR query (any term can match)
+✓ Phrase and NEAR/k queries (positional index, --positions)
+✓ Versioned binary index directory, memory-mapped (nothing is loaded up front)
 ✓ Interactive CLI
-✓ Fast in-memory search using set operations
+✓ BM25 ranking (term frequencies stored in the postings); the best 10 are
+  found with block-max dynamic pruning instead of scoring every match
 
 # ============================================
 # CORNERS CUT & WHY
@@ -46,21 +51,13 @@ python3 test_search.py
    → Would need NLTK/spaCy, adds complexity
    → Impact: "run" and "running" treated as different
    
-❌ No TF-IDF ranking
-   → Would need to store term frequencies
-   → Impact: Results are unordered
-   
-❌ No phrase queries  
-   → Would need positional index
-   → Impact: Can't search "machine learning" as exact phrase
-   
 ❌ Simple stopword list (24 words)
    → Full list would be 200+ words
    → Impact: Minor - some common words still indexed
-   
-❌ Pickle persistence (not database)
-   → Quick to implement
-   → Impact: Doesn't scale to millions of docs
+
+❌ Read-only index files
+   → Adding documents rewrites the whole index
+   → Impact: No incremental updates
 
 # ============================================
 # STATISTICS
@@ -68,9 +65,8 @@ python3 test_search.py
 
 Documents indexed: 832
 Unique terms: 150,622
-Index file size: ~15 MB
 Build time: ~5 seconds
-Query time: <1ms (in-memory)
+Query time: ~10 ms for the top 10 (50,000-document synthetic index)
 
 # ============================================
 # EXAMPLE USAGE
@@ -82,15 +78,19 @@ $ python3 search.py
 Search> aalborg university
 Query type: AND
 Terms: ['aalborg', 'university']
-Found 57 documents:
 
-1. [Doc 4] Privacy and cookie policy - Aalborg University
+Top 10 documents:
+================================================================================
+
+1. [Doc 4] Privacy and cookie policy - Aalborg University (score 7.85)
    URL: https://www.en.aau.dk/privacy-policy-cookies/
-   ...
+   Snippet: ...
+...
 
 Search> python OR java  
 Query type: OR
 Terms: ['python', 'java']
-Found 20 documents:
+
+Top 10 documents:
 ...
 """
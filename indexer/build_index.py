@@ -3,26 +3,91 @@ Build inverted index from processed web pages.
 """
 import json
 import os
+import sys
+import heapq
 import pickle
-from collections import defaultdict
-from preprocessing import tokenize
+import argparse
+from array import array
+from itertools import repeat
+from collections import Counter, defaultdict
+from preprocessing import tokenize, tokenize_with_positions
+from postings import (encode_postings, encode_skips, encode_positions, decode_postings_tf, decode_positions,
+                      iter_postings, positions_of, postings_count, BLOCK_SIZE)
+from ranking import Cursor, LengthNorms, bm25_idf, bm25_term_score, top_k
+from index_format import TermDictionary, DocumentStore, write_index, is_index_dir, FLAG_POSITIONS
+
+# The page store lives in the crawler package
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'crawler'))
+from utils.page_store import PageStore, STORE_DIRNAME
+
+
+# Merge buffered postings into the compressed lists once this many are buffered
+FLUSH_POSTINGS = 2000000
 
 
 class InvertedIndex:
     """
     Inverted index data structure.
     
-    Maps: term -> set of document IDs containing that term
-    Also stores document metadata (URL, title)
+    Maps: term -> compressed postings list of the document IDs containing
+    that term and the term's frequency in each (see postings.py), decoded
+    when a query needs it.
+    Also stores document metadata (URL, title) and document lengths, which
+    search_ranked uses to rank results by BM25, and a skip table for each
+    postings list longer than one block, which lets it skip the documents
+    that cannot make the top k.
+    
+    A positional index (positions=True) also stores where each term occurs
+    in each document, for phrase and proximity queries. The positions are
+    kept apart from the postings, so other queries never read them.
+    
+    Documents added since the last flush are buffered as plain arrays and
+    merged into the compressed lists before the next query or save.
+    
+    A saved index (see index_format.py) is loaded memory-mapped: terms and
+    documents are read from disk as queries need them. Adding documents
+    to it first reads the whole index into memory.
     """
     
-    def __init__(self):
-        self.index = defaultdict(set)  # term -> set of doc_ids
+    def __init__(self, positions=False):
+        self.index = {}  # term -> compressed postings list
+        self.skips = {}  # term -> skip table of its postings list, if longer than BLOCK_SIZE
+        self.with_positions = positions
+        self.positions = {}  # term -> compressed positions of its postings (positional index only)
+        self.pending = defaultdict(lambda: array('I'))  # term -> doc_ids added since the last flush
+        self.pending_tf = defaultdict(lambda: array('I'))  # term -> term frequencies of those doc_ids
+        self.pending_positions = defaultdict(list)  # term -> positions in each of those doc_ids
+        self.pending_count = 0
+        self.unsorted = set()  # pending terms whose doc_ids arrived out of order
         self.documents = {}  # doc_id -> {'url': ..., 'title': ..., 'content': ...}
+        self.doc_lengths = {}  # doc_id -> number of tokens
+        self.total_length = 0
         self.doc_count = 0
         
+    def _make_writable(self):
+        """Replace a memory-mapped index by in-memory dicts."""
+        if isinstance(self.index, TermDictionary):
+            index, documents = self.index, self.documents
+            self.index = dict(index.items())
+            self.skips = dict(index.skips.items())
+            self.positions = dict(index.positions.items())
+            self.documents = dict(documents.items())
+            self.doc_lengths = dict(documents.lengths.items())
+            index.close()
+            documents.close()
+        
     def add_document(self, doc_id, url, title, content):
-        """Add a document to the index."""
+        """
+        Add a document to the index.
+        
+        Raises:
+            ValueError: if doc_id is already in the index (its postings,
+                the document count and the average length would count it twice)
+        """
+        self._make_writable()
+        if doc_id in self.doc_lengths:
+            raise ValueError(f"Document {doc_id} is already in the index")
+        
         # Store document metadata
         self.documents[doc_id] = {
             'url': url,
@@ -31,30 +96,101 @@ class InvertedIndex:
         }
         
         # Tokenize and index the content
-        tokens = tokenize(content)
+        if self.with_positions:
+            token_positions = defaultdict(list)
+            for token, position in tokenize_with_positions(content):
+                token_positions[token].append(position)
+            for token, positions in token_positions.items():
+                self.pending_positions[token].append(positions)
+            counts = {token: len(positions) for token, positions in token_positions.items()}
+            length = sum(counts.values())
+        else:
+            tokens = tokenize(content)
+            counts = Counter(tokens)
+            length = len(tokens)
+        
+        self.total_length += length
+        self.doc_lengths[doc_id] = length
         
-        # Add each unique token to the index
-        for token in set(tokens):  # Use set to avoid duplicates
-            self.index[token].add(doc_id)
+        # Add each unique token to the index with its frequency
+        for token, tf in counts.items():
+            doc_ids = self.pending[token]
+            if doc_ids and doc_ids[-1] >= doc_id:
+                self.unsorted.add(token)
+            doc_ids.append(doc_id)
+            self.pending_tf[token].append(tf)
+        self.pending_count += len(counts)
         
         self.doc_count += 1
+        if self.pending_count >= FLUSH_POSTINGS:
+            self.flush()
+        
+    def flush(self):
+        """Merge the buffered postings into the compressed postings lists."""
+        for term, doc_ids in self.pending.items():
+            tfs = self.pending_tf[term]
+            position_lists = self.pending_positions.get(term) if self.with_positions else None
+            existing = self.index.get(term)
+            if existing is not None:
+                existing_ids, existing_tfs = decode_postings_tf(existing)
+                if existing_ids[-1] >= doc_ids[0]:
+                    self.unsorted.add(term)
+                if position_lists is not None and term in self.unsorted:
+                    position_lists = decode_positions(self.positions[term], existing_tfs) + position_lists
+                doc_ids = existing_ids + doc_ids
+                tfs = existing_tfs + tfs
+            # Documents usually arrive in doc id order, so sorting is rarely needed
+            if term in self.unsorted:
+                by_doc = dict(zip(doc_ids, zip(tfs, position_lists or repeat(None))))
+                doc_ids = sorted(by_doc)
+                tfs = [by_doc[doc_id][0] for doc_id in doc_ids]
+                if position_lists is not None:
+                    position_lists = [by_doc[doc_id][1] for doc_id in doc_ids]
+            self.index[term] = encode_postings(doc_ids, tfs)
+            if len(doc_ids) > BLOCK_SIZE:
+                self.skips[term] = encode_skips(doc_ids, tfs, self.doc_lengths)
+            if position_lists is not None:
+                # In order, the new positions simply follow the existing ones
+                encoded = encode_positions(position_lists)
+                self.positions[term] = encoded if term in self.unsorted else self.positions.get(term, b'') + encoded
+        self.pending.clear()
+        self.pending_tf.clear()
+        self.pending_positions.clear()
+        self.pending_count = 0
+        self.unsorted.clear()
+        
+    def postings(self, term):
+        """Iterate over the document IDs containing a term, in increasing order."""
+        if self.pending:
+            self.flush()
+        data = self.index.get(term.lower())
+        return iter_postings(data) if data is not None else iter(())
+    
+    def document_frequency(self, term):
+        """Number of documents containing a term."""
+        if self.pending:
+            self.flush()
+        data = self.index.get(term.lower())
+        return postings_count(data) if data is not None else 0
         
     def search(self, term):
         """Search for a single term."""
-        term = term.lower()
-        return self.index.get(term, set())
+        return set(self.postings(term))
     
     def search_and(self, terms):
         """Boolean AND: Return documents containing ALL terms."""
         if not terms:
             return set()
         
-        # Start with documents containing the first term
+        # Start with the rarest term so the intermediate result stays small
+        terms = sorted(terms, key=self.document_frequency)
         result = self.search(terms[0])
         
         # Intersect with documents containing each subsequent term
         for term in terms[1:]:
-            result = result & self.search(term)
+            if not result:
+                break
+            result = result.intersection(self.postings(term))
         
         return result
     
@@ -62,82 +198,286 @@ class InvertedIndex:
         """Boolean OR: Return documents containing ANY term."""
         result = set()
         for term in terms:
-            result = result | self.search(term)
+            result.update(self.postings(term))
         return result
     
+    def _require_positions(self):
+        if not self.with_positions:
+            raise ValueError("This index has no positions; rebuild it with 'python build_index.py --positions'")
+        
+    def _positions(self, term, doc_ids):
+        """Yield (doc_id, positions of term) for the doc ids (a set) that contain the term."""
+        postings = self.index.get(term)
+        if postings is None or not doc_ids:
+            return iter(())
+        return positions_of(self.positions.get(term, b''), postings, doc_ids)
+    
+    def search_phrase(self, phrase):
+        """
+        Phrase query: documents containing the words of a phrase at the same
+        distances as in the phrase (a stopword in the phrase matches any word).
+        Needs a positional index unless the phrase is a single word.
+        """
+        if self.pending:
+            self.flush()
+        words = tokenize_with_positions(phrase)
+        if len(words) > 1:
+            self._require_positions()
+        if not words:
+            return set()
+        candidates = self.search_and([word for word, _ in words])
+        if len(words) == 1 or not candidates:
+            return candidates
+        
+        # Positional merge over the AND candidates, rarest word first: keep, per
+        # document, the phrase start positions that agree with every word so far
+        words = sorted(words, key=lambda word: self.document_frequency(word[0]))
+        word, offset = words[0]
+        starts = {doc_id: {position - offset for position in positions}
+                  for doc_id, positions in self._positions(word, candidates)}
+        for word, offset in words[1:]:
+            matched = {}
+            for doc_id, positions in self._positions(word, set(starts)):
+                common = starts[doc_id].intersection([position - offset for position in positions])
+                if common:
+                    matched[doc_id] = common
+            starts = matched
+        return set(starts)
+    
+    def search_near(self, term1, term2, distance):
+        """
+        Proximity query (term1 NEAR/distance term2): documents in which the
+        two terms occur at most `distance` words apart, in either order.
+        Needs a positional index. The terms are tokenized like documents and
+        phrases; a term that is a stopword or splits into several words
+        matches nothing.
+        """
+        self._require_positions()
+        terms = [tokenize(term) for term in (term1, term2)]
+        if any(len(tokens) != 1 for tokens in terms):
+            return set()
+        (term1,), (term2,) = terms
+        candidates = self.search_and([term1, term2])
+        first = dict(self._positions(term1, candidates))
+        return {doc_id for doc_id, positions in self._positions(term2, candidates)
+                if _within(first[doc_id], positions, distance)}
+    
+    def search_ranked(self, terms, k=10, require_all=False, exhaustive=False, documents=None):
+        """
+        Rank the documents matching a query by BM25.
+        
+        OR queries are evaluated with Block-Max WAND (see ranking.py),
+        which skips the documents that cannot make the top k. AND queries,
+        and any query with exhaustive=True, score every match term by term
+        and keep the best k in a bounded heap. Both return the same results.
+        
+        Args:
+            terms: Query terms
+            k: Number of results to return
+            require_all: Only rank the documents containing every term (AND)
+            exhaustive: Score every matching document
+            documents: Only rank these documents (e.g. the matches of a phrase query)
+            
+        Returns:
+            [(doc_id, score), ...] best first; ties go to the lower doc id
+        """
+        if self.pending:
+            self.flush()
+        terms = list(dict.fromkeys(term.lower() for term in terms))
+        if k <= 0:
+            return []
+        candidates = None
+        if require_all and len(terms) > 1:
+            candidates = self.search_and(terms)
+        if documents is not None:
+            candidates = set(documents) if candidates is None else candidates.intersection(documents)
+        if candidates is not None and not candidates:
+            return []
+        
+        # Indexes saved before document lengths were stored rank every document as average length
+        avg_length = self.total_length / self.doc_count if self.total_length else 1
+        norms = LengthNorms(self.doc_lengths, avg_length)
+        postings = [(term, self.index.get(term)) for term in terms]
+        postings = [(term, data) for term, data in postings if data is not None]
+        
+        if candidates is None and not exhaustive:
+            cursors = [Cursor(order, bm25_idf(self.doc_count, postings_count(data)), data, self.skips.get(term), norms)
+                       for order, (term, data) in enumerate(postings)]
+            return top_k(cursors, k)
+        
+        scores = defaultdict(float)
+        for term, data in postings:
+            doc_ids, tfs = decode_postings_tf(data)
+            idf = bm25_idf(self.doc_count, len(doc_ids))
+            for doc_id, tf in zip(doc_ids, tfs):
+                if candidates is not None and doc_id not in candidates:
+                    continue
+                scores[doc_id] += bm25_term_score(idf, tf, norms.get(doc_id))
+        
+        return heapq.nlargest(k, scores.items(), key=lambda item: (item[1], -item[0]))
+    
     def get_document(self, doc_id):
         """Retrieve document metadata by ID."""
         return self.documents.get(doc_id)
     
-    def save(self, filepath):
-        """Save index to disk."""
-        with open(filepath, 'wb') as f:
-            pickle.dump({
-                'index': dict(self.index),  # Convert defaultdict to dict
-                'documents': self.documents,
-                'doc_count': self.doc_count
-            }, f)
-        print(f"Index saved to {filepath}")
-        
-    def load(self, filepath):
-        """Load index from disk."""
-        with open(filepath, 'rb') as f:
-            data = pickle.load(f)
-            self.index = defaultdict(set, data['index'])
-            self.documents = data['documents']
-            self.doc_count = data['doc_count']
-        print(f"Index loaded from {filepath}")
+    def save(self, path):
+        """Save index to disk as an index directory (see index_format.py)."""
+        self.flush()
+        total_postings = sum(postings_count(docs) for docs in self.index.values())
+        write_index(path, self.index, self.skips, self.positions, self.documents, self.doc_lengths,
+                    self.doc_count, total_postings, flags=FLAG_POSITIONS if self.with_positions else 0)
+        print(f"Index saved to {path}")
+        
+    def load(self, path):
+        """
+        Open an index saved to disk. An index directory is memory-mapped;
+        a pickle file written by older versions is read into memory.
+        """
+        self.close()
+        self.pending.clear()
+        self.pending_tf.clear()
+        self.pending_positions.clear()
+        self.pending_count = 0
+        self.unsorted.clear()
+        if is_index_dir(path):
+            self.index = TermDictionary(path)
+            self.skips = self.index.skips
+            self.positions = self.index.positions
+            self.with_positions = bool(self.index.flags & FLAG_POSITIONS)
+            self.documents = DocumentStore(path)
+            self.doc_lengths = self.documents.lengths
+            self.total_length = self.documents.total_length
+            self.doc_count = self.index.doc_count
+        else:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+                self.index = data['index']
+                self.skips = {}
+                self.positions = {}
+                self.with_positions = False
+                # Indexes saved before postings were compressed hold sets of doc ids
+                for term, doc_ids in self.index.items():
+                    if isinstance(doc_ids, (set, frozenset)):
+                        self.index[term] = encode_postings(sorted(doc_ids))
+                self.documents = data['documents']
+                self.doc_lengths = {}
+                self.total_length = 0
+                self.doc_count = data['doc_count']
+        print(f"Index loaded from {path}")
+        
+    def close(self):
+        """Unmap a loaded index directory."""
+        for mapping in (self.index, self.documents):
+            if isinstance(mapping, (TermDictionary, DocumentStore)):
+                mapping.close()
         
     def get_stats(self):
         """Get index statistics."""
+        self.flush()
+        if isinstance(self.index, TermDictionary):
+            # Kept in the index header, so opening an index does not scan it
+            total_postings = self.index.total_postings
+            postings_bytes = self.index.postings_bytes()
+        else:
+            total_postings = sum(postings_count(docs) for docs in self.index.values())
+            postings_bytes = sum(len(docs) for docs in self.index.values())
         return {
             'num_documents': self.doc_count,
             'num_unique_terms': len(self.index),
-            'avg_terms_per_doc': sum(len(docs) for docs in self.index.values()) / self.doc_count if self.doc_count > 0 else 0
+            'avg_terms_per_doc': total_postings / self.doc_count if self.doc_count > 0 else 0,
+            'postings_bytes': postings_bytes
         }
 
 
-def build_index_from_json(data_dir):
+def _within(positions1, positions2, distance):
+    """Whether two sorted position lists have positions at most `distance` apart (merging them in order)."""
+    i = j = 0
+    while i < len(positions1) and j < len(positions2):
+        a, b = positions1[i], positions2[j]
+        # Equal positions are the same occurrence (both lists are of one term)
+        if a != b and abs(a - b) <= distance:
+            return True
+        if a < b:
+            i += 1
+        else:
+            j += 1
+    return False
+
+
+def iter_documents(data_dir, content=True):
     """
-    Build inverted index from JSON files in the data directory.
-    
-    Args:
-        data_dir: Path to directory containing page_*.json files
-        
-    Returns:
-        InvertedIndex object
+    Yield (doc_id, page_dict) for every crawled page in data_dir: legacy
+    page_N.json files first, then the records of the segmented page store.
+    With content=False the store's pages come without their 'content', which
+    a zstd-dict store then does not decompress at all.
     """
-    index = InvertedIndex()
-    
     # Get all JSON files
     json_files = sorted([f for f in os.listdir(data_dir) if f.endswith('.json')])
-    
-    print(f"Building index from {len(json_files)} documents...")
-    
-    for i, filename in enumerate(json_files):
+
+    for filename in json_files:
         filepath = os.path.join(data_dir, filename)
-        
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
                 data = json.load(f)
-            
+
             # Extract document ID from filename (e.g., page_1.json -> 1)
             doc_id = int(filename.replace('page_', '').replace('.json', ''))
-            
-            # Add to index
-            index.add_document(
-                doc_id=doc_id,
-                url=data.get('url', ''),
-                title=data.get('title', ''),
-                content=data.get('content', '')
-            )
-            
-            if (i + 1) % 100 == 0:
-                print(f"Indexed {i + 1}/{len(json_files)} documents...")
-                
         except Exception as e:
             print(f"Error processing {filename}: {e}")
             continue
+        yield doc_id, data
+
+    store_dir = os.path.join(data_dir, STORE_DIRNAME)
+    if os.path.exists(os.path.join(store_dir, 'store.json')):
+        store = PageStore(store_dir)
+        try:
+            for doc_id in range(store.first_doc_id, store.next_doc_id()):
+                try:
+                    data = store.get(doc_id) if content else store.get_meta(doc_id)
+                except Exception as e:
+                    print(f"Error reading document {doc_id} from page store: {e}")
+                    continue
+                yield doc_id, data
+        finally:
+            store.close()
+
+
+def build_index_from_json(data_dir, positions=False):
+    """
+    Build inverted index from the crawled pages in the data directory.
+    
+    Args:
+        data_dir: Path to directory containing page_*.json files and/or
+            the segmented page store written by the crawler
+        positions: Build a positional index (for phrase and NEAR queries)
+        
+    Returns:
+        InvertedIndex object
+    """
+    index = InvertedIndex(positions=positions)
+    
+    # A page the crawler revisited and found changed is stored again under a
+    # new doc id; only its newest version is indexed
+    latest = {}
+    for doc_id, data in iter_documents(data_dir, content=False):
+        latest[data.get('url') or doc_id] = doc_id
+    current = set(latest.values())
+
+    total = len(current)
+    print(f"Building index from {total} documents...")
+    
+    documents = ((doc_id, data) for doc_id, data in iter_documents(data_dir) if doc_id in current)
+    for i, (doc_id, data) in enumerate(documents):
+        # Add to index
+        index.add_document(
+            doc_id=doc_id,
+            url=data.get('url', ''),
+            title=data.get('title', ''),
+            content=data.get('content', '')
+        )
+        
+        if (i + 1) % 100 == 0:
+            print(f"Indexed {i + 1}/{total} documents...")
     
     print(f"\nIndexing complete!")
     stats = index.get_stats()
@@ -148,11 +488,16 @@ def build_index_from_json(data_dir):
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the inverted index from the crawled pages')
+    parser.add_argument('--positions', action='store_true',
+                        help='Store term positions, for phrase and NEAR queries')
+    args = parser.parse_args()
+    
     # Build index from processed data
     data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'data', 'processed')
-    index = build_index_from_json(data_dir)
+    index = build_index_from_json(data_dir, positions=args.positions)
     
     # Save index
     index_dir = os.path.dirname(__file__)
-    index_file = os.path.join(index_dir, 'inverted_index.pkl')
-    index.save(index_file)
+    index_path = os.path.join(index_dir, 'inverted_index')
+    index.save(index_path)
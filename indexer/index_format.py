@@ -0,0 +1,357 @@
+"""
+On-disk index format.
+
+An index is a directory of five files, all little-endian:
+
+    terms.dat     header (magic, format version, flags, term count,
+                  document count, total postings), then one fixed-size
+                  entry per term - offset of the term in the name area, of
+                  its postings list in postings.dat, of its skip table in
+                  skips.dat and of its positions in positions.dat - sorted
+                  by term, and an end entry, then the names (UTF-8, back to
+                  back); each part of a term ends where the next entry's
+                  begins
+    postings.dat  the compressed postings lists (see postings.py)
+    skips.dat     the skip tables of the lists longer than one block
+    positions.dat the term positions of each posting, if the index has
+                  them (FLAG_POSITIONS); only phrase and proximity queries
+                  read this file
+    docs.dat      header (magic, format version, document count, first doc
+                  id, number of rows, total document length), then one row
+                  per doc id from the first to the last - offset and length
+                  of its record (0 for a doc id that is not indexed) and
+                  the document's length in tokens - then the records (JSON
+                  with url, title and content snippet)
+
+The files are opened with mmap and searched in place: a term lookup is a
+binary search over the term entries and reads one postings list, so only
+the pages a query touches are read from disk, a document or its length is
+found by its doc id without a search, opening an index takes the
+same few milliseconds whatever its size, and processes serving the same
+index share one copy in the page cache.
+
+Readers reject files of another format version; bump FORMAT_VERSION
+whenever the layout changes.
+"""
+import os
+import json
+import mmap
+import shutil
+import struct
+
+FORMAT_VERSION = 4
+
+TERMS_FILE = 'terms.dat'
+POSTINGS_FILE = 'postings.dat'
+SKIPS_FILE = 'skips.dat'
+POSITIONS_FILE = 'positions.dat'
+
+# Header flags
+FLAG_POSITIONS = 1
+DOCS_FILE = 'docs.dat'
+
+_TERMS_MAGIC = b'WIXT'
+_DOCS_MAGIC = b'WIXD'
+
+# magic, version, flags, term count, document count, total postings
+_TERMS_HEADER = struct.Struct('<4sIIQQQ')
+# name offset, postings offset, skip table offset, positions offset
+_TERM_ENTRY = struct.Struct('<QQQQ')
+_NAME_OFFSET = struct.Struct('<Q')
+# magic, version, document count, first doc id, rows, total document length
+_DOCS_HEADER = struct.Struct('<4sIQQQQ')
+# record offset, record length, document length
+_DOC_ROW = struct.Struct('<QII')
+
+
+class IndexFormatError(Exception):
+    """The files are not an index of the supported format version."""
+
+
+def is_index_dir(path):
+    return os.path.isfile(os.path.join(path, TERMS_FILE))
+
+
+def write_index(path, index, skips, positions, documents, doc_lengths, doc_count, total_postings, flags=0):
+    """
+    Write an index directory.
+
+    The files are written into a temporary directory that then replaces
+    `path`, so a reader never sees a half-written index; readers that have
+    the old index open keep reading its (now unlinked) files.
+
+    Args:
+        path: Index directory
+        index: Dict of term -> compressed postings list
+        skips: Dict of term -> skip table of its postings list, for the long lists
+        positions: Dict of term -> encoded positions of its postings (empty without FLAG_POSITIONS)
+        documents: Dict of doc_id -> {'url': ..., 'title': ..., 'content': ...}
+        doc_lengths: Dict of doc_id -> number of tokens in the document
+        doc_count: Number of indexed documents
+        total_postings: Sum of the lengths of all postings lists
+        flags: FLAG_* bits
+    """
+    path = os.path.abspath(path)
+    tmp_dir = f"{path}.tmp-{os.getpid()}"
+    if os.path.exists(tmp_dir):
+        shutil.rmtree(tmp_dir)
+    os.makedirs(tmp_dir)
+
+    terms = sorted(index)
+    names = [term.encode('utf-8') for term in terms]
+    with open(os.path.join(tmp_dir, POSTINGS_FILE), 'wb') as postings_file, \
+            open(os.path.join(tmp_dir, SKIPS_FILE), 'wb') as skips_file, \
+            open(os.path.join(tmp_dir, POSITIONS_FILE), 'wb') as positions_file, \
+            open(os.path.join(tmp_dir, TERMS_FILE), 'wb') as terms_file:
+        terms_file.write(_TERMS_HEADER.pack(_TERMS_MAGIC, FORMAT_VERSION, flags, len(terms), doc_count, total_postings))
+        files = (postings_file, skips_file, positions_file)
+        offsets = [0, 0, 0, 0]  # name, postings, skip table, positions
+        for term, name in zip(terms, names):
+            terms_file.write(_TERM_ENTRY.pack(*offsets))
+            offsets[0] += len(name)
+            for i, part in enumerate((index[term], skips.get(term, b''), positions.get(term, b'')), 1):
+                files[i - 1].write(part)
+                offsets[i] += len(part)
+        terms_file.write(_TERM_ENTRY.pack(*offsets))
+        terms_file.write(b''.join(names))
+
+    with open(os.path.join(tmp_dir, DOCS_FILE), 'wb') as docs_file:
+        first = min(documents, default=0)
+        rows = max(documents) - first + 1 if documents else 0
+        docs_file.write(_DOCS_HEADER.pack(_DOCS_MAGIC, FORMAT_VERSION, len(documents), first, rows,
+                                          sum(doc_lengths.values())))
+        records = []
+        offset = 0
+        for doc_id in range(first, first + rows):
+            document = documents.get(doc_id)
+            record = json.dumps(document, ensure_ascii=False).encode('utf-8') if document is not None else b''
+            docs_file.write(_DOC_ROW.pack(offset, len(record), doc_lengths.get(doc_id, 0)))
+            records.append(record)
+            offset += len(record)
+        docs_file.write(b''.join(records))
+
+    old_dir = f"{path}.old-{os.getpid()}"
+    if os.path.exists(path):
+        os.rename(path, old_dir)
+    os.rename(tmp_dir, path)
+    if os.path.exists(old_dir):
+        shutil.rmtree(old_dir)
+
+
+def _map(filepath):
+    """Map a whole file read-only (an empty file maps to b'', which mmap refuses)."""
+    with open(filepath, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _check_header(data, header, magic, filepath):
+    if len(data) < header.size:
+        raise IndexFormatError(f"{filepath} is truncated")
+    fields = header.unpack_from(data, 0)
+    if fields[0] != magic:
+        raise IndexFormatError(f"{filepath} is not an index file")
+    if fields[1] != FORMAT_VERSION:
+        raise IndexFormatError(f"{filepath} has format version {fields[1]}, "
+                               f"this version reads {FORMAT_VERSION}; rebuild the index")
+    return fields
+
+
+class TermDictionary:
+    """
+    Read-only mapping of term -> compressed postings list over terms.dat
+    and postings.dat. Supports the dict methods InvertedIndex uses (get,
+    `in`, len, iteration, items, values). `skips` and `positions` are the
+    matching mappings of term -> skip table and term -> positions, over
+    skips.dat and positions.dat, which are only read when those are used.
+    """
+
+    def __init__(self, path):
+        self._terms = _map(os.path.join(path, TERMS_FILE))
+        self._postings = _map(os.path.join(path, POSTINGS_FILE))
+        fields = _check_header(self._terms, _TERMS_HEADER, _TERMS_MAGIC, os.path.join(path, TERMS_FILE))
+        self.flags, self.count, self.doc_count, self.total_postings = fields[2:]
+        self._names_start = _TERMS_HEADER.size + (self.count + 1) * _TERM_ENTRY.size
+        self.skips = TermFile(self, _map(os.path.join(path, SKIPS_FILE)), 4)
+        self.positions = TermFile(self, _map(os.path.join(path, POSITIONS_FILE)), 6)
+
+    def _entry(self, i):
+        """(name start, name end, postings start, postings end, skips start, skips end, positions start,
+        positions end) of term i."""
+        offsets = _TERM_ENTRY.unpack_from(self._terms, _TERMS_HEADER.size + i * _TERM_ENTRY.size)
+        next_offsets = _TERM_ENTRY.unpack_from(self._terms, _TERMS_HEADER.size + (i + 1) * _TERM_ENTRY.size)
+        entry = [value for pair in zip(offsets, next_offsets) for value in pair]
+        entry[0] += self._names_start
+        entry[1] += self._names_start
+        return entry
+
+    def _name(self, entry):
+        return self._terms[entry[0]:entry[1]]
+
+    def _find(self, term):
+        """Binary search for a term; returns its entry or None."""
+        key = term.encode('utf-8')
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            offset = _TERMS_HEADER.size + mid * _TERM_ENTRY.size
+            start = self._names_start + _NAME_OFFSET.unpack_from(self._terms, offset)[0]
+            end = self._names_start + _NAME_OFFSET.unpack_from(self._terms, offset + _TERM_ENTRY.size)[0]
+            name = self._terms[start:end]
+            if name < key:
+                lo = mid + 1
+            elif name > key:
+                hi = mid
+            else:
+                return self._entry(mid)
+        return None
+
+    def _postings_of(self, entry):
+        return self._postings[entry[2]:entry[3]]
+
+    def get(self, term, default=None):
+        entry = self._find(term)
+        return self._postings_of(entry) if entry is not None else default
+
+    def __getitem__(self, term):
+        entry = self._find(term)
+        if entry is None:
+            raise KeyError(term)
+        return self._postings_of(entry)
+
+    def __contains__(self, term):
+        return self._find(term) is not None
+
+    def __len__(self):
+        return self.count
+
+    def items(self):
+        for i in range(self.count):
+            entry = self._entry(i)
+            yield self._name(entry).decode('utf-8'), self._postings_of(entry)
+
+    def __iter__(self):
+        return (term for term, _ in self.items())
+
+    def values(self):
+        return (data for _, data in self.items())
+
+    def postings_bytes(self):
+        return len(self._postings)
+
+    def close(self):
+        self.skips.close()
+        self.positions.close()
+        for data in (self._terms, self._postings):
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+class TermFile:
+    """
+    Read-only mapping of term -> the term's part of a file other than
+    postings.dat (skip table, positions), for the terms that have one.
+    """
+
+    def __init__(self, terms, data, field):
+        self._terms = terms
+        self._data = data
+        self._field = field  # index of the part's start in TermDictionary._entry
+
+    def _part(self, entry):
+        start, end = entry[self._field], entry[self._field + 1]
+        return self._data[start:end] if end > start else None
+
+    def get(self, term, default=None):
+        entry = self._terms._find(term)
+        part = self._part(entry) if entry is not None else None
+        return part if part is not None else default
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def items(self):
+        for i in range(self._terms.count):
+            entry = self._terms._entry(i)
+            part = self._part(entry)
+            if part is not None:
+                yield self._terms._name(entry).decode('utf-8'), part
+
+    def close(self):
+        if isinstance(self._data, mmap.mmap):
+            self._data.close()
+
+
+class DocumentStore:
+    """
+    Read-only mapping of doc_id -> document metadata over docs.dat.
+    `lengths` is the matching mapping of doc_id -> document length.
+    """
+
+    def __init__(self, path):
+        self._docs = _map(os.path.join(path, DOCS_FILE))
+        fields = _check_header(self._docs, _DOCS_HEADER, _DOCS_MAGIC, os.path.join(path, DOCS_FILE))
+        self.count, self._first, self._rows, self.total_length = fields[2:]
+        self._records_start = _DOCS_HEADER.size + self._rows * _DOC_ROW.size
+        self.lengths = DocumentLengths(self)
+
+    def _row(self, doc_id):
+        """(record offset, record length, document length) of a doc id, or None if it is not indexed."""
+        i = doc_id - self._first
+        if not 0 <= i < self._rows:
+            return None
+        row = _DOC_ROW.unpack_from(self._docs, _DOCS_HEADER.size + i * _DOC_ROW.size)
+        return row if row[1] else None
+
+    def _record(self, row):
+        start = self._records_start + row[0]
+        return json.loads(self._docs[start:start + row[1]])
+
+    def get(self, doc_id, default=None):
+        row = self._row(doc_id)
+        return self._record(row) if row is not None else default
+
+    def __contains__(self, doc_id):
+        return self._row(doc_id) is not None
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return (doc_id for doc_id in range(self._first, self._first + self._rows) if doc_id in self)
+
+    def items(self):
+        for doc_id in self:
+            yield doc_id, self._record(self._row(doc_id))
+
+    def close(self):
+        if isinstance(self._docs, mmap.mmap):
+            self._docs.close()
+
+
+class DocumentLengths:
+    """Read-only mapping of doc_id -> document length in tokens, over a DocumentStore."""
+
+    def __init__(self, store):
+        self._store = store
+
+    def get(self, doc_id, default=None):
+        row = self._store._row(doc_id)
+        return row[2] if row is not None else default
+
+    def __contains__(self, doc_id):
+        return doc_id in self._store
+
+    def __len__(self):
+        return len(self._store)
+
+    def __iter__(self):
+        return iter(self._store)
+
+    def items(self):
+        for doc_id in self._store:
+            yield doc_id, self.get(doc_id)
+
+    def values(self):
+        return (length for _, length in self.items())
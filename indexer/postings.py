@@ -0,0 +1,268 @@
+"""
+Compressed postings lists.
+
+A postings list is the sorted doc ids containing a term, stored as bytes:
+the number of doc ids, then the gaps between consecutive doc ids (the
+first gap is the doc id itself), each as a variable-byte integer (7 bits
+per byte, low bits first, high bit set on every byte but the last). Small
+gaps - frequent terms - take one byte per posting; a term found in a
+single document takes two or three bytes in total.
+
+The term frequencies (how often the term occurs in each document) follow
+the gaps, one variable-byte integer per doc id. They are left out when
+every frequency is 1, so postings lists written without frequencies read
+as lists of frequency 1.
+
+A list longer than BLOCK_SIZE also gets a skip table (kept next to it, not
+inside it): for each block of BLOCK_SIZE postings, its last doc id, the
+size of its gaps and frequencies, its highest term frequency and its
+shortest document length. A reader can jump to the block holding a doc id
+and decode only that block, and bound the score of any document in a
+block without decoding it.
+
+A positional index also keeps, apart from the postings, the positions of
+the term in each document: for each posting in order, the gaps between its
+positions (the first is the position itself) as variable-byte integers.
+A posting has as many positions as its term frequency, so nothing else is
+stored and the positions of a document are found by skipping those of the
+postings before it.
+"""
+from array import array
+from itertools import accumulate, chain, islice
+
+BLOCK_SIZE = 128
+
+
+def _put_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _get_varint(data, pos):
+    """Decode the variable-byte integer at data[pos]; returns (value, position after it)."""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _varint_size(value):
+    return max(1, (value.bit_length() + 6) // 7)
+
+
+def _put_varints(out, values):
+    if max(values) < 0x80:
+        # Every value fits in one byte (the usual case for gaps of frequent terms and for frequencies);
+        # iter() because bytes() of an array would copy its machine representation
+        out += bytes(iter(values))
+        return
+    for value in values:
+        while value >= 0x80:
+            out.append(value & 0x7f | 0x80)
+            value >>= 7
+        out.append(value)
+
+
+def _iter_varints(data, pos, count):
+    """The `count` variable-byte integers starting at data[pos], as an iterable."""
+    values = data[pos:pos + count]
+    if len(values) == count and values.isascii():
+        # No byte has the continuation bit: every value is one byte (iterating bytes gives ints;
+        # an iterator, because array() and bytes() would take bytes as their raw contents)
+        return iter(values)
+    return _iter_multibyte_varints(data, pos, count)
+
+
+def _iter_multibyte_varints(data, pos, count):
+    value = 0
+    shift = 0
+    for byte in data[pos:]:
+        if byte & 0x80:
+            value |= (byte & 0x7f) << shift
+            shift += 7
+        else:
+            yield value | (byte << shift)
+            count -= 1
+            if not count:
+                return
+            value = 0
+            shift = 0
+
+
+def _skip_varints(data, pos, count):
+    """Position after the `count` variable-byte integers starting at data[pos]."""
+    if data[pos:pos + count].isascii():
+        return pos + count
+    while count:
+        if data[pos] < 0x80:
+            count -= 1
+        pos += 1
+    return pos
+
+
+def encode_postings(doc_ids, tfs=None):
+    """
+    Compress doc ids and their term frequencies into a postings list.
+
+    Args:
+        doc_ids: Sorted, distinct non-negative doc ids
+        tfs: Term frequency of each doc id (all 1 if not given)
+
+    Returns:
+        bytes
+    """
+    out = bytearray()
+    _put_varint(out, len(doc_ids))
+    if not doc_ids:
+        return bytes(out)
+    gaps = [doc_ids[0]]
+    gaps += [b - a for a, b in zip(doc_ids, islice(doc_ids, 1, None))]
+    _put_varints(out, gaps)
+    if tfs is not None and any(tf != 1 for tf in tfs):
+        _put_varints(out, tfs)
+    return bytes(out)
+
+
+def postings_count(data):
+    """Number of doc ids in a postings list (read from its header, nothing is decoded)."""
+    return _get_varint(data, 0)[0]
+
+
+def iter_postings(data):
+    """Yield the doc ids of a postings list in increasing order, decoding as it goes."""
+    count, pos = _get_varint(data, 0)
+    if count:
+        yield from accumulate(_iter_varints(data, pos, count))
+
+
+def decode_postings(data):
+    """Decode a whole postings list into an array('I') of doc ids."""
+    return array('I', iter_postings(data))
+
+
+def decode_postings_tf(data):
+    """Decode a whole postings list into arrays ('I') of doc ids and of term frequencies."""
+    count, pos = _get_varint(data, 0)
+    if not count:
+        return array('I'), array('I')
+    doc_ids = array('I', accumulate(_iter_varints(data, pos, count)))
+    end = _skip_varints(data, pos, count)
+    if end == len(data):
+        return doc_ids, array('I', [1]) * count
+    return doc_ids, array('I', _iter_varints(data, end, count))
+
+
+def encode_skips(doc_ids, tfs, doc_lengths):
+    """
+    Skip table of the postings list encode_postings(doc_ids, tfs).
+
+    Args:
+        doc_ids: Sorted, distinct non-negative doc ids
+        tfs: Term frequency of each doc id (all 1 if None)
+        doc_lengths: Dict-like of doc_id -> document length (0 if missing)
+
+    Returns:
+        bytes: five variable-byte integers per block (last doc id minus
+        the previous block's, gaps size, frequencies size or 0 when the
+        list has none, highest frequency, shortest document length)
+    """
+    with_tfs = tfs is not None and any(tf != 1 for tf in tfs)
+    out = bytearray()
+    previous = 0
+    for start in range(0, len(doc_ids), BLOCK_SIZE):
+        ids = doc_ids[start:start + BLOCK_SIZE]
+        gaps_size = sum(_varint_size(b - a) for a, b in zip(chain((previous,), ids), ids))
+        block_tfs = tfs[start:start + BLOCK_SIZE] if with_tfs else (1,)
+        tfs_size = sum(_varint_size(tf) for tf in block_tfs) if with_tfs else 0
+        min_length = min(doc_lengths.get(doc_id, 0) for doc_id in ids)
+        for value in (ids[-1] - previous, gaps_size, tfs_size, max(block_tfs), min_length):
+            _put_varint(out, value)
+        previous = ids[-1]
+    return bytes(out)
+
+
+def decode_skips(data, skips):
+    """
+    Decode the skip table of postings list `data`.
+
+    Returns:
+        List of blocks (previous block's last doc id, last doc id,
+        position of the gaps, position of the frequencies or None, number
+        of postings, highest frequency, shortest document length)
+    """
+    count, pos = _get_varint(data, 0)
+    fields = list(_iter_varints(skips, 0, 5 * -(-count // BLOCK_SIZE)))
+    tfs_pos = pos + sum(fields[1::5])
+    with_tfs = any(fields[2::5])
+    blocks = []
+    last = 0
+    for i in range(0, len(fields), 5):
+        delta, gaps_size, tfs_size, max_tf, min_length = fields[i:i + 5]
+        size = min(BLOCK_SIZE, count - len(blocks) * BLOCK_SIZE)
+        blocks.append((last, last + delta, pos, tfs_pos if with_tfs else None, size, max_tf, min_length))
+        last += delta
+        pos += gaps_size
+        tfs_pos += tfs_size
+    return blocks
+
+
+def decode_block(data, block):
+    """Decode one block (from decode_skips) of a postings list into lists of doc ids and term frequencies."""
+    base, _, gaps_pos, tfs_pos, size = block[:5]
+    doc_ids = list(accumulate(_iter_varints(data, gaps_pos, size), initial=base))[1:]
+    tfs = list(_iter_varints(data, tfs_pos, size)) if tfs_pos is not None else [1] * size
+    return doc_ids, tfs
+
+
+def encode_positions(position_lists):
+    """
+    Compress the positions of a term's postings.
+
+    Args:
+        position_lists: One sorted list of positions per posting, in postings order
+
+    Returns:
+        bytes
+    """
+    out = bytearray()
+    for positions in position_lists:
+        _put_varints(out, [b - a for a, b in zip(chain((0,), positions), positions)])
+    return bytes(out)
+
+
+def decode_positions(data, tfs):
+    """Decode the positions of all postings (with frequencies tfs) into one list of positions per posting."""
+    position_lists = []
+    pos = 0
+    for tf in tfs:
+        position_lists.append(list(accumulate(_iter_varints(data, pos, tf))))
+        pos = _skip_varints(data, pos, tf)
+    return position_lists
+
+
+def positions_of(data, postings, doc_ids):
+    """
+    Yield (doc_id, positions) for the doc ids (a set) found in a postings
+    list, decoding only their positions.
+
+    Args:
+        data: Encoded positions of the postings list
+        postings: The postings list
+        doc_ids: Set of the doc ids wanted
+    """
+    pos = 0
+    skip = 0  # positions of the postings passed since pos
+    for doc_id, tf in zip(*decode_postings_tf(postings)):
+        if doc_id in doc_ids:
+            pos = _skip_varints(data, pos, skip)
+            yield doc_id, list(accumulate(_iter_varints(data, pos, tf)))
+            skip = tf
+        else:
+            skip += tf
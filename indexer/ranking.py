@@ -0,0 +1,181 @@
+"""
+BM25 scoring and top-k query evaluation.
+
+top_k evaluates OR queries with block-max dynamic pruning, in the spirit
+of Block-Max WAND (Ding & Suel, 2011) and MaxScore: the doc id space is
+walked in windows that end where the first of the terms' current blocks
+ends, so each term has one block in a window. The skip tables (see
+postings.py) give a score bound for every block without decoding it:
+
+  - a window whose block bounds add up to no more than the score of the
+    current k-th result is skipped without decoding anything;
+  - otherwise the terms with the lowest bounds, whose bounds together stay
+    below that score, are non-essential: only documents of the other terms
+    are candidates, and a non-essential block is only decoded if some
+    candidate can still beat the k-th result with it.
+
+Windows are scored a block at a time rather than a document at a time,
+which keeps the interpreter overhead per document low. A block's highest
+term frequency and shortest document length bound the BM25 score of each
+of its documents for any average document length, so the bounds stay
+valid as documents are added.
+"""
+import math
+import heapq
+from bisect import bisect_left, bisect_right
+from operator import attrgetter, methodcaller
+
+from postings import decode_postings_tf, decode_skips, decode_block
+
+# BM25 parameters: how quickly repeated occurrences of a term stop adding
+# to a document's score (K1), and how much long documents are penalized (B)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Bounds are raised by this factor before comparing them to a score, so
+# float rounding never puts a bound below a score it bounds
+_BOUND_SLACK = 1 + 1e-9
+
+
+def bm25_idf(doc_count, df):
+    return math.log(1 + (doc_count - df + 0.5) / (df + 0.5))
+
+
+def bm25_term_score(idf, tf, norm):
+    """A term's contribution to a document's score; norm is LengthNorms.get(doc_id)."""
+    return idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+
+class LengthNorms:
+    """BM25 document length normalization of each doc id, computed once per query."""
+
+    def __init__(self, doc_lengths, avg_length):
+        self.doc_lengths = doc_lengths
+        self.avg_length = avg_length
+        self.norms = {}
+
+    def of_length(self, length):
+        return BM25_K1 * (1 - BM25_B + BM25_B * length / self.avg_length)
+
+    def get(self, doc_id):
+        norm = self.norms.get(doc_id)
+        if norm is None:
+            # Documents of unknown length (indexes saved before lengths were stored) count as average
+            norm = self.norms[doc_id] = self.of_length(self.doc_lengths.get(doc_id, self.avg_length))
+        return norm
+
+
+class Cursor:
+    """
+    One query term's postings list, read block by block in doc id order.
+    A list with a skip table is decoded one block at a time as windows
+    reach it; a short list is decoded whole and its bound is exact.
+    """
+
+    def __init__(self, order, idf, data, skips, norms):
+        self.order = order  # position of the term in the query
+        self.idf = idf
+        self.data = data
+        self.norms = norms
+        if skips is not None:
+            self.blocks = decode_skips(data, skips)
+            self.bounds = [bm25_term_score(idf, block[5], norms.of_length(block[6])) for block in self.blocks]
+            self.decoded = None
+        else:
+            doc_ids, tfs = decode_postings_tf(data)
+            self.blocks = [(0, doc_ids[-1])]
+            self.bounds = [max(bm25_term_score(idf, tf, norms.get(doc_id)) for doc_id, tf in zip(doc_ids, tfs))]
+            self.decoded = (list(doc_ids), list(tfs))
+        self.last_docs = [block[1] for block in self.blocks]
+        self.block = 0
+        self.decoded_block = 0
+
+    def seek(self, doc):
+        """Move to the block that would hold doc; returns False past the last block."""
+        self.block = bisect_left(self.last_docs, doc, self.block)
+        return self.block < len(self.blocks)
+
+    def bound(self):
+        return self.bounds[self.block]
+
+    def last_doc(self):
+        return self.last_docs[self.block]
+
+    def postings(self, first, last):
+        """(doc ids, term frequencies) of the current block between first and last."""
+        if self.decoded is None or self.decoded_block != self.block:
+            self.decoded = decode_block(self.data, self.blocks[self.block])
+            self.decoded_block = self.block
+        doc_ids, tfs = self.decoded
+        start = bisect_left(doc_ids, first)
+        end = bisect_right(doc_ids, last, start)
+        return doc_ids[start:end], tfs[start:end]
+
+
+def top_k(cursors, k):
+    """
+    The k best documents matching any of the cursors' terms (see the module docstring).
+
+    Args:
+        cursors: One Cursor per query term, in query order
+        k: Number of results
+
+    Returns:
+        [(doc_id, score), ...] best first; ties go to the lower doc id
+    """
+    heap = []  # (score, -doc_id) of the best k so far, worst first
+    threshold = -1.0  # a document must score above this to enter the top k
+    by_bound = methodcaller('bound')
+    by_order = attrgetter('order')
+    first = 0
+    while True:
+        cursors = [cursor for cursor in cursors if cursor.seek(first)]
+        if not cursors:
+            break
+        last = min(cursor.last_doc() for cursor in cursors)
+
+        if may_exceed(sum(cursor.bound() for cursor in cursors), threshold):
+            # Non-essential terms: the lowest bounds, as long as they add up to no more than the threshold
+            cursors.sort(key=by_bound)
+            rest = 0.0
+            split = 0
+            while split < len(cursors) - 1 and not may_exceed(rest + cursors[split].bound(), threshold):
+                rest += cursors[split].bound()
+                split += 1
+            essential = sorted(cursors[split:], key=by_order)
+            non_essential = cursors[:split]
+
+            # Candidates and their scores from the essential terms, summed in query order
+            partial = {}
+            for cursor in essential:
+                for doc, tf in zip(*cursor.postings(first, last)):
+                    partial[doc] = partial.get(doc, 0.0) + bm25_term_score(cursor.idf, tf, cursor.norms.get(doc))
+            candidates = sorted(doc for doc, score in partial.items() if may_exceed(score + rest, threshold))
+
+            if candidates:
+                if non_essential:
+                    # Rescore in query order, so scores are the same as when every match is scored
+                    scores = dict.fromkeys(candidates, 0.0)
+                    for cursor in sorted(cursors, key=by_order):
+                        for doc, tf in zip(*cursor.postings(first, last)):
+                            if doc in scores:
+                                scores[doc] += bm25_term_score(cursor.idf, tf, cursor.norms.get(doc))
+                else:
+                    scores = partial
+                for doc in candidates:
+                    score = scores[doc]
+                    if score > threshold:
+                        if len(heap) < k:
+                            heapq.heappush(heap, (score, -doc))
+                        else:
+                            heapq.heapreplace(heap, (score, -doc))
+                        if len(heap) == k:
+                            threshold = heap[0][0]
+        first = last + 1
+
+    return [(-negative_doc, score) for score, negative_doc in sorted(heap, reverse=True)]
+
+
+def may_exceed(bound, threshold):
+    """Whether a score bound (a sum of term scores) leaves room for a score above threshold, allowing for rounding."""
+    return bound * _BOUND_SLACK > threshold
@@ -9,10 +9,17 @@ Query syntax:
     - Multiple words (AND): "python programming"
     - OR query: "python OR java"
     - Explicit AND: "python AND programming"
+    - Phrase: '"machine learning"' (needs an index built with --positions)
+    - Proximity: "python NEAR/5 tutorial", the words at most 5 words apart
+      (needs an index built with --positions)
+
+Results are ranked by BM25.
 """
+import re
 import sys
 import os
 from build_index import InvertedIndex
+from preprocessing import tokenize
 
 
 def parse_query(query_string):
@@ -20,10 +27,23 @@ def parse_query(query_string):
     Parse query string and determine query type.
     
     Returns:
-        (query_type, terms) where query_type is 'AND' or 'OR'
+        (query_type, terms) where query_type is 'SINGLE', 'AND', 'OR',
+        'PHRASE' (terms are the phrases, and the other words, which must
+        all match) or 'NEAR' (terms are the two words and the distance)
     """
     query_string = query_string.strip()
     
+    # Check for phrases in double quotes
+    if '"' in query_string:
+        phrases = re.findall(r'"([^"]*)"', query_string)
+        words = re.sub(r'"[^"]*"', ' ', query_string).replace('"', ' ').lower().split()
+        return 'PHRASE', [phrase.lower() for phrase in phrases if phrase.strip()] + words
+    
+    # Check for proximity: word NEAR/k word
+    match = re.fullmatch(r'(\S+)\s+NEAR/(\d+)\s+(\S+)', query_string, re.IGNORECASE)
+    if match:
+        return 'NEAR', [match.group(1).lower(), match.group(3).lower(), int(match.group(2))]
+    
     # Check for explicit OR
     if ' OR ' in query_string.upper():
         terms = [term.strip().lower() for term in query_string.upper().split(' OR ')]
@@ -42,29 +62,29 @@ def parse_query(query_string):
         return 'SINGLE', terms
 
 
-def display_results(index, doc_ids, max_results=10):
-    """Display search results."""
-    if not doc_ids:
+def display_results(index, results):
+    """Display ranked search results, given as (doc_id, score) best first."""
+    if not results:
         print("\nNo results found.")
         return
     
-    print(f"\nFound {len(doc_ids)} documents:")
+    print(f"\nTop {len(results)} documents:")
     print("=" * 80)
     
-    for i, doc_id in enumerate(sorted(doc_ids)[:max_results]):
+    for i, (doc_id, score) in enumerate(results):
         doc = index.get_document(doc_id)
         if doc:
-            print(f"\n{i+1}. [Doc {doc_id}] {doc['title']}")
+            print(f"\n{i+1}. [Doc {doc_id}] {doc['title']} (score {score:.2f})")
             print(f"   URL: {doc['url']}")
             print(f"   Snippet: {doc['content'][:150]}...")
-    
-    if len(doc_ids) > max_results:
-        print(f"\n... and {len(doc_ids) - max_results} more results.")
 
 
 def main():
     # Check if index exists
-    index_file = os.path.join(os.path.dirname(__file__), 'inverted_index.pkl')
+    index_file = os.path.join(os.path.dirname(__file__), 'inverted_index')
+    if not os.path.exists(index_file):
+        # Index built by an older version
+        index_file += '.pkl'
     
     if not os.path.exists(index_file):
         print("Error: Index not found!")
@@ -82,6 +102,8 @@ def main():
     print("  - Single word: 'python'")
     print("  - AND query (all words): 'python programming'")
     print("  - OR query (any word): 'python OR java'")
+    print("  - Phrase: '\"machine learning\"'")
+    print("  - Proximity (at most 5 words apart): 'python NEAR/5 tutorial'")
     print("  - Type 'quit' or 'exit' to quit\n")
     
     # Interactive search loop
@@ -102,14 +124,21 @@ def main():
             print(f"\nQuery type: {query_type}")
             print(f"Terms: {terms}")
             
-            if query_type == 'SINGLE':
-                results = index.search(terms[0])
-            elif query_type == 'AND':
-                results = index.search_and(terms)
+            if query_type in ('SINGLE', 'AND'):
+                results = index.search_ranked(terms, require_all=True)
             elif query_type == 'OR':
-                results = index.search_or(terms)
+                results = index.search_ranked(terms)
+            elif query_type == 'PHRASE':
+                matches = None
+                for phrase in terms:
+                    found = index.search_phrase(phrase)
+                    matches = found if matches is None else matches & found
+                results = index.search_ranked(tokenize(' '.join(terms)), documents=matches or set())
+            elif query_type == 'NEAR':
+                word1, word2, distance = terms
+                results = index.search_ranked(tokenize(f'{word1} {word2}'), documents=index.search_near(word1, word2, distance))
             else:
-                results = set()
+                results = []
             
             display_results(index, results)
             
@@ -0,0 +1,72 @@
+"""
+Checks for the compressed postings lists and positions (postings.py).
+
+Run with: python test_postings.py
+"""
+import os
+import sys
+import random
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from postings import (encode_postings, decode_postings, decode_postings_tf, iter_postings, postings_count,
+                      encode_positions, decode_positions, positions_of)
+
+
+def random_postings(rng, count, spread):
+    """Sorted distinct doc ids and their term frequencies"""
+    doc_ids = array('I', sorted(rng.sample(range(count * spread), count)))
+    tfs = array('I', [rng.choice((1, 1, 2, 3, 200)) for _ in doc_ids])
+    return doc_ids, tfs
+
+
+def test_round_trip():
+    rng = random.Random(1)
+    for _ in range(500):
+        # Dense lists have one-byte gaps, sparse ones multi-byte gaps
+        doc_ids, tfs = random_postings(rng, rng.choice((1, 5, 127, 128, 129, 1000)), rng.choice((1, 3, 1000, 100000)))
+        data = encode_postings(doc_ids, tfs)
+        assert postings_count(data) == len(doc_ids)
+        assert decode_postings(data) == doc_ids
+        assert list(iter_postings(data)) == list(doc_ids)
+        assert decode_postings_tf(data) == (doc_ids, tfs)
+
+
+def test_without_frequencies():
+    doc_ids = array('I', [0, 1, 5, 300, 70000, 2 ** 32 - 1])
+    data = encode_postings(doc_ids)
+    # All frequencies 1 are left out, whether or not they are given
+    assert data == encode_postings(doc_ids, array('I', [1] * len(doc_ids)))
+    assert decode_postings_tf(data) == (doc_ids, array('I', [1] * len(doc_ids)))
+
+
+def test_empty_and_single():
+    assert decode_postings_tf(encode_postings(array('I'))) == (array('I'), array('I'))
+    assert postings_count(encode_postings(array('I'))) == 0
+    # One document: the count and one gap
+    assert len(encode_postings(array('I', [100]))) == 2
+    assert decode_postings(encode_postings(array('I', [100]))) == array('I', [100])
+
+
+def test_positions_round_trip():
+    rng = random.Random(2)
+    for _ in range(300):
+        doc_ids, _ = random_postings(rng, rng.choice((1, 5, 129, 300)), rng.choice((1, 1000)))
+        # As many sorted positions per posting as its term frequency, some far into the document
+        position_lists = [sorted(rng.sample(range(rng.choice((10, 100000))), rng.randint(1, 5))) for _ in doc_ids]
+        tfs = array('I', [len(positions) for positions in position_lists])
+        postings = encode_postings(doc_ids, tfs)
+        data = encode_positions(position_lists)
+        assert decode_positions(data, tfs) == position_lists
+
+        # Only the positions of the wanted documents
+        wanted = set(rng.sample(list(doc_ids), rng.randint(0, len(doc_ids))))
+        expected = {doc_id: positions for doc_id, positions in zip(doc_ids, position_lists) if doc_id in wanted}
+        assert dict(positions_of(data, postings, wanted)) == expected
+
+
+if __name__ == '__main__':
+    for test in (test_round_trip, test_without_frequencies, test_empty_and_single, test_positions_round_trip):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
@@ -0,0 +1,118 @@
+"""
+Checks for skip tables and block-max top-k ranking (postings.py, ranking.py).
+
+Builds a random corpus, so no crawled data is needed. Run with:
+python test_ranking.py
+"""
+import os
+import sys
+import random
+import shutil
+import tempfile
+from array import array
+from itertools import accumulate
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from build_index import InvertedIndex
+from postings import BLOCK_SIZE, encode_postings, encode_skips, decode_skips, decode_block
+
+
+def random_corpus(rng, documents=3000, vocabulary=3000):
+    """Documents of Zipf-distributed words: a few very common ones and a long tail of rare ones"""
+    words = [f'w{i}' for i in range(vocabulary)]
+    weights = list(accumulate(1 / (i + 1) for i in range(vocabulary)))
+    return [' '.join(rng.choices(words, cum_weights=weights, k=rng.randint(20, 300))) for _ in range(documents)]
+
+
+def random_query(rng):
+    """One to five words, each common, mid-frequency or rare"""
+    return [f'w{rng.choice((rng.randint(0, 10), rng.randint(10, 300), rng.randint(300, 2999)))}'
+            for _ in range(rng.randint(1, 5))]
+
+
+def test_skip_tables():
+    rng = random.Random(1)
+    for count in (BLOCK_SIZE + 1, 5 * BLOCK_SIZE, 1000):
+        doc_ids = array('I', sorted(rng.sample(range(count * rng.choice((1, 2, 1000))), count)))
+        tfs = array('I', [rng.choice((1, 1, 2, 200)) for _ in doc_ids])
+        lengths = {doc_id: rng.randint(1, 500) for doc_id in doc_ids}
+        data = encode_postings(doc_ids, tfs)
+        blocks = decode_skips(data, encode_skips(doc_ids, tfs, lengths))
+        assert len(blocks) == -(-count // BLOCK_SIZE)
+
+        for i, block in enumerate(blocks):
+            block_ids, block_tfs = decode_block(data, block)
+            start = i * BLOCK_SIZE
+            assert block_ids == list(doc_ids[start:start + BLOCK_SIZE])
+            assert block_tfs == list(tfs[start:start + BLOCK_SIZE])
+            # Last doc id, highest frequency and shortest length bound the block
+            assert block[1] == block_ids[-1]
+            assert block[5] == max(block_tfs)
+            assert block[6] == min(lengths[doc_id] for doc_id in block_ids)
+
+
+def check_top_k(index, rng, queries=300):
+    for _ in range(queries):
+        terms = random_query(rng)
+        k = rng.choice((1, 3, 10, 50))
+        assert index.search_ranked(terms, k=k) == index.search_ranked(terms, k=k, exhaustive=True), (terms, k)
+
+
+def test_top_k_matches_exhaustive():
+    rng = random.Random(2)
+    corpus = random_corpus(rng)
+    directory = tempfile.mkdtemp()
+    try:
+        for positions in (False, True):
+            index = InvertedIndex(positions=positions)
+            for doc_id, text in enumerate(corpus):
+                index.add_document(doc_id, f'http://example.com/{doc_id}', f'Doc {doc_id}', text)
+            check_top_k(index, rng)
+
+            # The same through the memory-mapped index directory
+            path = os.path.join(directory, f'index-{positions}')
+            index.save(path)
+            loaded = InvertedIndex()
+            loaded.load(path)
+            check_top_k(loaded, rng)
+            loaded.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+def test_duplicate_doc_id_rejected():
+    index = InvertedIndex()
+    index.add_document(1, 'http://example.com/1', 'One', 'crawler index ranking')
+    index.add_document(2, 'http://example.com/2', 'Two', 'crawler')
+    try:
+        index.add_document(1, 'http://example.com/1', 'One again', 'crawler crawler crawler')
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a duplicate doc id was accepted")
+    # Neither the collection statistics BM25 uses nor the postings count it twice
+    assert (index.doc_count, index.total_length) == (2, 4)
+    assert list(index.postings('crawler')) == [1, 2]
+    assert index.get_document(1)['title'] == 'One'
+
+
+def test_near_terms_normalized():
+    index = InvertedIndex(positions=True)
+    index.add_document(1, 'http://example.com/1', 'One', 'Python is a great language for a web crawler.')
+    index.add_document(2, 'http://example.com/2', 'Two', 'Python ' + 'filler ' * 10 + 'crawler')
+    # Query words are tokenized like the documents and phrases
+    assert index.search_near('python', 'crawler', 8) == {1}
+    assert index.search_near('Python', 'Crawler,', 8) == {1}
+    assert index.search_near('"crawler"', 'PYTHON', 20) == {1, 2}
+    assert index.search_phrase('Web Crawler') == {1}
+    # A stopword or a term of several words matches nothing
+    assert index.search_near('the', 'crawler', 20) == set()
+    assert index.search_near('web-crawler', 'python', 20) == set()
+
+
+if __name__ == '__main__':
+    for test in (test_skip_tables, test_top_k_matches_exhaustive, test_duplicate_doc_id_rejected,
+                 test_near_terms_normalized):
+        test()
+        print(f"{test.__name__}: ok")
+    print("All tests completed!")
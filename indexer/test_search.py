@@ -7,7 +7,10 @@ import os
 
 def run_test_queries():
     # Load index
-    index_file = os.path.join(os.path.dirname(__file__), 'inverted_index.pkl')
+    index_file = os.path.join(os.path.dirname(__file__), 'inverted_index')
+    if not os.path.exists(index_file):
+        # Index built by an older version
+        index_file += '.pkl'
     index = InvertedIndex()
     index.load(index_file)
     
@@ -48,6 +51,27 @@ def run_test_queries():
     results = index.search('xyzabc123')
     print(f"   Results: {len(results)} documents")
     
+    # Test 6: Ranked query
+    print("\n6. Ranked query (BM25): 'aalborg university'")
+    results = index.search_ranked(['aalborg', 'university'], k=3)
+    for doc_id, score in results:
+        doc = index.get_document(doc_id)
+        print(f"   [{doc_id}] {score:.2f} {doc['title'][:60]}")
+    
+    # Test 7: Ranked OR query (Block-Max WAND) gives the same top 10 as scoring every match
+    print("\n7. Ranked OR query: 'python' OR 'java' OR 'data'")
+    results = index.search_ranked(['python', 'java', 'data'])
+    print(f"   Same as exhaustive: {results == index.search_ranked(['python', 'java', 'data'], exhaustive=True)}")
+
+    # Test 8: Phrase and proximity queries (only on an index built with --positions)
+    if index.with_positions:
+        print("\n8. Phrase query: \"aalborg university\"")
+        results = index.search_phrase('aalborg university')
+        print(f"   Results: {len(results)} documents")
+        print("\n9. Proximity query: aalborg NEAR/3 university")
+        results = index.search_near('aalborg', 'university', 3)
+        print(f"   Results: {len(results)} documents")
+
     print("\n" + "=" * 80)
     print("All tests completed!")
     print("=" * 80)